@@ -74,9 +74,10 @@ function btnFreeScroll() {
 var currentProgram = 'tracie';
 var allPrograms = ['avoid', 'tracie'];
 
-// Disables the specified program button and enables the rest.
+// Disables the specified program button and enables the rest. Programs without
+// a button (such as calib and seq) leave all the buttons enabled.
 function enableOtherPrograms(name) {
-	if (name != 'calib') {
+	if (allPrograms.indexOf(name) != -1) {
 		setEnabled('btnc-' + name, false);
 	}
 	for (var i = 0, len = allPrograms.length; i < len; i++) {
@@ -179,12 +180,24 @@ function send(message) {
 	});
 }
 
-// Requests the latest status from the server, adds the response to the console,
-// and repeats immediately. There is no delay because the server uses
+// Sequence number of the next status message to request (null for new ones).
+var statusCursor = null;
+
+// Requests the statuses after the cursor from the server, adds them to the
+// console, and repeats immediately. There is no delay because the server uses
 // long-polling, so the connection will stay open until there is a new status.
+// Since the cursor is kept here, no statuses are lost between requests.
 function updateStatus() {
-	post('long:status', function(text) {
-		addToConsole(text);
+	var cursor = (statusCursor === null) ? '' : String(statusCursor);
+	post('long:status:' + cursor, function(text) {
+		var data = JSON.parse(text);
+		if (data.missed > 0) {
+			addToConsole("missed " + data.missed + " statuses");
+		}
+		for (var i = 0, len = data.messages.length; i < len; i++) {
+			addToConsole(data.messages[i]);
+		}
+		statusCursor = data.cursor;
 		updateStatus();
 	}, updateStatus, updateStatus);
 }
@@ -216,6 +229,10 @@ function synchronize() {
 	})
 }
 
+// The robot to control, given by the URL fragment (for example, '#1' for the
+// second robot). It is empty for the first robot.
+var robot = window.location.hash.substring(1);
+
 // Sends data to the server via a POST request. Calls the onreceive function
 // with the response text as the argument when the request is completed. Calls
 // the onfail function with the response status if it is not 200 OK. Calls the
@@ -234,7 +251,7 @@ function post(data, onreceive, onfail, ontimeout) {
 			}
 		}
 	};
-	r.open('POST', '/', true);
+	r.open('POST', '/' + robot, true);
 	r.setRequestHeader('Content-type', 'application/json');
 	r.timeout = ajaxTimeout;
 	r.ontimeout = ontimeout;
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+from __future__ import print_function
+
+# The clients use the standard library's HTTP client, so its sockets have to
+# cooperate with gevent.
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import sys
+
+from scribbler.loadgen import (
+    PERCENTILES, launch_server, load_test, stop_server)
+from scribbler.programs.tracie import parse_points
+
+
+# Description for the usage message.
+DESC = "Measures how the server holds up with many browsers using it at once."
+
+# Drawing that the operator uploads if no other points file is given.
+DEFAULT_POINTS = '../demo/complex.json'
+
+# Backends that the launched server can run on, like BACKENDS in `main.py`.
+BACKENDS = ['gevent', 'asyncio']
+
+# Configure the arguments.
+parser = argparse.ArgumentParser(description=DESC)
+parser.add_argument(
+    '-c',
+    '--clients',
+    type=int,
+    default=100,
+    help="the number of simulated browsers"
+)
+parser.add_argument(
+    '-t',
+    '--duration',
+    type=float,
+    default=60,
+    help="how long to run the test (seconds)"
+)
+parser.add_argument(
+    '-r',
+    '--ramp',
+    type=float,
+    default=5,
+    help="spread the arrival of the clients over this many seconds"
+)
+parser.add_argument(
+    '-s',
+    '--host',
+    type=str,
+    default='localhost',
+    help="the host of the server"
+)
+parser.add_argument(
+    '-p',
+    '--port',
+    type=int,
+    default=8081,
+    help="the port of the server"
+)
+parser.add_argument(
+    '-e',
+    '--existing',
+    action='store_true',
+    help="test a server that is already running instead of starting one"
+)
+parser.add_argument(
+    '-w',
+    '--workers',
+    action='store_true',
+    help="run the robot in a worker process"
+)
+parser.add_argument(
+    '-k',
+    '--backend',
+    choices=BACKENDS,
+    default=BACKENDS[0],
+    help="launch the server on this backend"
+)
+parser.add_argument(
+    '--python',
+    type=str,
+    help="launch the server with this Python interpreter (asyncio needs 3)"
+)
+parser.add_argument(
+    '--robots',
+    type=int,
+    default=1,
+    help="spread the clients across this many robots on the server"
+)
+parser.add_argument(
+    '--points',
+    type=str,
+    default=DEFAULT_POINTS,
+    help="the drawing that the operator uploads"
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    type=str,
+    help="also save the report to this JSON file, for comparing runs"
+)
+
+# Go to this directory to make the relative paths work.
+script_dir = os.path.dirname(sys.argv[0])
+if script_dir:
+    os.chdir(script_dir)
+
+# Parse the command-line arguments.
+args = parser.parse_args()
+if args.backend == 'asyncio' and not args.python and not args.existing and \
+        sys.version_info[0] < 3:
+    sys.exit("error: the asyncio backend needs Python 3; pass --python")
+with open(args.points) as f:
+    points = parse_points(json.load(f))
+
+# Start the server with the dummy Myro library, unless testing an existing one.
+server = None
+pid = None
+if not args.existing:
+    try:
+        server = launch_server(args.port, args.workers, args.backend,
+                               args.python)
+    except RuntimeError as e:
+        sys.exit("error: " + str(e))
+    pid = server.pid
+
+print("Running {} clients for {:.0f} s...".format(args.clients, args.duration))
+try:
+    report = load_test(args.host, args.port, args.clients, args.duration,
+                       points, args.ramp, args.robots, pid)
+finally:
+    if server:
+        stop_server(server)
+
+# Report the latency of each kind of command.
+columns = ' '.join('{:>8}'.format('p{}'.format(p)) for p in PERCENTILES)
+print("{:<20} {:>7} {:>8} {:>6} {} {:>8}".format(
+    "command", "count", "req/s", "failed", columns, "max"))
+for name, c in sorted(report['commands'].items()):
+    values = ' '.join('{:8.1f}'.format(c['p{}'.format(p)]) for p in PERCENTILES)
+    print("{:<20} {:7d} {:8.1f} {:6d} {} {:8.1f}".format(
+        name, c['count'], c['rate'], c['failed'], values, c['max']))
+print("{} requests in {:.1f} s ({:.1f} req/s); latencies in ms".format(
+    report['requests'], report['elapsed'], report['rate']))
+print("peak requests in flight: {}".format(report['in_flight']))
+if report['sockets'] is not None:
+    print("peak server sockets: {}".format(report['sockets']))
+if report['memory_start'] is not None:
+    print("server memory: {} KiB at start, {} KiB at end, {} KiB peak".format(
+        report['memory_start'], report['memory_end'], report['memory_peak']))
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
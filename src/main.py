@@ -7,8 +7,10 @@ from __future__ import print_function
 import argparse
 import os
 import sys
-import __builtin__
 
+from scribbler.controller import Controller
+from scribbler.link import supervise
+from scribbler.sensors import SAMPLE_RATE
 from scribbler.server import Server
 
 import template
@@ -20,6 +22,9 @@ DESC = "Starts the Scribbler Bot server."
 # All web resources are in the public folder.
 PUBLIC = '../public'
 
+# Concurrency backends that can run the server and the controllers.
+BACKENDS = ['gevent', 'asyncio']
+
 # Requests for any paths other than these will 404.
 WHITELIST = [
     '/', '/index.html', '/404.html', '/style.css',
@@ -52,8 +57,22 @@ parser.add_argument(
     '-b',
     '--bluetooth',
     type=str,
-    default='/dev/tty.Fluke2-0530-Fluke2',
-    help="the Scribbler is on this Bluetooth serial port"
+    nargs='+',
+    default=['/dev/tty.Fluke2-0530-Fluke2'],
+    help="the Scribblers are on these Bluetooth serial ports"
+)
+parser.add_argument(
+    '-w',
+    '--workers',
+    action='store_true',
+    help="run each robot in its own process (implied by several ports)"
+)
+parser.add_argument(
+    '-r',
+    '--samplerate',
+    type=float,
+    default=SAMPLE_RATE,
+    help="sample the obstacle sensors this many times per second"
 )
 parser.add_argument(
     '-d',
@@ -61,6 +80,19 @@ parser.add_argument(
     action='store_true',
     help="use a dummy Myro library"
 )
+parser.add_argument(
+    '-j',
+    '--nojournal',
+    action='store_true',
+    help="don't journal the robots' state or restore it on startup"
+)
+parser.add_argument(
+    '-k',
+    '--backend',
+    choices=BACKENDS,
+    default=BACKENDS[0],
+    help="run the server on this backend (asyncio needs Python 3)"
+)
 
 # Go to this directory to make the relative paths work.
 script_dir = os.path.dirname(sys.argv[0])
@@ -78,19 +110,52 @@ if any([not os.path.exists(PUBLIC + p) for p in WHITELIST]):
     print("error: missing files in /public", file=sys.stderr)
     sys.exit(1)
 
-# Import Myro, or the dummy version.
-if args.dummymyro:
-    import scribbler.programs.nomyro as myro
-else:
-    import myro
-
-# This is an ugly hack. I know.
-__builtin__.myro = myro
+workers = args.workers or len(args.bluetooth) > 1
+if workers and args.backend == 'asyncio':
+    print("error: the asyncio backend can't run workers", file=sys.stderr)
+    sys.exit(1)
 
-# Start Myro
-myro.initialize(args.bluetooth)
+if workers:
+    # Each worker process imports and starts Myro for its own robot.
+    from scribbler.worker import RemoteController
+    controllers = [
+        RemoteController(port, args.dummymyro, args.samplerate,
+                         not args.nojournal)
+        for port in args.bluetooth
+    ]
+else:
+    # Import Myro, or the dummy version.
+    if args.dummymyro:
+        import scribbler.programs.nomyro as myro
+    else:
+        import myro
+
+    if args.backend == 'asyncio':
+        # The asyncio backend needs Python 3, so it is only imported here. It
+        # makes Myro a builtin without supervising the link.
+        from scribbler import aio
+        loop = aio.new_event_loop()
+        aio.install(myro, args.bluetooth[0])
+        controllers = [aio.AsyncController(sample_rate=args.samplerate,
+                                           robot=args.bluetooth[0],
+                                           journal=not args.nojournal,
+                                           loop=loop)]
+    else:
+        # Start Myro behind a supervisor that reconnects if the link drops.
+        # This makes the supervisor a builtin, which is an ugly hack. I know.
+        supervise(myro, args.bluetooth[0])
+
+        # The robot's calibration profile is named after its port.
+        controllers = [Controller(sample_rate=args.samplerate,
+                                  robot=args.bluetooth[0],
+                                  journal=not args.nojournal)]
 
 # Start the server.
-server = Server(args.host, args.port, PUBLIC, WHITELIST)
+if args.backend == 'asyncio':
+    server = aio.AsyncServer(args.host, args.port, PUBLIC, WHITELIST,
+                             args.samplerate, controllers, loop)
+else:
+    server = Server(args.host, args.port, PUBLIC, WHITELIST, args.samplerate,
+                    controllers)
 server.start(not args.nobrowser)
 server.stay_alive()
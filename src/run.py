@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import sys
+import time
+
+try:
+    import __builtin__
+except ImportError:
+    import builtins as __builtin__
+
+from scribbler import profiles
+from scribbler.battery import BATTERY_INTERVAL, BatterySampler, VoltageModel
+from scribbler.programs import avoider, calib, sequential, tracie
+from scribbler.sim import SimClock, SimRobot, install
+from scribbler.tuner import DEFAULT_OBSTACLE, TICK
+
+
+# Description for the usage message.
+DESC = "Runs a Scribbler program to completion without the web app."
+
+# Map program IDs to their respective classes. This should have the same
+# programs as PROGRAMS in the controller, which can't be imported here because
+# it depends on gevent.
+PROGRAMS = {
+    'avoid': avoider.Avoider,
+    'calib': calib.Calib,
+    'seq': sequential.SeqProgram,
+    'tracie': tracie.Tracie
+}
+
+# Exit status when the program doesn't finish before the time limit.
+TIMED_OUT = 2
+
+# Shortest wait between iterations (seconds), so that the simulated clock
+# always moves forward when waiting for a mode to end.
+MIN_WAIT = 0.0001
+
+# Configure the arguments.
+parser = argparse.ArgumentParser(description=DESC)
+parser.add_argument(
+    'program',
+    choices=sorted(PROGRAMS),
+    help="the program to run"
+)
+parser.add_argument(
+    '-p',
+    '--param',
+    action='append',
+    default=[],
+    help="set a parameter before starting, like s=0.5"
+)
+parser.add_argument(
+    '-c',
+    '--command',
+    action='append',
+    default=[],
+    help="send a command before starting, like use:bounce or map:load"
+)
+parser.add_argument(
+    '--points',
+    type=str,
+    help="the drawing for Tracie (saved from the drawing view)"
+)
+parser.add_argument(
+    '-i',
+    '--image',
+    type=str,
+    help="an image for Tracie to trace instead of a points file"
+)
+parser.add_argument(
+    '-g',
+    '--svg',
+    type=str,
+    help="an SVG drawing for Tracie instead of a points file"
+)
+parser.add_argument(
+    '-j',
+    '--jobs',
+    type=str,
+    help="a JSON list of jobs for Tracie to draw one after another"
+)
+parser.add_argument(
+    '-t',
+    '--timeout',
+    type=float,
+    default=600,
+    help="give up after this many seconds of robot time"
+)
+parser.add_argument(
+    '-v',
+    '--preview',
+    type=str,
+    help="write a preview of tracie's drawing to this SVG or PNG file and "
+         "exit without running it (noise from -n)"
+)
+parser.add_argument(
+    '-b',
+    '--bluetooth',
+    type=str,
+    default='/dev/tty.Fluke2-0530-Fluke2',
+    help="the Scribbler is on this Bluetooth serial port"
+)
+parser.add_argument(
+    '-d',
+    '--dummymyro',
+    action='store_true',
+    help="use a dummy Myro library"
+)
+parser.add_argument(
+    '-m',
+    '--simulate',
+    action='store_true',
+    help="run on a simulated robot as fast as possible"
+)
+parser.add_argument(
+    '-n',
+    '--noise',
+    type=float,
+    default=0.0,
+    help="relative standard deviation of the simulated motor noise"
+)
+parser.add_argument(
+    '--drain',
+    type=float,
+    default=0.0,
+    help="drain the simulated battery by this many volts per hour"
+)
+parser.add_argument(
+    '-o',
+    '--obstacle',
+    action='append',
+    default=[],
+    help="add a simulated obstacle x0,y0,x1,y1 (cm)"
+)
+
+# Parse the command-line arguments.
+args = parser.parse_args()
+drawings = (args.points, args.image, args.svg, args.jobs)
+if args.program == 'tracie' and not any(drawings):
+    sys.exit("error: tracie needs points, an image, an SVG file, or jobs")
+try:
+    obstacles = [tuple(float(v) for v in o.split(',')) for o in args.obstacle]
+except ValueError as e:
+    sys.exit("error: bad obstacle: {}".format(e))
+if args.preview and args.program != 'tracie':
+    sys.exit("error: only tracie can preview its drawing")
+if args.simulate and args.program == 'avoid' and not obstacles:
+    obstacles = [DEFAULT_OBSTACLE]
+
+# Set up the robot and the clock. A preview doesn't need the robot.
+if args.simulate or args.preview:
+    clock = SimClock()
+    robot = SimRobot(clock, obstacles=obstacles, noise=args.noise,
+                     drain=args.drain / 3600)
+    install(robot)
+    now = clock.time
+    wait = clock.advance
+else:
+    # Import Myro, or the dummy version.
+    if args.dummymyro:
+        import scribbler.programs.nomyro as myro
+    else:
+        import myro
+    __builtin__.myro = myro
+    myro.initialize(args.bluetooth)
+    now = time.time
+    wait = time.sleep
+
+# Create the program and apply the settings. A real robot uses the calibrated
+# parameters in its profile (named after its port), and its calibration is
+# saved there.
+program = PROGRAMS[args.program]()
+program.clock = now
+program.battery = BatterySampler()
+if not args.simulate:
+    program.robot = args.bluetooth
+    profiles.apply(program, args.bluetooth)
+else:
+    # The default parameters hold for the simulated robot's full battery.
+    program.voltage_model = VoltageModel(robot.battery)
+commands = ['set:' + p for p in args.param] + args.command
+if args.points:
+    with open(args.points) as f:
+        commands.append(tracie.POINTS_PREFIX + f.read())
+if args.image:
+    with open(args.image, 'rb') as f:
+        commands.append(tracie.IMAGE_PREFIX + base64.b64encode(f.read()))
+if args.svg:
+    with open(args.svg) as f:
+        commands.append(tracie.SVG_PREFIX + f.read())
+if args.jobs:
+    with open(args.jobs) as f:
+        jobs = json.load(f)
+    commands.extend(tracie.JOB_PREFIX + json.dumps(job) for job in jobs)
+for command in commands:
+    status = program(command)
+    if status:
+        print(status)
+reason = program.no_start()
+if reason:
+    sys.exit("error: " + reason)
+
+# Write the preview instead of running the program.
+if args.preview:
+    fmt = 'png' if args.preview.lower().endswith('.png') else 'svg'
+    result = program.preview_drawing({'fmt': fmt, 'noise': args.noise})
+    if not isinstance(result, dict):
+        sys.exit("error: " + result)
+    image = result['image']
+    with open(args.preview, 'wb') as f:
+        f.write(base64.b64decode(image) if fmt == 'png'
+                else image.encode('utf-8'))
+    print(json.dumps(result['stats'], indent=2, sort_keys=True))
+    sys.exit()
+
+# Run the program until it finishes, printing the statuses as they come.
+wall_start = time.time()
+start = now()
+program.battery.sample()
+next_sample = start + BATTERY_INTERVAL
+program.start()
+finished = False
+try:
+    while now() - start < args.timeout:
+        # Sample the battery every so often, like the controller.
+        if now() >= next_sample:
+            program.battery.sample()
+            next_sample += BATTERY_INTERVAL
+        status = program.loop()
+        if status:
+            print("[{:8.2f}] {}".format(now() - start, status))
+        if program.finished(status):
+            finished = True
+            break
+        # Wake up when the mode is due to end, like the controller.
+        deadline = program.deadline
+        if deadline is None:
+            wait(TICK)
+        else:
+            wait(max(MIN_WAIT, min(TICK, deadline - now())))
+except KeyboardInterrupt:
+    pass
+finally:
+    program.stop()
+
+elapsed = now() - start
+wall = time.time() - wall_start
+if finished:
+    print("finished in {:.2f} s ({:.2f} s wall)".format(elapsed, wall))
+else:
+    print("stopped after {:.2f} s ({:.2f} s wall)".format(elapsed, wall))
+    sys.exit(TIMED_OUT)
@@ -0,0 +1,455 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Runs the server and the controllers on asyncio instead of gevent.
+
+This module needs Python 3. It is only imported when the asyncio backend is
+chosen, so the gevent backend keeps working without it (and this backend works
+without gevent). The program code is the same for both: each controller runs
+its program, its sensor sampling, and the commands that change its state in a
+thread of its own, so the blocking Myro calls never hold up the event loop.
+"""
+
+import asyncio
+import builtins
+import json
+import traceback
+import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from sys import exit
+from time import time
+
+from scribbler import profiler, protocol
+from scribbler.battery import BATTERY_INTERVAL, BatterySampler
+from scribbler.controller import (
+    DEFAULT_PROGRAM, PRIORITY, PRIORITY_TIMEOUT, PROFILE_PREFIX, START_DELAY,
+    STATUS_POLL_TIMEOUT, STATUS_PREFIX, STOP_LATENCY, BaseController,
+    parse_cursor, parse_profile, priority_queued, show_lines, status_reply)
+from scribbler.link import LinkDown
+from scribbler.protocol import QUEUED, WAITING, Failure, command
+from scribbler.sensors import SAMPLE_RATE, Sampler
+from scribbler.server import (
+    PLAN_PREFIX, STATUS_204, STATUS_404, STATUS_500, BaseServer,
+    broadcast_reply, get_mime, get_status, headers, plan_reply)
+from scribbler.statuslog import StatusLog
+
+
+# Longest that a keep-alive connection may sit idle (seconds).
+IDLE_TIMEOUT = 60.0
+
+# Longest that the headers of a request may take to arrive (seconds).
+HEADER_TIMEOUT = 10.0
+
+# HTTP versions that keep connections open unless told otherwise.
+KEEP_ALIVE_VERSIONS = ('HTTP/1.1',)
+
+
+def new_event_loop():
+    """Creates an event loop and makes it the current one, so that the
+    controllers and the server use it by default."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def install(backend, port):
+    """Connects to the robot on the given Bluetooth port and makes programs use
+    the backend (the Myro module or a stand-in) as Myro. The link isn't
+    supervised, since the supervisor is built on gevent."""
+    backend.initialize(port)
+    builtins.myro = backend
+
+
+class AsyncStatusLog(StatusLog):
+
+    """A status log whose readers wait on the event loop. Messages can be put
+    from any thread."""
+
+    event_class = asyncio.Event
+
+    def __init__(self, loop):
+        self.loop = loop
+        StatusLog.__init__(self)
+
+    def put(self, msg):
+        """Appends a message on the event loop's thread, since the controller's
+        thread puts most of them."""
+        self.loop.call_soon_threadsafe(StatusLog.put, self, msg)
+
+    async def read(self, cursor=None, timeout=None):
+        """Like StatusLog.read, but waits without blocking the event loop."""
+        cursor = self.start(cursor)
+        if cursor == self.next_seq:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.collect(cursor)
+
+
+class AsyncSampler(Sampler):
+
+    """A sampler that runs as a task on the event loop, taking each sample in
+    the controller's thread. It can be started and stopped from any thread."""
+
+    def __init__(self, rate, loop, executor):
+        Sampler.__init__(self, rate)
+        self.loop = loop
+        self.executor = executor
+        self.task = None
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self.start_task)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stop_task)
+
+    def start_task(self):
+        """Starts sampling from scratch, if it is not already sampling."""
+        if self.task:
+            return
+        self.clear()
+        self.task = self.loop.create_task(self.run())
+
+    def stop_task(self):
+        """Stops sampling."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            t = time()
+            await self.loop.run_in_executor(self.executor, self.sample)
+            await asyncio.sleep(max(0, self.period - (time() - t)))
+
+
+class AsyncBatterySampler(AsyncSampler, BatterySampler):
+
+    """A battery sampler that runs as a task on the event loop, like
+    AsyncSampler."""
+
+    def __init__(self, loop, executor):
+        AsyncSampler.__init__(self, 1.0 / BATTERY_INTERVAL, loop, executor)
+
+
+class AsyncController(BaseController):
+
+    """Manages a program's main loop as a task on the event loop.
+
+    The program is only ever touched by the controller's own thread: the main
+    loop runs each iteration there, and the actor task performs each command
+    there, one at a time. Stopping and resetting go in a priority lane ahead of
+    everything else, and commands that only read state are answered right away
+    on the event loop.
+    """
+
+    def __init__(self, program_id=DEFAULT_PROGRAM, sample_rate=SAMPLE_RATE,
+                 robot=None, journal=False, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(1)
+        self.writer = ThreadPoolExecutor(1)
+        BaseController.__init__(self, program_id, sample_rate, robot, journal)
+        self.active = False # whether the program is running
+        self.task = None # the main loop, only touched on the event loop
+        self.inbox = asyncio.PriorityQueue()
+        self.sequence = count()
+        self.actor = self.loop.create_task(self.serve())
+
+    def new_log(self):
+        return AsyncStatusLog(self.loop)
+
+    def new_sampler(self, sample_rate):
+        return AsyncSampler(sample_rate, self.loop, self.executor)
+
+    def new_battery(self):
+        return AsyncBatterySampler(self.loop, self.executor)
+
+    @property
+    def running(self):
+        return self.active
+
+    def start(self):
+        BaseController.start(self)
+        self.active = True
+        self.loop.call_soon_threadsafe(self.start_loop)
+
+    def stop(self):
+        BaseController.stop(self)
+        self.active = False
+        self.loop.call_soon_threadsafe(self.stop_loop)
+
+    def close(self):
+        """Stops the program and the controller's thread. This must not be
+        called on the event loop's thread while the loop is running."""
+        self.executor.submit(self.stop).result()
+        self.battery.stop()
+        self.executor.shutdown()
+        self.writer.shutdown()
+
+    def start_loop(self):
+        """Starts the main loop task after START_DELAY."""
+        self.stop_loop()
+        self.task = self.loop.create_task(self.main_loop())
+
+    def stop_loop(self):
+        """Cancels the main loop task."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def main_loop(self):
+        """Runs the program's loop method continuously in the controller's
+        thread."""
+        await asyncio.sleep(START_DELAY)
+        while True:
+            delay = await self.loop.run_in_executor(self.executor, self.step)
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+
+    def in_background(self, fn, *args):
+        self.writer.submit(fn, *args)
+
+    def step(self):
+        """Runs one iteration of the program's loop and returns how long to
+        wait before the next, or returns None if the program was stopped after
+        the iteration was scheduled."""
+        if not self.active:
+            return None
+        return self.tick()
+
+    @command('long:status', show=show_lines, kind=WAITING, structured=False)
+    async def read_status(self, _):
+        """Like Controller.read_status, but waits on the event loop."""
+        msgs, _, _ = await self.messages.read(timeout=STATUS_POLL_TIMEOUT)
+        return msgs
+
+    @command(STATUS_PREFIX, show=json.dumps, kind=WAITING,
+             arg=('number', 'string', 'null'))
+    async def poll_status(self, cursor):
+        """Like Controller.poll_status, but waits on the event loop."""
+        try:
+            cursor = parse_cursor(cursor)
+        except (ValueError, TypeError):
+            return Failure("bad cursor: " + str(cursor))
+        msgs = await self.messages.read(cursor, STATUS_POLL_TIMEOUT)
+        return status_reply(*msgs)
+
+    @command(PROFILE_PREFIX, show=json.dumps, kind=WAITING,
+             arg=('number', 'string'))
+    async def profile(self, args):
+        """Like Controller.profile, but waits on the event loop."""
+        try:
+            seconds, allocations = parse_profile(args)
+        except ValueError as e:
+            return Failure("bad profile: {}".format(e))
+        if profiler.active:
+            return Failure("already profiling")
+        prof = profiler.Profile(allocations)
+        prof.start()
+        try:
+            await asyncio.sleep(profiler.limit(seconds))
+        finally:
+            prof.stop()
+        while not prof.done:
+            await asyncio.sleep(profiler.SAMPLE_INTERVAL)
+        return prof.results()
+
+    async def serve(self):
+        """Handles queued commands one at a time, forever."""
+        while True:
+            lane, _, arrived, command, result = await self.inbox.get()
+            try:
+                msg = await self.loop.run_in_executor(
+                    self.executor, self.perform, command, arrived)
+            except LinkDown as e:
+                msg = "lost link to robot: {}".format(e)
+            except Exception as e:
+                msg = e
+            # The client may have given up on the command by now.
+            if not result.done():
+                if isinstance(msg, Exception):
+                    result.set_exception(msg)
+                else:
+                    result.set_result(msg)
+            self.record_latency(lane, arrived)
+
+    def emergency_stop(self):
+        """Holds the main loop right away, and stops the motors from another
+        thread, without waiting for the actor or for the controller's thread.
+        Like Controller.emergency_stop, this leaves the program's state to the
+        queued priority command, and the hold lasts until a later start."""
+        self.held = time()
+        self.loop.run_in_executor(None, self.halt)
+        self.messages.put("emergency stop")
+
+    async def __call__(self, command):
+        """Accepts a command and either performs the desired action or passes
+        the message on to the program. Returns the reply."""
+        req = protocol.parse(command)
+        cmd, arg = protocol.lookup(self, req)
+        if cmd is not None and cmd.kind != QUEUED:
+            value = protocol.call(self, cmd, req, arg)
+            if asyncio.iscoroutine(value):
+                value = await value
+            return protocol.reply(cmd, req, value)
+        lane = self.lane(cmd)
+        result = self.loop.create_future()
+        self.inbox.put_nowait((lane, next(self.sequence), time(), req, result))
+        if lane == PRIORITY:
+            try:
+                return await asyncio.wait_for(asyncio.shield(result),
+                                              STOP_LATENCY)
+            except asyncio.TimeoutError:
+                self.emergency_stop()
+            try:
+                return await asyncio.wait_for(asyncio.shield(result),
+                                              PRIORITY_TIMEOUT)
+            except asyncio.TimeoutError:
+                return protocol.reply(cmd, req, priority_queued(cmd))
+        return await result
+
+
+async def read_request(reader):
+    """Reads an HTTP request from the stream. Returns its method, path, version,
+    headers (with lowercase names), and body, or None if the client closed the
+    connection. Raises ValueError if the request is malformed."""
+    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+    if not line:
+        return None
+    method, path, version = line.decode('latin-1').split()
+    head = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+        line = line.decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        head[name.strip().lower()] = value.strip()
+    length = int(head.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return method, path.partition('?')[0], version, head, body
+
+
+def keep_alive(version, head):
+    """Returns true if the connection should stay open after the request."""
+    connection = head.get('connection', '').lower()
+    if version in KEEP_ALIVE_VERSIONS:
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+class AsyncServer(BaseServer):
+
+    """A very simple web server running on asyncio, with keep-alive
+    connections."""
+
+    def __init__(self, host, port, root, whitelist, sample_rate=SAMPLE_RATE,
+                 controllers=None, loop=None):
+        """Create a server that serves from root on host:port (see BaseServer).
+        By default there is one AsyncController, sampling the robot's sensors
+        at `sample_rate` (Hz) while a program is running."""
+        self.loop = loop or asyncio.get_event_loop()
+        if controllers is None:
+            controllers = [AsyncController(sample_rate=sample_rate,
+                                           loop=self.loop)]
+        BaseServer.__init__(self, host, port, root, whitelist, controllers)
+        self.address = (host, port)
+        self.server = None
+
+    def start(self, open_browser=True, verbose=True):
+        """Starts the server if it is not already running. Unless False
+        arguments are passed, prints a message to standard output and opens the
+        browser to the served page."""
+        if self.running:
+            return
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle_connection, *self.address))
+        if verbose:
+            print("Serving on {}...".format(self.url))
+        if open_browser:
+            webbrowser.open(self.url)
+        self.running = True
+
+    def stop(self):
+        """Stops the programs and the server. Does nothing if already
+        stopped."""
+        if self.running:
+            for controller in self.controllers:
+                controller.close()
+            self.server.close()
+            self.running = False
+
+    def stay_alive(self):
+        """Runs the event loop forever. Only exits when a keyboard interrupt is
+        detected. The server must already be running."""
+        assert self.running
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            exit()
+
+    async def handle_connection(self, reader, writer):
+        """Handles the requests on a connection until it is closed."""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path_info, version, head, body = request
+                try:
+                    status, mime, data = await self.respond(method, path_info,
+                                                            body)
+                except Exception:
+                    # Like pywsgi, report the error and keep the connection.
+                    traceback.print_exc()
+                    status, mime, data = STATUS_500, get_mime(), b''
+                alive = keep_alive(version, head)
+                lines = ["{} {}".format(version, status)]
+                lines.extend("{}: {}".format(k, v)
+                             for k, v in headers(mime, len(data)))
+                if not alive:
+                    lines.append("Connection: close")
+                head = '\r\n'.join(lines) + '\r\n\r\n'
+                writer.write(head.encode('latin-1') + data)
+                await writer.drain()
+                if not alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, path_info, body):
+        """Handles a request. Returns the status, the MIME type, and the body
+        of the response."""
+        if method == 'GET':
+            path = self.path(path_info)
+            with open(path, 'rb') as f:
+                return get_status(path), get_mime(path), f.read()
+        controller = self.controller(path_info)
+        if method != 'POST' or not controller:
+            return STATUS_404, get_mime(), b''
+        msg = await controller(body.decode('utf-8'))
+        if msg is None:
+            return STATUS_204, get_mime(), b''
+        return get_status(), get_mime(), msg.encode('utf-8')
+
+    async def broadcast(self, command):
+        """Like Server.broadcast, but waits on the event loop."""
+        if command.startswith(PLAN_PREFIX):
+            return await self.plan(command[len(PLAN_PREFIX):])
+        replies = await asyncio.gather(*[c(command) for c in self.controllers])
+        return broadcast_reply(replies)
+
+    async def plan(self, data):
+        """Like Server.plan, but plans in the loop's default executor."""
+        commands = await self.loop.run_in_executor(None, self.plan_commands,
+                                                   data)
+        if isinstance(commands, str):
+            return commands
+        replies = [await controller(command) for controller, (_, command)
+                   in zip(self.controllers, commands)]
+        return plan_reply([robot for robot, _ in commands], replies)
@@ -0,0 +1,112 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tracks the battery voltage and corrects the conversion factors for it, since
+the robot slows down as its batteries run down."""
+
+from scribbler.link import LinkDown
+from scribbler.sensors import Sampler
+
+
+# Time between battery samples (seconds). The voltage changes slowly, and each
+# sample is a round trip to the robot.
+BATTERY_INTERVAL = 5.0
+
+# Lowest reading that is taken to be a real voltage (V).
+MIN_VOLTAGE = 1.0
+
+# Spread of voltages (V) that calibrations must cover for the model to be
+# fitted to them. Until then, the speed is taken to be proportional to the
+# voltage.
+MIN_SPREAD = 0.3
+
+# Largest factor by which a conversion factor is corrected, either way.
+MAX_CORRECTION = 1.5
+
+# The conversion factors that are corrected for the voltage.
+FACTORS = ('dist_to_time', 'angle_to_time')
+
+
+class BatterySampler(Sampler):
+
+    """Samples the battery voltage every few seconds in a Greenlet. The median
+    of the last few samples (see Sampler) rides out the dips when the motors
+    start."""
+
+    def __init__(self, interval=BATTERY_INTERVAL):
+        Sampler.__init__(self, 1.0 / interval)
+
+    @property
+    def voltage(self):
+        """Returns the filtered voltage, or None if there are no samples."""
+        return self.median if self.ready else None
+
+    def sample(self):
+        """Takes one sample, unless the link to the robot is down or the
+        reading isn't a voltage."""
+        try:
+            voltage = float(myro.getBattery())
+        except (LinkDown, TypeError, ValueError):
+            return
+        if voltage >= MIN_VOLTAGE:
+            self.add(voltage)
+
+
+def fit_stall(records, name):
+    """Fits the voltage at which the robot would stop to the calibrations in
+    the records, which have the voltage and the fitted conversion factor
+    `name`. The speed (the inverse of the factor) is assumed to be linear in
+    the voltage and is fitted by least squares. Returns zero (a speed
+    proportional to the voltage) if the voltages are too close together or
+    the fit makes no sense."""
+    pts = [(r['voltage'], 1.0 / r[name]) for r in records
+           if r.get('voltage') and r.get(name)]
+    if not pts:
+        return 0.0
+    vs = [v for v, _ in pts]
+    if max(vs) - min(vs) < MIN_SPREAD:
+        return 0.0
+    n = float(len(pts))
+    mv = sum(vs) / n
+    ms = sum(s for _, s in pts) / n
+    svv = sum((v - mv) ** 2 for v in vs)
+    slope = sum((v - mv) * (s - ms) for v, s in pts) / svv
+    if slope <= 0:
+        return 0.0
+    stall = mv - ms / slope
+    return max(0.0, min(stall, min(vs) - MIN_SPREAD))
+
+
+class VoltageModel(object):
+
+    """Predicts how the conversion factors change with the voltage.
+
+    The robot's speed is taken to be proportional to how far the voltage is
+    above the stall voltage, which is fitted to the past calibrations of each
+    factor. The factors in use were calibrated at the reference voltage, so
+    they are scaled by the ratio of the speed there to the speed now. Without
+    a reference, nothing is corrected.
+    """
+
+    def __init__(self, reference=None, records=()):
+        self.reference = reference
+        self.records = list(records)
+        self.stall = dict((name, fit_stall(records, name))
+                          for name in FACTORS)
+
+    def scale(self, name, voltage):
+        """Returns how much to scale the conversion factor `name` at the given
+        voltage (1 if either voltage is unknown)."""
+        if self.reference is None or voltage is None:
+            return 1.0
+        stall = self.stall.get(name, 0.0)
+        if voltage <= stall:
+            return MAX_CORRECTION
+        scale = (self.reference - stall) / (voltage - stall)
+        return min(MAX_CORRECTION, max(1.0 / MAX_CORRECTION, scale))
+
+
+def load_model(profile):
+    """Returns the voltage model for a robot's profile, which has the voltage
+    of the last calibration and the records of all the calibrations."""
+    return VoltageModel(profile.get('voltage'),
+                        profile.get('calibrations', []))
@@ -2,18 +2,38 @@
 
 """Mediates between the server and the currently executing program."""
 
+from __future__ import print_function
+
 import json
+from collections import OrderedDict
+from itertools import count
+from time import time
 
-from gevent import Greenlet, sleep
-from gevent.queue import Empty, Queue
+try:
+    from gevent import Greenlet, Timeout, get_hub, sleep, spawn
+    from gevent.event import AsyncResult
+    from gevent.queue import PriorityQueue
+    from gevent.threadpool import ThreadPool
+except ImportError:
+    Greenlet = Timeout = get_hub = sleep = spawn = None
+    AsyncResult = PriorityQueue = ThreadPool = None
 
-from scribbler.programs import avoider, calib, tracie
+from scribbler import profiler, profiles, protocol
+from scribbler.battery import BatterySampler
+from scribbler.journal import Journal
+from scribbler.link import LinkDown
+from scribbler.programs import avoider, calib, sequential, tracie
+from scribbler.protocol import IMMEDIATE, QUEUED, WAITING, Failure, command
+from scribbler.sensors import SAMPLE_RATE, Sampler
+from scribbler.statuslog import StatusLog
+from scribbler.timing import Timing
 
 
 # Map program IDs to their respective classes or functions.
 PROGRAMS = {
     'avoid': avoider.Avoider,
     'calib': calib.Calib,
+    'seq': sequential.SeqProgram,
     'tracie': tracie.Tracie
 }
 
@@ -23,44 +43,229 @@ DEFAULT_PROGRAM = 'tracie'
 # The prefix to a command which indicates a program switch.
 PROGRAM_PREFIX = 'program:'
 
-# Amount of time to sleep between main loop iterations (seconds).
+# The prefix to a status poll that carries the client's cursor into the log.
+STATUS_PREFIX = 'long:status:'
+
+# Amount of time to sleep between main loop iterations (seconds). The loop
+# wakes up sooner when the current mode is due to end.
 LOOP_DELAY = 0.01
 
 # Amount of time to delay before starting (seconds), to ensure that the starting
 # message gets sent before the program's first status update.
 START_DELAY = 0.1
 
-# Timeout for status queue long-polling (seconds). This should be less than
+# The prefix to a command that profiles the process for a number of seconds.
+# Adding ':cpu' leaves out the allocations, which slow down the program.
+PROFILE_PREFIX = 'profile:'
+
+# Timeout for status log long-polling (seconds). This should be less than
 # `ajaxTimeout` in `controls.js`, so that the server times out just before the
-# client gives up, and the server responds with a non-200 status.
+# client gives up. A poll that times out still gets a normal reply, with no
+# messages and the cursor to use next time.
 STATUS_POLL_TIMEOUT = 25
 
+# Commands that jump ahead of all other queued commands.
+PRIORITY_COMMANDS = ['control:stop', 'control:reset']
+
+# Lanes of the command queue, in order of priority.
+PRIORITY, NORMAL = range(2)
+
+# Maximum time a priority command may wait for the controller (seconds). If it
+# is not handled by then, the robot is stopped without waiting any longer.
+STOP_LATENCY = 0.05
+
+# Longest that a priority command waits for the actor after an emergency stop
+# (seconds). If the actor is still busy then, the client is told that the
+# command is queued instead.
+PRIORITY_TIMEOUT = 2.0
+
+
+def show_sync(info):
+    """Shows the reply to a sync command as text, in the form 'program running
+    can_reset'."""
+    return "{} {} {}".format(info['program'], info['running'],
+                             info['can_reset'])
+
+
+def show_battery(info):
+    """Shows the reply to a battery command as text."""
+    if info['voltage'] is None:
+        return "voltage unknown"
+    msg = "{:.2f} V".format(info['voltage'])
+    if info['reference'] is not None:
+        msg += " (calibrated at {:.2f} V)".format(info['reference'])
+    return msg + "; " + ', '.join(
+        "{} x{:.3f}".format(name, scale)
+        for name, scale in sorted(info['corrections'].items()))
+
+
+def show_lines(msgs):
+    """Shows status messages as text, one per line, or None if there are
+    none."""
+    return '\n'.join(msgs) or None
+
+
+def parse_cursor(cursor):
+    """Returns the cursor given in a status poll (None if it is empty), or
+    raises ValueError if it isn't a number."""
+    if cursor is None or cursor == '':
+        return None
+    return int(cursor)
+
+
+def status_reply(msgs, cursor, missed):
+    """Returns the reply to a status poll."""
+    return {'cursor': cursor, 'missed': missed, 'messages': msgs}
+
+
+def priority_queued(cmd):
+    """Returns the reply to a priority command that is still queued behind a
+    busy actor after the robot was stopped."""
+    return "robot stopped; {} will finish after the current command".format(
+        cmd.name)
+
+
+def parse_profile(args):
+    """Returns the duration (seconds) and whether to trace allocations for the
+    arguments of a profile command, such as '5' or '5:cpu'. Raises ValueError
+    if the duration isn't a number or is negative."""
+    seconds, _, kind = str(args).partition(':')
+    seconds = float(seconds)
+    if not seconds >= 0:
+        raise ValueError("duration must be at least 0")
+    return seconds, kind != 'cpu'
+
+
+class LaneStats(object):
+
+    """Measures the latency of the commands in a lane of the command queue."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.misses = 0
+
+    def record(self, latency, missed=False):
+        """Records the time a command took from arrival to completion."""
+        self.count += 1
+        self.total += latency
+        self.worst = max(self.worst, latency)
+        if missed:
+            self.misses += 1
+
+    def __str__(self):
+        mean = self.total / self.count if self.count else 0
+        return "n={} mean={:.1f}ms max={:.1f}ms missed={}".format(
+            self.count, 1000 * mean, 1000 * self.worst, self.misses)
 
-class Controller(object):
 
-    """Manages a program's main loop in a Greenlet."""
+class BaseController(object):
 
-    def __init__(self, program_id=DEFAULT_PROGRAM):
-        """Creates a controller to control the specified program. The program
-        doesn't start executing until the start method is called."""
-        self.messages = Queue()
+    """The part of a controller that doesn't depend on how it is scheduled.
+
+    It owns the program, the sensor sampler, and the status log, and knows how
+    to answer commands and run one iteration of the program. Subclasses run the
+    main loop and the actor that performs commands one at a time, using gevent
+    (Controller) or asyncio (AsyncController in `scribbler.aio`), and can
+    override `new_log` and `new_sampler` to use versions that suit their
+    backend. This class is abstract: subclasses must implement `running`, and
+    override `start` and `stop` to start and stop their main loop.
+    """
+
+    def __init__(self, program_id=DEFAULT_PROGRAM, sample_rate=SAMPLE_RATE,
+                 robot=None, journal=False):
+        """Creates a controller to control the specified program, sampling the
+        sensors at the given rate (Hz) while it runs. The program uses the
+        calibrated parameters in the profile of the robot with the given ID,
+        if there is one. If `journal` is true, the commands that change the
+        state are journaled, and the state in the robot's journal is restored
+        right away. The program doesn't start executing until the start
+        method is called."""
+        self.robot = robot
+        self.messages = self.new_log()
+        self.sensors = self.new_sampler(sample_rate)
+        self.battery = self.new_battery()
+        self.battery.start()
+        self.timing = Timing()
         self.program_id = program_id
-        self.program = PROGRAMS[program_id]()
-        self.green = None
+        self.program = self.new_program(program_id)
         self.can_reset = False
+        self.saved = None
+        # When an emergency stop held the main loop, or None if it isn't held.
+        # Only a start sent after that releases it.
+        self.held = None
+        # When the command being performed arrived.
+        self.arrived = None
+        self.stats = {PRIORITY: LaneStats(), NORMAL: LaneStats()}
+        # When the current run started, and the voltage then.
+        self.run = None
+        # The journaled commands that rebuild the program's state, by key.
+        self.history = OrderedDict()
+        self.journal = None
+        if journal:
+            self.journal = Journal(robot)
+            self.replay()
+
+    @property
+    def running(self):
+        """Returns true if the program's main loop is running. Only the
+        subclass knows, since it owns the main loop."""
+        raise NotImplementedError("running is implemented by subclasses")
 
     def start(self):
-        """Starts (or resumes) the execution of the program."""
-        self.green = Greenlet(self.main_loop)
-        self.green.start_later(START_DELAY)
+        """Starts (or resumes) the execution of the program. Subclasses start
+        the main loop."""
+        self.held = None
+        self.sensors.start()
         self.program.start()
         self.can_reset = True
+        self.run = time(), self.battery.voltage
 
     def stop(self):
-        """Stops the execution of the program."""
-        self.program.stop()
-        if self.green:
-            self.green.kill()
+        """Stops the execution of the program. If the robot can't be reached,
+        the program goes back to its last checkpoint, since the robot may have
+        been partway through a mode transition. Subclasses stop the main
+        loop."""
+        try:
+            self.program.stop()
+        except LinkDown:
+            if self.saved:
+                self.program.restore(self.saved)
+        self.sensors.stop()
+        if self.run:
+            self.record_run()
+
+    def record_run(self):
+        """Records the run that just ended in the robot's profile: how long it
+        was, the battery voltage at its start and end, and the corrections in
+        use at the end. The profile is written in the background, so that
+        stopping doesn't wait for the disk."""
+        started, voltage = self.run
+        self.run = None
+        if self.robot is None or voltage is None:
+            return
+        self.in_background(self.save_run, {
+            'program': self.program_id,
+            'start': started,
+            'duration': time() - started,
+            'voltage_start': voltage,
+            'voltage_end': self.battery.voltage,
+            'corrections': self.program.corrections()
+        })
+
+    def save_run(self, run):
+        """Appends a run to the robot's profile."""
+        try:
+            profiles.record(self.robot, 'runs', run)
+        except (IOError, OSError) as e:
+            print("warning: couldn't record run: {}".format(e))
+
+    def in_background(self, fn, *args):
+        """Calls a function that doesn't return anything, such as one that
+        writes a file. Subclasses call it in another thread without waiting
+        for it, one function at a time in the order they were given."""
+        fn(*args)
 
     def reset(self):
         """Stops the program and resets it to its initial state."""
@@ -72,52 +277,464 @@ class Controller(object):
         """Stops execution and switches to a new program."""
         self.stop()
         self.program_id = program_id
-        self.program = PROGRAMS[program_id]()
+        self.program = self.new_program(program_id)
+        self.history.clear()
+        self.saved = None
         self.can_reset = False
 
+    def new_log(self):
+        """Creates the status log."""
+        return StatusLog()
+
+    def new_sampler(self, sample_rate):
+        """Creates the sampler for the obstacle sensors."""
+        return Sampler(sample_rate)
+
+    def new_battery(self):
+        """Creates the sampler for the battery voltage, which runs for as long
+        as the controller."""
+        return BatterySampler()
+
+    def new_program(self, program_id):
+        """Creates a program that reads its sensors from the sampler and uses
+        the robot's calibrated parameters."""
+        program = PROGRAMS[program_id]()
+        program.sensors = self.sensors
+        program.battery = self.battery
+        program.timing = self.timing
+        program.robot = self.robot
+        program.offload = self.offload
+        program.in_background = self.in_background
+        profiles.apply(program, self.robot)
+        return program
+
+    def offload(self, fn, *args):
+        """Calls a function that may take a long time for the program, and
+        returns its result. Subclasses run it where it doesn't hold up the
+        main loop."""
+        return fn(*args)
+
+    def state(self):
+        """Returns a dictionary describing the state of the controller and the
+        robot, as shown in the client."""
+        _, _, heading = self.program.position()
+        return {
+            'program': self.program_id,
+            'mode': self.program.mode_name,
+            'running': self.running,
+            'can_reset': self.can_reset,
+            'status_seq': self.messages.next_seq,
+            'heading': heading
+        }
+
+    def tick(self):
+        """Runs one iteration of the program's loop, collecting any returned
+        message into the status log, and returns how long to wait before the
+        next. The program's progress is checkpointed first, so that it can
+        resume from there if the link to the robot drops. While the main loop
+        is held by an emergency stop, the program isn't run at all."""
+        if self.held is not None:
+            return LOOP_DELAY
+        self.saved = self.program.checkpoint()
+        msg = self.program.loop()
+        if msg:
+            self.messages.put(msg)
+        return self.loop_delay()
+
+    def halt(self):
+        """Stops the robot's motors without touching the program's state. The
+        link supervisor sends the stop ahead of any Myro call that is stuck."""
+        try:
+            getattr(myro, 'stop_now', myro.stop)()
+        except LinkDown:
+            pass
+
+    def loop_delay(self):
+        """Returns how long to sleep before the next iteration: LOOP_DELAY, or
+        less if the current mode should end before then, so that the program
+        notices right away."""
+        deadline = self.program.deadline
+        if deadline is None:
+            return LOOP_DELAY
+        return max(0, min(LOOP_DELAY, deadline - self.program.clock()))
+
+    @command('short:sync', show=show_sync, kind=IMMEDIATE)
+    def sync(self, _):
+        return {
+            'program': self.program_id,
+            'running': self.running,
+            'can_reset': self.can_reset
+        }
+
+    @command('short:param-help', show=json.dumps, kind=IMMEDIATE)
+    def param_help(self, _):
+        return self.program.codes
+
+    @command('short:state', show=json.dumps, kind=IMMEDIATE)
+    def short_state(self, _):
+        return self.state()
+
+    @command('short:link', kind=IMMEDIATE)
+    def link(self, _):
+        if not hasattr(myro, 'describe'):
+            return "link not supervised"
+        return myro.describe()
+
+    @command('short:timing', kind=IMMEDIATE)
+    def short_timing(self, _):
+        return str(self.timing)
+
+    @command('short:battery', show=show_battery, kind=IMMEDIATE)
+    def battery_status(self, _):
+        return {
+            'voltage': self.battery.voltage,
+            'reference': self.program.voltage_model.reference,
+            'corrections': self.program.corrections()
+        }
+
+    @command('short:latency', kind=IMMEDIATE)
+    def latency(self, _):
+        return "priority: {}; normal: {}".format(
+            self.stats[PRIORITY], self.stats[NORMAL])
+
+    def lane(self, cmd):
+        """Returns the lane of the command queue for a command. The command is
+        None if it is for the program."""
+        if cmd is not None and cmd.text in PRIORITY_COMMANDS:
+            return PRIORITY
+        return NORMAL
+
+    def record_latency(self, lane, arrived):
+        """Records the latency of a command that arrived in the lane at the
+        given time and has just been performed."""
+        latency = time() - arrived
+        missed = lane == PRIORITY and latency > STOP_LATENCY
+        self.stats[lane].record(latency, missed)
+
+    def perform(self, command, arrived=None):
+        """Performs a command (a string or a Request) that may change the state
+        of the controller or the program, and returns the reply. `arrived` is
+        when the command arrived, if it isn't now. Commands that have a
+        journal key are journaled once they are done, unless they fail."""
+        self.arrived = time() if arrived is None else arrived
+        req = protocol.request(command)
+        target = self
+        cmd, arg = protocol.lookup(self, req)
+        if cmd is None:
+            target = self.program
+            cmd, arg = protocol.lookup(self.program, req)
+        if cmd is None:
+            return protocol.unknown(req, self.program.unrecognized)
+        value = protocol.call(target, cmd, req, arg)
+        if self.journal and cmd.journal is not None and \
+                not isinstance(value, Failure):
+            self.remember(cmd, req)
+        return protocol.reply(cmd, req, value)
+
+    def remember(self, cmd, req):
+        """Journals a command in the background, along with the snapshot to
+        compact the journal into if it is due. Starting and stopping are
+        journaled as whichever of them the program ended up in."""
+        self.keep(cmd, req)
+        body = req.body
+        if cmd.journal == 'running':
+            body = 'control:start' if self.running else 'control:stop'
+        self.in_background(self.write_journal, body, self.snapshot())
+
+    def write_journal(self, body, snapshot):
+        """Appends a command to the journal, and compacts the journal into
+        the snapshot when it is due."""
+        try:
+            if self.journal.append(body):
+                self.journal.compact(snapshot)
+        except (IOError, OSError) as e:
+            print("warning: couldn't write journal: {}".format(e))
+
+    def keep(self, cmd, req):
+        """Keeps a journaled command in the history of the current program,
+        in place of the one with the same key. Commands that the snapshot
+        covers some other way (switching programs, starting and stopping, and
+        setting parameters) aren't kept."""
+        key = cmd.journal
+        if key in ('program', 'running', 'params'):
+            return
+        if key is True:
+            key = req.body
+        self.history.pop(key, None)
+        self.history[key] = req.body
+
+    def snapshot(self, running=None):
+        """Returns a snapshot of the state for the journal. It records whether
+        the program is running (or `running`, if given), but not its progress,
+        since the robot may not be where it was when the server comes back."""
+        return {
+            'program': self.program_id,
+            'params': self.program.changed_params(),
+            'commands': list(self.history.values()),
+            'running': self.running if running is None else running
+        }
+
+    def replay(self):
+        """Restores the state in the journal: switches to the journaled
+        program and performs the commands that built its state, without
+        touching the robot. The program is left paused even if it was running,
+        so that it only resumes once the operator starts it."""
+        snapshot, commands = self.journal.load()
+        if snapshot is None and not commands:
+            return
+        running = False
+        if snapshot:
+            running = snapshot.get('running', False)
+            self.restore(snapshot.get('program', self.program_id))
+            params = snapshot.get('params')
+            if params:
+                self.restore_command(json.dumps({'cmd': 'set', 'arg': params}))
+            for body in snapshot.get('commands', []):
+                self.restore_command(body)
+        for body in commands:
+            req = protocol.parse(body)
+            cmd, arg = protocol.lookup(self, req)
+            if cmd is None:
+                self.restore_command(req)
+            elif cmd.journal == 'program':
+                running = False
+                self.restore(arg)
+            elif cmd.journal == 'running':
+                running = cmd.text == 'control:start'
+            else:
+                running = False
+                self.restore_command(req)
+        self.journal.compact(self.snapshot(running))
+        msg = "restored {} from the journal".format(self.program_id)
+        if running:
+            msg += "; it was running, so start it to resume"
+        self.messages.put(msg)
+
+    def restore(self, program_id):
+        """Switches to a program while replaying the journal."""
+        if program_id in PROGRAMS:
+            self.program_id = program_id
+            self.program = self.new_program(program_id)
+            self.history.clear()
+
+    def restore_command(self, command):
+        """Performs a journaled command while replaying the journal. Program
+        commands go to the program, and resetting only resets the program."""
+        req = protocol.request(command)
+        cmd, _ = protocol.lookup(self, req)
+        try:
+            if cmd is None:
+                cmd, _ = protocol.lookup(self.program, req)
+                self.program(req)
+            else:
+                # The only other journaled command in the history.
+                self.program.reset()
+        except Exception as e:
+            self.messages.put("couldn't restore {!r}: {}".format(
+                req.body[:40], e))
+            return
+        if cmd is not None and cmd.journal is not None:
+            self.keep(cmd, req)
+
+    @command(PROGRAM_PREFIX, journal='program', arg='string')
+    def switch_command(self, prog):
+        if prog not in PROGRAMS:
+            return Failure("no such program: " + prog)
+        self.switch_program(prog)
+        return "switched to {}".format(prog)
+
+    @command('control:start', journal='running')
+    def control_start(self, _):
+        if self.held is not None and self.arrived <= self.held:
+            return Failure("not started, since it was sent before the "
+                           "emergency stop")
+        reason = self.program.no_start()
+        if reason:
+            return Failure(reason)
+        if self.running:
+            return Failure("already running")
+        saved = self.program.checkpoint()
+        try:
+            self.start()
+        except LinkDown as e:
+            self.stop()
+            self.program.restore(saved)
+            return Failure("can't start, lost link to robot: {}".format(e))
+        return "program resumed"
+
+    @command('control:stop', journal='running')
+    def control_stop(self, _):
+        if not self.running:
+            return Failure("not running")
+        self.stop()
+        return "program paused"
+
+    @command('control:reset', journal='reset')
+    def control_reset(self, _):
+        self.reset()
+        return "program reset"
+
+
+class Controller(BaseController):
+
+    """Manages a program's main loop in a Greenlet.
+
+    Commands that change the state of the controller or the program are handled
+    one at a time by an actor Greenlet, so concurrent clients can't interleave
+    them. Stopping and resetting go in a priority lane ahead of everything else,
+    and commands that only read state are answered right away.
+    """
+
+    def __init__(self, program_id=DEFAULT_PROGRAM, sample_rate=SAMPLE_RATE,
+                 robot=None, journal=False):
+        self.writer = ThreadPool(1)
+        BaseController.__init__(self, program_id, sample_rate, robot, journal)
+        self.green = None
+        self.inbox = PriorityQueue()
+        self.sequence = count()
+        self.actor = spawn(self.serve)
+
+    @property
+    def running(self):
+        return bool(self.green)
+
+    def start(self):
+        self.green = Greenlet(self.main_loop)
+        self.green.start_later(START_DELAY)
+        BaseController.start(self)
+
+    def stop(self):
+        BaseController.stop(self)
+        if self.green:
+            self.green.kill()
+
     def main_loop(self):
-        """Runs the program's loop method continously, collecting any returned
-        messages into the messages queue."""
+        """Runs the program's loop method continously, recovering if the link
+        to the robot drops."""
+        while True:
+            try:
+                delay = self.tick()
+            except LinkDown as e:
+                self.recover(e)
+                continue
+            sleep(delay)
+
+    def recover(self, error):
+        """Waits for the link to the robot to come back, and then resumes the
+        program from the last checkpoint."""
+        self.messages.put("lost link to robot ({}), reconnecting".format(error))
+        self.sensors.stop()
+        while True:
+            myro.wait_up()
+            self.program.restore(self.saved)
+            try:
+                self.program.start()
+            except LinkDown:
+                continue
+            break
+        self.sensors.start()
+        self.messages.put("link restored, resuming in mode {}".format(
+            self.program.mode_name))
+
+    @command('long:status', show=show_lines, kind=WAITING, structured=False)
+    def read_status(self, _):
+        """Waits for new status messages and returns them."""
+        msgs, _, _ = self.messages.read(timeout=STATUS_POLL_TIMEOUT)
+        return msgs
+
+    @command(STATUS_PREFIX, show=json.dumps, kind=WAITING,
+             arg=('number', 'string', 'null'))
+    def poll_status(self, cursor):
+        """Waits for status messages from the given cursor on (an empty one
+        means only new ones) and returns them, along with the cursor to use
+        next time and the number of messages that were missed. The reply is
+        sent even if the poll times out so that the client learns its cursor."""
+        try:
+            cursor = parse_cursor(cursor)
+        except (ValueError, TypeError):
+            return Failure("bad cursor: " + str(cursor))
+        return status_reply(*self.messages.read(cursor, STATUS_POLL_TIMEOUT))
+
+    @command(PROFILE_PREFIX, show=json.dumps, kind=WAITING,
+             arg=('number', 'string'))
+    def profile(self, args):
+        """Profiles the whole process (the server, this controller, and its
+        program) for the number of seconds in `args`, and returns the results.
+        This is answered outside the actor, so the robot keeps going while the
+        profile is taken."""
+        try:
+            seconds, allocations = parse_profile(args)
+        except ValueError as e:
+            return Failure("bad profile: {}".format(e))
+        if profiler.active:
+            return Failure("already profiling")
+        return profiler.profile(seconds, allocations)
+
+    def serve(self):
+        """Handles queued commands one at a time, forever."""
         while True:
-            msg = self.program.loop()
-            if msg:
-                self.messages.put(msg)
-            sleep(LOOP_DELAY)
+            lane, _, arrived, command, result = self.inbox.get()
+            try:
+                result.set(self.perform(command, arrived))
+            except LinkDown as e:
+                result.set("lost link to robot: {}".format(e))
+            except Exception as e:
+                result.set_exception(e)
+            self.record_latency(lane, arrived)
+
+    def offload(self, fn, *args):
+        """Calls the function in gevent's thread pool, so that the main loop,
+        status polls, and emergency stops carry on while it runs. Errors are
+        raised here rather than reported by the pool."""
+        def catch():
+            try:
+                return fn(*args), None
+            except Exception as e:
+                return None, e
+        value, error = get_hub().threadpool.apply(catch)
+        if error is not None:
+            raise error
+        return value
+
+    def in_background(self, fn, *args):
+        self.writer.spawn(fn, *args)
+
+    def close(self):
+        """Stops the program and the controller's Greenlets, and waits for
+        the background writer to finish what it was given."""
+        self.stop()
+        self.battery.stop()
+        self.actor.kill()
+        self.writer.join()
+
+    def emergency_stop(self):
+        """Stops the robot right away, without waiting for the actor, and holds
+        the main loop so that it doesn't start the motors again. The program's
+        state is left alone, since the actor may be partway through another
+        command. The priority command stays queued, and it stops or resets the
+        program when its turn comes. The hold lasts until a start sent after
+        this, so a start that was already queued can't undo it."""
+        self.held = time()
+        self.halt()
+        self.messages.put("emergency stop")
 
     def __call__(self, command):
         """Accepts a command and either performs the desired action or passes
-        the message on to the program. Returns a status message."""
-        if command == 'short:sync':
-            pid = self.program_id
-            running = bool(self.green)
-            can_reset = self.can_reset
-            return "{} {} {}".format(pid, running, can_reset)
-        if command == 'short:param-help':
-            return json.dumps(self.program.codes)
-        if command == 'long:status':
+        the message on to the program. Returns the reply."""
+        req = protocol.parse(command)
+        cmd, arg = protocol.lookup(self, req)
+        if cmd is not None and cmd.kind != QUEUED:
+            return protocol.reply(cmd, req, protocol.call(self, cmd, req, arg))
+        lane = self.lane(cmd)
+        result = AsyncResult()
+        self.inbox.put((lane, next(self.sequence), time(), req, result))
+        if lane == PRIORITY:
             try:
-                msg = self.messages.get(timeout=STATUS_POLL_TIMEOUT)
-            except Empty:
-                return None
-            return msg
-        if command.startswith(PROGRAM_PREFIX):
-            prog = command[len(PROGRAM_PREFIX):]
-            self.switch_program(prog)
-            return "switched to {}".format(prog)
-        if command == 'control:start':
-            reason = self.program.no_start()
-            if reason:
-                return reason
-            if self.green:
-                return "already running"
-            self.start()
-            return "program resumed"
-        if command == 'control:stop':
-            if not self.green:
-                return "not running"
-            self.stop()
-            return "program paused"
-        if command == 'control:reset':
-            self.reset()
-            return "program reset"
-        return self.program(command)
+                return result.get(timeout=STOP_LATENCY)
+            except Timeout:
+                self.emergency_stop()
+            try:
+                return result.get(timeout=PRIORITY_TIMEOUT)
+            except Timeout:
+                return protocol.reply(cmd, req, priority_queued(cmd))
+        return result.get()
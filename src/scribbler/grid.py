@@ -0,0 +1,151 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Remembers where obstacles are in a compact occupancy grid."""
+
+import json
+import math
+from array import array
+
+
+# Width of a square cell (cm).
+CELL_SIZE = 4.0
+
+# Number of cells along each side of the grid, which is centred on the origin.
+GRID_SIZE = 128
+
+# Distance ahead of the robot's centre at which the obstacle sensors see an
+# obstacle when they detect one (cm).
+SENSE_DIST = 12.0
+
+# Changes to the log-odds of a cell for a detection and for a clear reading.
+HIT = 20
+MISS = -8
+
+# Limit on the magnitude of the log-odds, so that the map can change its mind.
+LIMIT = 120
+
+# Log-odds above which a cell is known to be occupied, and below which it is
+# known to be free.
+OCCUPIED_ODDS = 40
+FREE_ODDS = -16
+
+# Knowledge about a region of the grid.
+UNKNOWN, FREE, OCCUPIED = range(3)
+
+
+class OccupancyGrid(object):
+
+    """A square grid of cells holding the log-odds that they are occupied.
+
+    The log-odds are stored in a byte array, so the whole map is only a few
+    kilobytes and can be kept for as long as the program runs and saved to
+    disk. Readings outside the grid are ignored.
+    """
+
+    def __init__(self, size=GRID_SIZE, cell=CELL_SIZE):
+        self.size = size
+        self.cell = cell
+        self.clear()
+
+    def clear(self):
+        """Forgets everything in the map."""
+        self.cells = array('b', [0]) * (self.size * self.size)
+        # Sides chosen to go around the obstacles, by cell index.
+        self.sides = {}
+
+    def index(self, x, y):
+        """Returns the index of the cell containing (x,y), or None if it is
+        outside the grid."""
+        half = self.size // 2
+        i = int(math.floor(x / self.cell)) + half
+        j = int(math.floor(y / self.cell)) + half
+        if 0 <= i < self.size and 0 <= j < self.size:
+            return j * self.size + i
+        return None
+
+    def update(self, x, y, delta):
+        """Adds `delta` to the log-odds of the cell containing (x,y)."""
+        k = self.index(x, y)
+        if k is not None:
+            self.cells[k] = max(-LIMIT, min(LIMIT, self.cells[k] + delta))
+
+    def ray(self, x, y, heading, dist):
+        """Returns the points spaced by half a cell along a ray from (x,y)."""
+        c, s = math.cos(heading), math.sin(heading)
+        step = self.cell / 2
+        n = int(dist / step)
+        return [(x + i * step * c, y + i * step * s) for i in range(1, n + 1)]
+
+    def observe(self, x, y, heading, detected):
+        """Updates the map with an obstacle sensor reading taken at (x,y) facing
+        `heading` (radians). The space in front of the robot is free up to the
+        obstacle, if there is one."""
+        points = self.ray(x, y, heading, SENSE_DIST)
+        for px, py in points[:-1]:
+            self.update(px, py, MISS)
+        px, py = points[-1]
+        self.update(px, py, HIT if detected else MISS)
+
+    def probe(self, x, y, heading):
+        """Returns what the map knows about the space that the obstacle sensors
+        would see from (x,y) facing `heading`: OCCUPIED if any of it is known to
+        be occupied, FREE if all of it is known to be free, and UNKNOWN
+        otherwise."""
+        result = FREE
+        for px, py in self.ray(x, y, heading, SENSE_DIST):
+            k = self.index(px, py)
+            if k is None:
+                return UNKNOWN
+            odds = self.cells[k]
+            if odds > OCCUPIED_ODDS:
+                return OCCUPIED
+            if odds > FREE_ODDS:
+                result = UNKNOWN
+        return result
+
+    def remember_side(self, x, y, side):
+        """Remembers the side chosen to go around the obstacle at (x,y)."""
+        k = self.index(x, y)
+        if k is not None:
+            self.sides[k] = side
+
+    def side(self, x, y):
+        """Returns the side chosen for the obstacle at (x,y) or nearby, or None
+        if there isn't one."""
+        for dx in (0, -self.cell, self.cell):
+            for dy in (0, -self.cell, self.cell):
+                k = self.index(x + dx, y + dy)
+                if k in self.sides:
+                    return self.sides[k]
+        return None
+
+    def save(self, path):
+        """Writes the map to a file."""
+        with open(path, 'w') as f:
+            json.dump({
+                'size': self.size,
+                'cell': self.cell,
+                'cells': self.cells.tolist(),
+                'sides': [[k, v] for k, v in self.sides.items()]
+            }, f)
+
+    def load(self, path):
+        """Reads a map from a file written by `save`. Raises ValueError if the
+        file is not a valid map."""
+        with open(path) as f:
+            data = json.load(f)
+        try:
+            size = int(data['size'])
+            cell = float(data['cell'])
+            cells = array('b', data['cells'])
+            sides = dict((int(k), int(v)) for k, v in data['sides'])
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            raise ValueError("bad map: {}".format(e))
+        if len(cells) != size * size:
+            raise ValueError("bad map: wrong number of cells")
+        if not cell > 0:
+            raise ValueError("bad map: cell size must be positive")
+        self.size = size
+        self.cell = cell
+        self.cells = cells
+        self.sides = sides
@@ -0,0 +1,123 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Queues drawings so that Tracie can draw them one after another."""
+
+from collections import deque
+from itertools import count
+
+
+# States of a job.
+WAITING, DRAWING, DONE, SKIPPED = 'waiting', 'drawing', 'done', 'skipped'
+
+# Number of finished jobs that are kept to be listed.
+HISTORY = 50
+
+
+class Job(object):
+
+    """A drawing to be drawn with its own parameters. The drawing is already
+    converted into Tracie's points, so starting the job takes no work."""
+
+    def __init__(self, number, name, params, points, lifts, delay, now):
+        self.number = number
+        self.name = name
+        self.params = params
+        self.points = points
+        self.lifts = lifts
+        self.delay = delay
+        self.state = WAITING
+        self.queued = now
+        self.started = None
+        self.finished = None
+
+    def describe(self, progress=None):
+        """Returns a dictionary describing the job for the client. The times
+        are in seconds, and `progress` is the fraction of the points reached
+        if the job is being drawn."""
+        info = {
+            'number': self.number,
+            'name': self.name,
+            'state': self.state,
+            'points': len(self.points),
+            'params': self.params,
+            'queued': self.queued
+        }
+        if self.started is not None:
+            info['started'] = self.started
+            info['waited'] = self.started - self.queued
+        if self.finished is not None:
+            info['finished'] = self.finished
+            info['duration'] = self.finished - self.started
+        if progress is not None:
+            info['progress'] = progress
+        return info
+
+
+class JobQueue(object):
+
+    """The jobs waiting to be drawn, the one being drawn, and the recently
+    finished ones."""
+
+    def __init__(self):
+        self.waiting = deque()
+        self.current = None
+        self.history = deque(maxlen=HISTORY)
+        self.numbers = count(1)
+
+    def __len__(self):
+        """Returns the number of jobs waiting."""
+        return len(self.waiting)
+
+    def add(self, name, params, points, lifts, delay, now):
+        """Adds a job to the end of the queue and returns it."""
+        number = next(self.numbers)
+        name = name or "job {}".format(number)
+        job = Job(number, name, params, points, lifts, delay, now)
+        self.waiting.append(job)
+        return job
+
+    def start(self, now):
+        """Takes the next job off the queue and returns it, or None if there
+        are no jobs waiting."""
+        if not self.waiting:
+            return None
+        self.current = self.waiting.popleft()
+        self.current.state = DRAWING
+        self.current.started = now
+        return self.current
+
+    def finish(self, now, state=DONE):
+        """Records that the current job is done (or was skipped) and returns
+        it, or None if there is no current job."""
+        job = self.current
+        if job is None:
+            return None
+        job.state = state
+        job.finished = now
+        self.history.append(job)
+        self.current = None
+        return job
+
+    def requeue(self):
+        """Puts the current job back at the front of the queue, to be drawn
+        again from the beginning."""
+        if self.current is not None:
+            self.current.state = WAITING
+            self.current.started = None
+            self.waiting.appendleft(self.current)
+            self.current = None
+
+    def clear(self):
+        """Removes all the waiting jobs and returns how many there were."""
+        n = len(self.waiting)
+        self.waiting.clear()
+        return n
+
+    def describe(self, progress=None):
+        """Returns a list describing the finished, current, and waiting jobs
+        in order. The current job's progress is included if it is given."""
+        jobs = [j.describe() for j in self.history]
+        if self.current is not None:
+            jobs.append(self.current.describe(progress))
+        jobs.extend(j.describe() for j in self.waiting)
+        return jobs
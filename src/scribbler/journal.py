@@ -0,0 +1,119 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Journals the commands that change a robot's state, so that the server can
+get back to where it was after a restart."""
+
+from __future__ import print_function
+
+import json
+import os
+from time import time
+
+from scribbler.profiles import UNSAFE_CHARS, replace
+
+
+# Directory that holds the journal and the snapshot of each robot.
+JOURNAL_DIR = 'journals'
+
+# Number of commands appended to a journal before it is compacted into a
+# snapshot.
+COMPACT_EVERY = 100
+
+
+def journal_paths(robot):
+    """Returns the paths of the journal and the snapshot for the robot with the
+    given ID (such as its Bluetooth port)."""
+    name = UNSAFE_CHARS.sub('_', os.path.basename(robot.rstrip('/')))
+    base = os.path.join(JOURNAL_DIR, name)
+    return base + '.log', base + '.snapshot.json'
+
+
+class Journal(object):
+
+    """An append-only log of commands, one JSON entry per line, compacted from
+    time to time into a snapshot.
+
+    Each entry is numbered, and the snapshot records the number of the last
+    entry it covers. The controller writes entries in order on its background
+    writer, so a command's reply doesn't wait for the disk, and the snapshot
+    replaces the old one atomically before the log is truncated. A crash at
+    any point leaves a consistent state behind: the snapshot and whichever of
+    the following entries were written whole.
+    """
+
+    def __init__(self, robot, compact_every=COMPACT_EVERY):
+        self.log_path, self.snapshot_path = journal_paths(robot)
+        self.compact_every = compact_every
+        self.seq = 0 # number of the last entry
+        self.appended = 0 # entries appended since the last compaction
+        self.file = None
+
+    def load(self):
+        """Returns the snapshot (None if there isn't one) and the list of
+        commands journaled after it. A partly written entry at the end of the
+        log, left by a crash, is ignored and cut off."""
+        snapshot = None
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except IOError:
+            pass
+        except ValueError as e:
+            print("warning: ignoring bad snapshot {}: {}".format(
+                self.snapshot_path, e))
+        if not isinstance(snapshot, dict):
+            snapshot = None
+        self.seq = snapshot.get('seq', 0) if snapshot else 0
+        commands = []
+        good = 0
+        try:
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        break
+                    good += len(line)
+                    if entry['n'] > self.seq:
+                        commands.append(entry['cmd'])
+                        self.seq = entry['n']
+            if os.path.getsize(self.log_path) > good:
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(good)
+        except IOError:
+            pass
+        return snapshot, commands
+
+    def append(self, command):
+        """Appends a command (the body of its request) to the log, and returns
+        true if it is time to compact the journal."""
+        if self.file is None:
+            if not os.path.isdir(JOURNAL_DIR):
+                os.makedirs(JOURNAL_DIR)
+            self.file = open(self.log_path, 'ab')
+        self.seq += 1
+        entry = {'n': self.seq, 't': time(), 'cmd': command}
+        self.file.write((json.dumps(entry) + '\n').encode('utf-8'))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.appended += 1
+        return self.appended >= self.compact_every
+
+    def compact(self, snapshot):
+        """Saves the snapshot, which must cover every command appended so far,
+        and empties the log."""
+        snapshot = dict(snapshot, seq=self.seq, saved=time())
+        if not os.path.isdir(JOURNAL_DIR):
+            os.makedirs(JOURNAL_DIR)
+        temp = self.snapshot_path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        replace(temp, self.snapshot_path)
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.log_path, 'wb')
+        self.appended = 0
@@ -0,0 +1,192 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Watches the Bluetooth link to the robot and reconnects when it drops."""
+
+from __future__ import print_function
+
+try:
+    import __builtin__
+except ImportError:
+    import builtins as __builtin__
+
+try:
+    from gevent import Timeout, sleep, spawn
+    from gevent.event import Event
+    from gevent.threadpool import ThreadPool
+except ImportError:
+    Timeout = sleep = spawn = Event = ThreadPool = None
+
+
+# Longest that a Myro call may take before the link is considered lost
+# (seconds). Beeps are given their length on top of this.
+CALL_TIMEOUT = 2.0
+
+# Longest that connecting to the robot may take (seconds).
+CONNECT_TIMEOUT = 30.0
+
+# Amount of time to wait before the first attempt to reconnect (seconds). It
+# doubles after each failed attempt, up to BACKOFF_MAX.
+BACKOFF_MIN = 0.5
+
+# Longest amount of time to wait between attempts to reconnect (seconds).
+BACKOFF_MAX = 30.0
+
+
+class LinkDown(Exception):
+
+    """Raised by a Myro call that fails or times out, and by every call made
+    while the link is down."""
+
+    pass
+
+
+class LinkSupervisor(object):
+
+    """Stands in for the Myro library, making each call in a worker thread with
+    a time limit.
+
+    All the calls go through the same worker, one at a time, since Myro can't
+    share the serial port between threads. When a call fails or times out,
+    the link is marked as down and a Greenlet reconnects to the robot, waiting
+    longer after each failed attempt. A call that timed out may still be stuck
+    in the worker, so the worker is retired and a new one takes over the next
+    calls. Reconnecting waits a while for the retired workers' calls to
+    return, so that it doesn't compete with them for the port, and a retired
+    worker exits once its call returns. Calls made in the meantime raise
+    LinkDown straight away instead of blocking, so the controller can wait for
+    the link to come back and then resume the program from its last
+    checkpoint.
+    """
+
+    def __init__(self, backend, port, timeout=CALL_TIMEOUT):
+        """Creates a supervisor for the robot on the given Bluetooth port. The
+        backend is the Myro module (or a stand-in with the same functions). It
+        doesn't connect until the connect method is called."""
+        self.backend = backend
+        self.port = port
+        self.timeout = timeout
+        self.worker = ThreadPool(1)
+        self.retired = []
+        # Sends emergency stops, which can't wait behind a stuck call.
+        self.urgent = ThreadPool(1)
+        self.up = False
+        self.restored = Event()
+        self.reconnecting = None
+        self.drops = 0
+
+    def connect(self):
+        """Connects to the robot. Returns true if that worked, and otherwise
+        keeps trying in the background and returns false."""
+        try:
+            self.call(self.backend.initialize, CONNECT_TIMEOUT, self.port,
+                      check=False)
+        except LinkDown:
+            return False
+        self.up = True
+        self.restored.set()
+        return True
+
+    def call(self, fn, timeout, *args, **kwargs):
+        """Calls the Myro function in the worker and returns its result.
+        Raises LinkDown if the link is down (unless `check` is false), or if
+        the call fails or takes longer than `timeout` seconds."""
+        if kwargs.get('check', True) and not self.up:
+            raise LinkDown("link is down")
+        try:
+            with Timeout(timeout, LinkDown("no reply in {} s".format(timeout))):
+                return self.worker.apply(fn, args)
+        except LinkDown:
+            self.lost()
+            raise
+        except Exception as e:
+            self.lost()
+            raise LinkDown(str(e) or type(e).__name__)
+
+    def stop_now(self):
+        """Stops the motors from a thread of its own, without waiting for the
+        call in the worker, which may be stuck. The stop is sent even if the
+        link is down, since the robot may still hear it. Raises LinkDown if it
+        fails or takes longer than the time limit, and then replaces the
+        thread so that the next stop doesn't wait for this one."""
+        try:
+            with Timeout(self.timeout, LinkDown("no reply in {} s".format(
+                    self.timeout))):
+                return self.urgent.apply(self.backend.stop)
+        except LinkDown:
+            self.urgent.kill()
+            self.urgent = ThreadPool(1)
+            raise
+        except Exception as e:
+            raise LinkDown(str(e) or type(e).__name__)
+
+    def lost(self):
+        """Marks the link as down, replaces the worker, and starts reconnecting,
+        if it isn't already."""
+        self.worker.kill()
+        self.retired.append(self.worker)
+        self.worker = ThreadPool(1)
+        if self.up:
+            self.drops += 1
+        self.up = False
+        self.restored.clear()
+        if not self.reconnecting:
+            self.reconnecting = spawn(self.reconnect)
+
+    def reconnect(self):
+        """Tries to connect to the robot until it works, backing off
+        exponentially between attempts. Stops the robot once it is back."""
+        delay = BACKOFF_MIN
+        while True:
+            sleep(delay)
+            self.settle()
+            try:
+                self.call(self.backend.initialize, CONNECT_TIMEOUT, self.port,
+                          check=False)
+                self.call(self.backend.stop, self.timeout, check=False)
+                break
+            except LinkDown:
+                delay = min(2 * delay, BACKOFF_MAX)
+        self.reconnecting = None
+        self.up = True
+        self.restored.set()
+
+    def settle(self):
+        """Waits up to CONNECT_TIMEOUT for the calls stuck in the retired
+        workers to return, and then forgets about the workers."""
+        with Timeout(CONNECT_TIMEOUT, False):
+            for worker in self.retired:
+                worker.join()
+        self.retired = []
+
+    def wait_up(self):
+        """Blocks until the link is up."""
+        self.restored.wait()
+
+    def describe(self):
+        """Returns a short description of the state of the link."""
+        state = "up" if self.up else "down, reconnecting"
+        return "link {} ({} drops)".format(state, self.drops)
+
+    def beep(self, length, freq):
+        """Beeps, allowing for the length of the beep in the time limit."""
+        return self.call(self.backend.beep, self.timeout + length, length, freq)
+
+    def __getattr__(self, name):
+        """Returns a supervised version of a Myro function."""
+        fn = getattr(self.backend, name)
+        if not callable(fn):
+            return fn
+        def supervised(*args):
+            return self.call(fn, self.timeout, *args)
+        setattr(self, name, supervised)
+        return supervised
+
+
+def supervise(backend, port, timeout=CALL_TIMEOUT):
+    """Makes programs use a new LinkSupervisor as Myro, and connects to the
+    robot through it. Returns the supervisor."""
+    link = LinkSupervisor(backend, port, timeout)
+    __builtin__.myro = link
+    if not link.connect():
+        print("warning: can't connect to {}, still trying".format(port))
+    return link
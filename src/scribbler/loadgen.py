@@ -0,0 +1,345 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Simulates many browsers using the web app at once, to measure how much load
+the server can take."""
+
+import httplib
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+from time import time
+
+from gevent import joinall, sleep, spawn
+
+
+# How often each client synchronizes with the server (seconds). This should be
+# the same as `syncInterval` in `controls.js`.
+SYNC_INTERVAL = 10.0
+
+# How often a tracing client asks for the trace (seconds). The drawing view
+# asks whenever the motion it is animating ends, which for Tracie is a few
+# times per second.
+TRACE_INTERVAL = 0.5
+
+# Fraction of the clients that have the drawing view open with tracing on.
+TRACING_FRACTION = 0.5
+
+# Time between the commands sent by the operator (seconds).
+OPERATOR_INTERVAL = 2.0
+
+# Commands that the operator cycles through, after uploading the drawing and
+# starting the program. None is replaced by the points command.
+OPERATOR_SCRIPT = [
+    'short:param-help',
+    'set:s=0.5',
+    'other:beep',
+    'control:stop',
+    'set:s=default',
+    'control:start',
+    'other:info',
+    'control:stop',
+    'control:reset',
+    None,
+    'control:start'
+]
+
+# Timeout for each request (seconds). This should be the same as `ajaxTimeout`
+# in `controls.js`.
+REQUEST_TIMEOUT = 30.0
+
+# Time between samples of the open connections and the server's memory use
+# (seconds).
+SAMPLE_INTERVAL = 1.0
+
+# Longest to wait for a launched server to start listening (seconds).
+STARTUP_TIMEOUT = 15.0
+
+# Percentiles of the latency included in the report.
+PERCENTILES = (50, 90, 99)
+
+# Commands whose second part names the command, like 'short:sync'. The rest
+# are named by their prefix alone, like 'points'.
+TWO_PART = ('long', 'short', 'control', 'other')
+
+
+def kind(command):
+    """Returns the name under which a command's requests are counted."""
+    prefix, _, rest = command.partition(':')
+    if prefix in TWO_PART:
+        return prefix + ':' + rest.partition(':')[0]
+    return prefix
+
+
+def percentile(values, p):
+    """Returns the `p`th percentile of the sorted values (nearest rank)."""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(1, rank) - 1]
+
+
+def launch_server(port, workers=False, backend='gevent', python=None):
+    """Starts the server with the dummy Myro library on the given backend in a
+    subprocess, and waits until it accepts connections. Returns the process.
+    The server runs on the given Python interpreter (this one by default),
+    since the asyncio backend needs Python 3 while the clients need Python 2.
+    It doesn't journal, so that each run starts from the same state."""
+    cmd = [python or sys.executable, 'main.py', '-d', '-n', '-j',
+           '-p', str(port), '-k', backend]
+    if workers:
+        cmd.append('-w')
+    process = subprocess.Popen(cmd)
+    deadline = time() + STARTUP_TIMEOUT
+    while time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with status {}".format(
+                process.returncode))
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return process
+        except socket.error:
+            sleep(0.1)
+    stop_server(process)
+    raise RuntimeError("server didn't start listening")
+
+
+def stop_server(process):
+    """Interrupts the server so that it stops its workers, and kills it if it
+    doesn't exit."""
+    process.send_signal(signal.SIGINT)
+    deadline = time() + STARTUP_TIMEOUT
+    while process.poll() is None and time() < deadline:
+        sleep(0.1)
+    if process.poll() is None:
+        process.kill()
+
+
+def process_memory(pid):
+    """Returns the resident memory of the process (KiB), or None if it can't
+    be read (it is only available on Linux)."""
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def process_sockets(pid):
+    """Returns the number of sockets the process has open, or None if they
+    can't be counted (it is only possible on Linux)."""
+    fd_dir = '/proc/{}/fd'.format(pid)
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        return None
+    count = 0
+    for fd in fds:
+        try:
+            if os.readlink(os.path.join(fd_dir, fd)).startswith('socket:'):
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+class Stats(object):
+
+    """Collects the latencies and failures of the requests by kind of command,
+    along with samples of the open connections and the server's memory."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.failures = {}
+        self.in_flight = 0
+        self.samples = []
+
+    def record(self, name, latency, ok):
+        """Records a completed (or failed) request."""
+        if ok:
+            self.latencies.setdefault(name, []).append(latency)
+        else:
+            self.failures[name] = self.failures.get(name, 0) + 1
+
+    def sample(self, pid=None):
+        """Records the requests in flight, and the sockets and memory of the
+        server process if it is known."""
+        sockets = memory = None
+        if pid is not None:
+            sockets = process_sockets(pid)
+            memory = process_memory(pid)
+        self.samples.append((time(), self.in_flight, sockets, memory))
+
+    def report(self, elapsed):
+        """Returns a dictionary summarizing the run, which lasted `elapsed`
+        seconds. Latencies are in milliseconds and memory is in KiB."""
+        commands = {}
+        names = set(self.latencies) | set(self.failures)
+        for name in sorted(names):
+            values = sorted(1000 * t for t in self.latencies.get(name, []))
+            entry = {
+                'count': len(values),
+                'rate': len(values) / elapsed,
+                'failed': self.failures.get(name, 0),
+                'max': values[-1] if values else 0.0
+            }
+            for p in PERCENTILES:
+                entry['p{}'.format(p)] = percentile(values, p)
+            commands[name] = entry
+        in_flight = [s[1] for s in self.samples]
+        sockets = [s[2] for s in self.samples if s[2] is not None]
+        memory = [s[3] for s in self.samples if s[3] is not None]
+        total = sum(c['count'] for c in commands.values())
+        return {
+            'elapsed': elapsed,
+            'requests': total,
+            'rate': total / elapsed,
+            'commands': commands,
+            'in_flight': max(in_flight or [0]),
+            'sockets': max(sockets) if sockets else None,
+            'memory_start': memory[0] if memory else None,
+            'memory_end': memory[-1] if memory else None,
+            'memory_peak': max(memory) if memory else None
+        }
+
+
+class Client(object):
+
+    """A browser with the web app open, making the same requests as the
+    scripts in `public`.
+
+    Every client long-polls the status log and synchronizes periodically. Some
+    also have tracing on, and one can be the operator, who uploads a drawing
+    and keeps starting, stopping, and tuning the program. Like a browser, each
+    of these runs in its own Greenlet with its own connection.
+    """
+
+    def __init__(self, host, port, stats, robot='', tracing=False,
+                 points=None):
+        """Creates a client for the robot with the given number (an empty
+        string for the first one). It is the operator if it has points to
+        upload."""
+        self.host = host
+        self.port = port
+        self.path = '/' + robot
+        self.stats = stats
+        self.tracing = tracing
+        self.points = points
+        self.cursor = ''
+
+    def post(self, conn, command):
+        """Sends a command on the connection and returns the reply, or None if
+        the request failed. Failed connections are reopened by the next call."""
+        name = kind(command)
+        self.stats.in_flight += 1
+        start = time()
+        try:
+            conn.request('POST', self.path, command,
+                         {'Content-type': 'application/json'})
+            response = conn.getresponse()
+            body = response.read()
+            ok = response.status in (httplib.OK, httplib.NO_CONTENT)
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            body = None
+            ok = False
+        finally:
+            self.stats.in_flight -= 1
+        self.stats.record(name, time() - start, ok)
+        return body if ok else None
+
+    def connect(self):
+        """Opens a new keep-alive connection to the server."""
+        return httplib.HTTPConnection(self.host, self.port,
+                                      timeout=REQUEST_TIMEOUT)
+
+    def poll_status(self):
+        """Long-polls the status log forever, like `updateStatus`."""
+        conn = self.connect()
+        while True:
+            body = self.post(conn, 'long:status:' + self.cursor)
+            if body is None:
+                sleep(1)
+                continue
+            try:
+                self.cursor = str(json.loads(body)['cursor'])
+            except (ValueError, KeyError):
+                pass
+
+    def synchronize(self):
+        """Synchronizes every SYNC_INTERVAL forever, like `synchronize`."""
+        conn = self.connect()
+        while True:
+            self.post(conn, 'short:sync')
+            sleep(SYNC_INTERVAL)
+
+    def trace(self):
+        """Asks for the trace every TRACE_INTERVAL forever, like `syncTrace`."""
+        conn = self.connect()
+        while True:
+            self.post(conn, 'short:trace')
+            sleep(TRACE_INTERVAL)
+
+    def operate(self):
+        """Uploads the drawing, starts the program, and then goes through the
+        operator's script forever."""
+        conn = self.connect()
+        upload = 'points:' + json.dumps(self.points)
+        self.post(conn, 'program:tracie')
+        self.post(conn, upload)
+        self.post(conn, 'control:start')
+        while True:
+            for command in OPERATOR_SCRIPT:
+                sleep(OPERATOR_INTERVAL)
+                self.post(conn, command or upload)
+
+    def run(self, duration):
+        """Opens the web app and uses it for `duration` seconds."""
+        tasks = [self.poll_status, self.synchronize]
+        if self.tracing:
+            tasks.append(self.trace)
+        if self.points:
+            tasks.append(self.operate)
+        greenlets = [spawn(task) for task in tasks]
+        sleep(duration)
+        for g in greenlets:
+            g.kill()
+
+
+def load_test(host, port, clients, duration, points, ramp=0.0, robots=1,
+              pid=None, seed=None):
+    """Runs `clients` clients against the server for `duration` seconds,
+    spreading their arrival over `ramp` seconds and their robots across
+    `robots` robots. The first client is the operator. The server's memory
+    and sockets are sampled if its process ID is given. Returns the report
+    (see `Stats.report`)."""
+    rng = random.Random(seed)
+    stats = Stats()
+
+    def monitor():
+        while True:
+            stats.sample(pid)
+            sleep(SAMPLE_INTERVAL)
+
+    def arrive(i):
+        sleep(ramp * i / max(1, clients))
+        robot = str(i % robots) if robots > 1 else ''
+        tracing = rng.random() < TRACING_FRACTION
+        client = Client(host, port, stats, robot, tracing,
+                        points if i == 0 else None)
+        client.run(duration - ramp * i / max(1, clients))
+
+    sampler = spawn(monitor)
+    start = time()
+    joinall([spawn(arrive, i) for i in range(clients)])
+    elapsed = time() - start
+    stats.sample(pid)
+    sampler.kill()
+    return stats.report(elapsed)
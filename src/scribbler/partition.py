@@ -0,0 +1,254 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Splits a drawing between several robots so that they can draw it together."""
+
+import math
+from bisect import bisect_right
+
+from scribbler.programs import base, tracie
+from scribbler.programs.tracie import join_strokes
+from scribbler.util import deg_to_rad, dist_2d, equiv_angle, rad_to_deg
+
+# Ordering the strokes needs NumPy, which is optional.
+try:
+    from scribbler import strokes
+except ImportError:
+    strokes = None
+
+
+# Closest that the centres of two robots may come while drawing (cm).
+CLEARANCE = 25.0
+
+# Longest piece that the segments are cut into when splitting them between
+# robots (cm).
+PIECE_LENGTH = 5.0
+
+# Width of the strips that each robot draws one after another (cm).
+SWEEP_WIDTH = 20.0
+
+# Time between the moments compared when checking the clearance (seconds).
+CHECK_STEP = 0.5
+
+# Amount by which a robot's start is delayed when it would come too close to
+# another robot (seconds).
+DELAY_STEP = 5.0
+
+# Longest delay tried in steps before making a robot wait for the others to
+# finish instead (seconds).
+MAX_DELAY = 300.0
+
+
+def tracie_params(overrides=None):
+    """Returns Tracie's default parameters, updated with the given ones."""
+    params = dict(base.PARAM_DEFAULTS)
+    params.update(tracie.PARAM_DEFAULTS)
+    params.update(overrides or {})
+    return params
+
+
+def drive_time(params, dist):
+    """Returns how long Tracie takes to drive `dist` centimetres."""
+    return params['dist_to_time'] * dist / params['speed']
+
+
+def rotate_time(params, angle):
+    """Returns how long Tracie takes to rotate by `angle` radians."""
+    return params['angle_to_time'] * rad_to_deg(abs(angle)) / \
+        params['rotation_speed']
+
+
+def timeline(points, lifts, params, delay=0.0):
+    """Estimates when Tracie will be where while drawing the points (reaching
+    the indices in `lifts` with the pen up). Returns a list of `(t, x, y)`
+    tuples in seconds and centimetres, with the robot moving in a straight line
+    between each one and the next."""
+    scale = params['point_scale']
+    pause = params['pen_pause']
+    min_rad = deg_to_rad(params['min_rotation'])
+    x, y = points[0][0] * scale, points[0][1] * scale
+    heading = math.pi / 2
+    t = delay
+    times = [(0.0, x, y), (t, x, y)]
+    pen_up = False
+    for i in range(1, len(points)):
+        if i in lifts and not pen_up:
+            pen_up = True
+            t += pause
+            times.append((t, x, y))
+        tx, ty = points[i][0] * scale, points[i][1] * scale
+        angle = math.atan2(ty - y, tx - x)
+        delta = equiv_angle(angle - heading)
+        heading = angle
+        if abs(delta) >= min_rad:
+            t += rotate_time(params, delta)
+            times.append((t, x, y))
+        t += drive_time(params, dist_2d(x, y, tx, ty))
+        x, y = tx, ty
+        times.append((t, x, y))
+        if pen_up and i + 1 < len(points) and i + 1 not in lifts:
+            pen_up = False
+            t += pause
+            times.append((t, x, y))
+    return times
+
+
+def position(times, t):
+    """Returns the position `(x, y)` at time `t` on a timeline."""
+    k = bisect_right(times, (t, float('inf'), float('inf')))
+    if k == 0:
+        return times[0][1:]
+    if k == len(times):
+        return times[-1][1:]
+    t0, x0, y0 = times[k - 1]
+    t1, x1, y1 = times[k]
+    f = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+    return x0 + f * (x1 - x0), y0 + f * (y1 - y0)
+
+
+def too_close(a, b):
+    """Returns true if the robots following timelines `a` and `b` come within
+    CLEARANCE of each other, including while one has finished and the other is
+    still drawing."""
+    end = max(a[-1][0], b[-1][0])
+    t = 0.0
+    while t <= end + CHECK_STEP:
+        xa, ya = position(a, t)
+        xb, yb = position(b, t)
+        if dist_2d(xa, ya, xb, yb) < CLEARANCE:
+            return True
+        t += CHECK_STEP
+    return False
+
+
+def split(lines, n, params):
+    """Splits the strokes into at most `n` groups, each a band across the
+    x-axis, that take about the same time to draw. Segments are cut into
+    pieces no longer than PIECE_LENGTH first, so that long segments are shared
+    between the bands they cross."""
+    scale = params['point_scale']
+    step = PIECE_LENGTH / scale
+    pieces = []
+    for s, line in enumerate(lines):
+        heading = None
+        j = 0
+        for i in range(len(line) - 1):
+            (x1, y1), (x2, y2) = line[i], line[i+1]
+            angle = math.atan2(y2 - y1, x2 - x1)
+            length = dist_2d(x1, y1, x2, y2)
+            cuts = max(1, int(math.ceil(length / step)))
+            for k in range(cuts):
+                a = (x1 + (x2 - x1) * k / cuts, y1 + (y2 - y1) * k / cuts)
+                b = (x1 + (x2 - x1) * (k + 1) / cuts,
+                     y1 + (y2 - y1) * (k + 1) / cuts)
+                cost = drive_time(params, scale * length / cuts)
+                if k == 0 and heading is not None:
+                    cost += rotate_time(params, equiv_angle(angle - heading))
+                pieces.append(((a[0] + b[0]) / 2, s, j, k > 0, a, b, cost))
+                j += 1
+            heading = angle
+    pieces.sort()
+    total = sum(p[-1] for p in pieces)
+    bands = [[]]
+    done = 0.0
+    for piece in pieces:
+        if done >= total * len(bands) / n and len(bands) < n:
+            bands.append([])
+        bands[-1].append(piece)
+        done += piece[-1]
+    return [rejoin(band) for band in bands if band]
+
+
+def rejoin(band):
+    """Rebuilds strokes from the pieces in a band, joining the pieces that
+    follow each other in the same stroke (and merging the pieces of a single
+    segment back together)."""
+    result = []
+    last = None
+    for _, s, j, same_segment, a, b, _ in sorted(band, key=lambda p: p[1:3]):
+        if last == (s, j - 1):
+            if same_segment:
+                result[-1][-1] = b
+            else:
+                result[-1].append(b)
+        else:
+            result.append([a, b])
+        last = (s, j)
+    return result
+
+
+def sweep(band, params):
+    """Orders the strokes in a band to be drawn from left to right, a strip of
+    SWEEP_WIDTH at a time, so that all the robots sweep the same way at about
+    the same rate and each stays about a band's width from its neighbours.
+    Within each strip, the strokes are ordered to keep the travel short."""
+    width = SWEEP_WIDTH / params['point_scale']
+    band = [s if s[0][0] <= s[-1][0] else s[::-1] for s in band]
+    band.sort(key=lambda s: min(x for x, _ in s))
+    strips = []
+    for s in band:
+        strip = int(min(x for x, _ in s) // width)
+        if not strips or strips[-1][0] != strip:
+            strips.append((strip, []))
+        strips[-1][1].append(s)
+    if strokes is None:
+        return band
+    ordered = []
+    here = band[0][0]
+    for _, group in strips:
+        ordered.extend([(float(x), float(y)) for x, y in s]
+                       for s in strokes.order(group, here))
+        here = ordered[-1][-1]
+    return ordered
+
+
+def plan(lines, n, params=None):
+    """Plans how up to `n` robots can draw the strokes together. Drawings with
+    long strokes across the whole width can keep the robots waiting for each
+    other, so fewer robots are used if that finishes sooner. Returns a list
+    with a dictionary for each robot that has something to draw, containing
+    its 'strokes' in drawing order, its 'offset' from the first robot (cm), the
+    'delay' before it should start (seconds), its estimated 'time' to finish
+    (seconds, including the delay), and whether it is 'clear' of the others."""
+    params = tracie_params(params)
+    plans = [plan_for(lines, k, params) for k in range(1, n + 1)]
+    return min(plans, key=lambda p: max([r['time'] for r in p] or [0]))
+
+
+def plan_for(lines, n, params):
+    """Plans how exactly `n` robots can draw the strokes (see `plan`)."""
+    robots = []
+    for band in split(lines, n, params):
+        band = sweep(band, params)
+        points, lifts = join_strokes(band)
+        robots.append({'strokes': band, 'points': points, 'lifts': lifts})
+    schedule(robots, params)
+    scale = params['point_scale']
+    x0, y0 = robots[0]['points'][0] if robots else (0, 0)
+    for robot in robots:
+        x, y = robot.pop('points')[0]
+        del robot['lifts']
+        robot['offset'] = (scale * (x - x0), scale * (y - y0))
+        robot['time'] = robot.pop('timeline')[-1][0]
+    return robots
+
+
+def schedule(robots, params):
+    """Delays the start of each robot until its path stays clear of the robots
+    before it. If no delay up to MAX_DELAY works, the robot waits until the
+    robots it would come too close to have finished."""
+    for j, robot in enumerate(robots):
+        others = robots[:j]
+        times = timeline(robot['points'], robot['lifts'], params)
+        blocking = [o for o in others if too_close(times, o['timeline'])]
+        steps = int(MAX_DELAY / DELAY_STEP) + 1
+        delays = [DELAY_STEP * k for k in range(steps)]
+        if blocking:
+            delays.append(max(o['timeline'][-1][0] for o in blocking))
+        for delay in delays:
+            times = timeline(robot['points'], robot['lifts'], params, delay)
+            clear = not any(too_close(times, o['timeline']) for o in others)
+            if clear:
+                break
+        robot['delay'] = delay
+        robot['timeline'] = times
+        robot['clear'] = clear
@@ -0,0 +1,73 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Estimates the robot's pose by dead reckoning from its motor commands."""
+
+import math
+
+
+# Variance of the position error added per centimetre driven (cm^2/cm).
+DIST_VAR = 0.01
+
+# Variance of the heading error added per radian rotated (rad^2/rad).
+ANGLE_VAR = 0.002
+
+
+class Pose(object):
+
+    """Tracks the position (cm) and heading (radians, in standard position) of
+    the robot, along with an estimate of their uncertainty.
+
+    The pose is only updated when the motion changes: between changes the robot
+    moves with a constant velocity and turn rate, so the pose at any time can
+    be found in constant time without touching the stored state. The robot
+    starts at the origin facing up (in the positive y direction).
+    """
+
+    def __init__(self, now=0.0):
+        """Creates a pose for a stationary robot at the origin."""
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = math.pi / 2
+        self.velocity = 0.0
+        self.turn_rate = 0.0
+        self.since = now
+        self.pos_var = 0.0
+        self.heading_var = 0.0
+
+    def at(self, now):
+        """Returns the estimated `(x, y, heading)` at the given time."""
+        dt = now - self.since
+        v, w, theta = self.velocity, self.turn_rate, self.heading
+        if dt <= 0 or (v == 0 and w == 0):
+            return self.x, self.y, theta
+        if w == 0:
+            return (self.x + v * math.cos(theta) * dt,
+                    self.y + v * math.sin(theta) * dt,
+                    theta)
+        new_theta = theta + w * dt
+        return (self.x + v / w * (math.sin(new_theta) - math.sin(theta)),
+                self.y - v / w * (math.cos(new_theta) - math.cos(theta)),
+                new_theta)
+
+    def move(self, now, velocity, turn_rate):
+        """Brings the pose up to date and changes the motion of the robot to the
+        given velocity (cm/s) and turn rate (rad/s)."""
+        dt = max(0, now - self.since)
+        dist = abs(self.velocity) * dt
+        angle = abs(self.turn_rate) * dt
+        self.x, self.y, self.heading = self.at(now)
+        self.pos_var += DIST_VAR * dist + self.heading_var * dist * dist
+        self.heading_var += ANGLE_VAR * angle
+        self.velocity = velocity
+        self.turn_rate = turn_rate
+        self.since = now
+
+    @property
+    def uncertainty(self):
+        """Returns the standard deviation of the position estimate (cm)."""
+        return math.sqrt(self.pos_var)
+
+    @property
+    def heading_uncertainty(self):
+        """Returns the standard deviation of the heading estimate (radians)."""
+        return math.sqrt(self.heading_var)
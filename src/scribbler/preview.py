@@ -0,0 +1,259 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Previews what Tracie will draw, comparing the motion it plans with the path
+a robot would actually take."""
+
+import base64
+import math
+import struct
+import zlib
+
+import numpy as np
+
+
+# Image formats that previews can be rendered in.
+FORMATS = ['svg', 'png']
+
+# Relative standard deviation of the motor noise in the simulated execution,
+# the same as the default for tuning.
+NOISE = 0.02
+
+# Default width of the rendered image (pixels).
+WIDTH = 800
+
+# Widest image that can be asked for (pixels).
+MAX_WIDTH = 4000
+
+# Blank space around the drawing (pixels).
+MARGIN = 10
+
+# Colours of the planned and the executed paths, each as a hex string for SVG
+# and as RGB for PNG. Travel with the pen up is dashed in SVG and drawn in a
+# lighter tint in PNG.
+PLANNED_COLOR = '#3366cc', (51, 102, 204)
+EXECUTED_COLOR = '#cc3333', (204, 51, 51)
+PLANNED_TRAVEL = (173, 194, 235)
+EXECUTED_TRAVEL = (235, 173, 173)
+
+# Signature at the start of every PNG file.
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def plan(points, params):
+    """Returns the motions that Tracie plans for the points (in pixels, with
+    the first at the origin): the rotation before each segment (radians,
+    counterclockwise, zero if it is skipped for being under `min_rotation`)
+    and the distance driven (cm), along with the positions the robot expects
+    to reach, starting at the origin.
+
+    Like Tracie, each motion is aimed from the position reached by the last
+    rather than from the previous point. That makes each depend on the one
+    before, so this is the only part of a preview that isn't vectorized.
+    """
+    scale = params['point_scale']
+    min_rad = math.radians(params['min_rotation'])
+    atan2, hypot, cos, sin = math.atan2, math.hypot, math.cos, math.sin
+    pi, tau = math.pi, 2 * math.pi
+    x = y = 0.0
+    heading = pi / 2
+    turns, dists = [], []
+    xs, ys = [x], [y]
+    for px, py in points[1:]:
+        dx, dy = scale * px - x, scale * py - y
+        angle = atan2(dy, dx)
+        delta = (angle - heading + pi) % tau - pi
+        if abs(delta) < min_rad:
+            delta = 0.0
+        else:
+            heading = angle
+        dist = hypot(dx, dy)
+        x += dist * cos(heading)
+        y += dist * sin(heading)
+        turns.append(delta)
+        dists.append(dist)
+        xs.append(x)
+        ys.append(y)
+    return np.array(turns), np.array(dists), np.column_stack((xs, ys))
+
+
+def execute(turns, dists, params, dist_to_time=None, angle_to_time=None,
+            noise=NOISE, seed=None):
+    """Returns the positions that the robot really reaches when it makes the
+    planned motions, like the robot in `scribbler.sim`. Its true conversion
+    factors are `dist_to_time` and `angle_to_time` (the calibrated ones if
+    not given), and each motion is off by Gaussian noise with the relative
+    standard deviation `noise`. Since Tracie only knows where it is by dead
+    reckoning, the errors are never corrected and build up along the way."""
+    rng = np.random.RandomState(seed)
+    drive_gain = params['dist_to_time'] / (dist_to_time or
+                                           params['dist_to_time'])
+    turn_gain = params['angle_to_time'] / (angle_to_time or
+                                           params['angle_to_time'])
+    turns = turns * turn_gain * (1 + noise * rng.standard_normal(len(turns)))
+    dists = dists * drive_gain * (1 + noise * rng.standard_normal(len(dists)))
+    headings = math.pi / 2 + np.cumsum(turns)
+    steps = dists[:, None] * np.column_stack((np.cos(headings),
+                                              np.sin(headings)))
+    return np.vstack((np.zeros((1, 2)), np.cumsum(steps, axis=0)))
+
+
+def drawn_mask(n, lifts):
+    """Returns a boolean array telling whether each of the segments between
+    `n` points is drawn, as opposed to travelled with the pen up."""
+    mask = np.ones(max(0, n - 1), dtype=bool)
+    lifts = [i - 1 for i in lifts if 0 < i < n]
+    mask[lifts] = False
+    return mask
+
+
+def errors(a, b):
+    """Returns the maximum and mean distance between corresponding points."""
+    dist = np.hypot(*(a - b).T)
+    return {'max': float(dist.max()), 'mean': float(dist.mean())}
+
+
+def statistics(targets, turns, dists, planned, executed, drawn):
+    """Returns the deviation statistics of a preview (in cm): how far the
+    planned positions are from the points (because of skipped rotations) and
+    how far the executed positions are from the planned ones."""
+    drift = errors(executed, planned)
+    drift['final'] = float(np.hypot(*(executed[-1] - planned[-1])))
+    return {
+        'segments': len(dists),
+        'rotations': int(np.count_nonzero(turns)),
+        'drawn': float(dists[drawn].sum()),
+        'travel': float(dists[~drawn].sum()),
+        'plan_error': errors(planned, targets),
+        'error': drift
+    }
+
+
+def frame(paths, width):
+    """Returns a function that converts positions (cm) into pixels so that
+    all the paths fit in an image `width` pixels wide, with the y-axis
+    pointing down, and the height of the image."""
+    pts = np.vstack(paths)
+    lo = pts.min(axis=0)
+    span = pts.max(axis=0) - lo
+    scale = (width - 2 * MARGIN) / max(span.max(), 1e-9)
+    height = int(math.ceil(span[1] * scale)) + 2 * MARGIN
+    def to_pixels(p):
+        return np.column_stack((MARGIN + (p[:, 0] - lo[0]) * scale,
+                                height - MARGIN - (p[:, 1] - lo[1]) * scale))
+    return to_pixels, height
+
+
+def path_data(xy, mask):
+    """Returns the SVG path data for the segments of the polyline that are
+    selected by the mask, starting a new subpath after each gap."""
+    seg = np.flatnonzero(mask)
+    if not len(seg):
+        return ''
+    starts = seg[np.r_[True, np.diff(seg) > 1]]
+    verts = np.concatenate((starts, seg + 1))
+    order = np.argsort(np.concatenate((2 * starts, 2 * seg + 1)),
+                       kind='mergesort')
+    lines = np.concatenate((np.zeros(len(starts), dtype=bool),
+                            np.ones(len(seg), dtype=bool)))[order]
+    fmt = ''.join(np.where(lines, 'L%.1f %.1f', 'M%.1f %.1f'))
+    return fmt % tuple(xy[verts[order]].ravel())
+
+
+def render_svg(planned, executed, drawn, width):
+    """Renders the planned and executed paths as an SVG document."""
+    to_pixels, height = frame((planned, executed), width)
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+        'viewBox="0 0 {0} {1}">'.format(width, height),
+        '<rect width="100%" height="100%" fill="white"/>'
+    ]
+    for path, (color, _) in ((planned, PLANNED_COLOR),
+                             (executed, EXECUTED_COLOR)):
+        xy = to_pixels(path)
+        for mask, dash in ((~drawn, ' stroke-dasharray="4 3"'), (drawn, '')):
+            d = path_data(xy, mask)
+            if d:
+                parts.append('<path d="{}" fill="none" stroke="{}"{}/>'
+                             .format(d, color, dash))
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+def rasterize(img, xy, mask, color):
+    """Draws the segments of the polyline (in pixels) that are selected by the
+    mask onto the image, by sampling each segment about once per pixel."""
+    a, b = xy[:-1][mask], xy[1:][mask]
+    if not len(a):
+        return
+    n = np.ceil(np.hypot(*(b - a).T)).astype(int) + 1
+    which = np.repeat(np.arange(len(n)), n)
+    step = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    t = step / np.maximum(n - 1, 1)[which].astype(float)
+    p = np.rint(a[which] + (b - a)[which] * t[:, None]).astype(int)
+    h, w, _ = img.shape
+    inside = (p[:, 0] >= 0) & (p[:, 0] < w) & (p[:, 1] >= 0) & (p[:, 1] < h)
+    img[p[inside, 1], p[inside, 0]] = color
+
+
+def png_chunk(tag, data):
+    """Returns a PNG chunk with its length and checksum."""
+    crc = zlib.crc32(tag + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+
+def encode_png(img):
+    """Encodes an RGB image (an array of bytes) as a PNG file."""
+    h, w, _ = img.shape
+    raw = np.zeros((h, 1 + 3 * w), dtype=np.uint8)
+    raw[:, 1:] = img.reshape(h, -1)
+    header = struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)
+    return (PNG_SIGNATURE + png_chunk(b'IHDR', header) +
+            png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) +
+            png_chunk(b'IEND', b''))
+
+
+def render_png(planned, executed, drawn, width):
+    """Renders the planned and executed paths as a PNG file."""
+    to_pixels, height = frame((planned, executed), width)
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    planned, executed = to_pixels(planned), to_pixels(executed)
+    rasterize(img, planned, ~drawn, PLANNED_TRAVEL)
+    rasterize(img, executed, ~drawn, EXECUTED_TRAVEL)
+    rasterize(img, planned, drawn, PLANNED_COLOR[1])
+    rasterize(img, executed, drawn, EXECUTED_COLOR[1])
+    return encode_png(img)
+
+
+def preview(points, lifts, params, fmt='svg', width=WIDTH, noise=NOISE,
+            seed=None, dist_to_time=None, angle_to_time=None):
+    """Previews the drawing of the points (with the pen lifted to travel to
+    the indices in `lifts`) using Tracie's parameters. Returns a dictionary
+    with the image (SVG text, or a PNG file in base64) and the deviation
+    statistics. The execution is simulated as described in `execute`. Raises
+    ValueError if an option is invalid."""
+    if fmt not in FORMATS:
+        raise ValueError("format must be one of " + ', '.join(FORMATS))
+    width = int(width)
+    if not 2 * MARGIN < width <= MAX_WIDTH:
+        raise ValueError("width must be between {} and {}".format(
+            2 * MARGIN + 1, MAX_WIDTH))
+    if len(points) < 2:
+        raise ValueError("not enough points")
+    noise = float(noise)
+    if not noise >= 0:
+        raise ValueError("noise must be at least 0")
+    targets = params['point_scale'] * np.array(points, dtype=float)
+    turns, dists, planned = plan(points, params)
+    executed = execute(turns, dists, params, dist_to_time, angle_to_time,
+                       noise, seed)
+    drawn = drawn_mask(len(points), lifts)
+    if fmt == 'svg':
+        image = render_svg(planned, executed, drawn, width)
+    else:
+        image = base64.b64encode(
+            render_png(planned, executed, drawn, width)).decode('ascii')
+    return {
+        'format': fmt,
+        'image': image,
+        'stats': statistics(targets, turns, dists, planned, executed, drawn)
+    }
@@ -0,0 +1,244 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Profiles the running server by sampling its stacks, so that a sluggish
+control loop can be examined without restarting it under a profiler."""
+
+import gc
+import sys
+import threading
+from collections import Counter
+from time import sleep as thread_sleep, time
+
+try:
+    import thread
+except ImportError:
+    import _thread as thread
+
+try:
+    from gevent import monkey, sleep
+except ImportError:
+    monkey = sleep = None
+
+try:
+    from greenlet import greenlet
+except ImportError:
+    greenlet = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Time between stack samples (seconds).
+SAMPLE_INTERVAL = 0.005
+
+# Longest profile allowed (seconds), so that a typo can't leave it running.
+MAX_DURATION = 60.0
+
+# Deepest stack recorded (frames). Deeper stacks are cut off at the root.
+MAX_DEPTH = 64
+
+# Number of rows in the table of allocations.
+TOP_ALLOCATIONS = 20
+
+# Number of frames kept for each allocation traced by tracemalloc.
+TRACE_FRAMES = 1
+
+# Starts a real thread even if the threading module is monkey-patched, since
+# the sampler must keep running while the greenlets are busy.
+if monkey is None:
+    start_new_thread, get_ident = thread.start_new_thread, thread.get_ident
+else:
+    start_new_thread = monkey.get_original(thread.__name__, 'start_new_thread')
+    get_ident = monkey.get_original(thread.__name__, 'get_ident')
+
+# The thread that runs the greenlets, which is the one importing this module.
+main_ident = get_ident()
+
+# Whether a profile is being taken. Only one can run at a time.
+active = False
+
+
+def frame_label(frame):
+    """Returns the name of the function running in the frame, qualified by its
+    module."""
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return "{}:{}".format(frame.f_globals.get('__name__', '?'), name)
+
+
+def stack_of(frame):
+    """Returns the labels of the frame and its callers, outermost first."""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+def collapse(counts):
+    """Returns counted stacks in the collapsed format read by flame graph
+    tools: one line per stack, with the frames separated by semicolons and
+    followed by the count. The most common stacks come first."""
+    return ["{} {}".format(';'.join(stack), n)
+            for stack, n in counts.most_common()]
+
+
+class Sampler(object):
+
+    """Samples the stacks of all the threads from a separate thread.
+
+    All the greenlets share the main thread, so its samples show whichever one
+    was running, and time spent idle in the hub shows up as the hub's stack.
+    Sampling only reads the frames, so it doesn't disturb the program.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.stopping = False
+        self.done = False
+        self.ident = None
+
+    def thread_names(self):
+        """Returns the names of the known threads by their IDs."""
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        names[main_ident] = 'main'
+        return names
+
+    def run(self):
+        """Takes samples until told to stop."""
+        self.ident = get_ident()
+        try:
+            names = self.thread_names()
+            while not self.stopping:
+                for ident, frame in sys._current_frames().items():
+                    if ident == self.ident:
+                        continue
+                    name = names.get(ident, "thread-{}".format(ident))
+                    self.counts[(name,) + stack_of(frame)] += 1
+                self.samples += 1
+                thread_sleep(self.interval)
+        finally:
+            self.done = True
+
+    def start(self):
+        """Starts sampling in a new thread."""
+        start_new_thread(self.run, ())
+
+
+def parked_greenlets():
+    """Returns the collapsed stacks of the greenlets that are waiting to run,
+    showing where each one is blocked."""
+    if greenlet is None:
+        return []
+    counts = Counter()
+    for obj in gc.get_objects():
+        if isinstance(obj, greenlet) and obj.gr_frame is not None:
+            counts[stack_of(obj.gr_frame)] += 1
+    return collapse(counts)
+
+
+def allocation_table(before, after):
+    """Returns the lines that allocated the most memory between two tracemalloc
+    snapshots, leaving out the profiler itself."""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, __file__.replace('.pyc', '.py'))]
+    before = before.filter_traces(ignore)
+    after = after.filter_traces(ignore)
+    rows = []
+    for stat in after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        rows.append({
+            'where': "{}:{}".format(frame.filename, frame.lineno),
+            'size_diff': stat.size_diff,
+            'size': stat.size,
+            'count_diff': stat.count_diff
+        })
+    return rows
+
+
+def limit(duration):
+    """Returns the duration of a profile (seconds), kept within MAX_DURATION."""
+    return min(max(0.0, duration), MAX_DURATION)
+
+
+class Profile(object):
+
+    """A profile of the stacks, and of the allocations unless `allocations` is
+    false. Waiting for it to be over is left to the caller, so that it works
+    with any concurrency backend."""
+
+    def __init__(self, allocations=True):
+        self.trace = allocations and tracemalloc is not None
+        self.started_tracing = False
+        self.sampler = Sampler()
+        self.before = self.after = None
+        self.started = self.elapsed = None
+
+    def start(self):
+        """Starts sampling and tracing allocations."""
+        global active
+        active = True
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self.started_tracing = True
+        if self.trace:
+            self.before = tracemalloc.take_snapshot()
+        self.started = time()
+        self.sampler.start()
+
+    def stop(self):
+        """Tells the sampler to stop, and stops tracing allocations. The
+        results are ready once `done` is true."""
+        global active
+        self.sampler.stopping = True
+        self.elapsed = time() - self.started
+        try:
+            if self.trace:
+                self.after = tracemalloc.take_snapshot()
+        finally:
+            if self.started_tracing:
+                tracemalloc.stop()
+            active = False
+
+    @property
+    def done(self):
+        """Returns true when the sampling thread has finished."""
+        return self.sampler.done
+
+    def results(self):
+        """Returns a dictionary with the collapsed stacks, the stacks of the
+        parked greenlets, and the table of allocations (None if they weren't
+        traced)."""
+        table = None
+        if self.after is not None:
+            table = allocation_table(self.before, self.after)
+        return {
+            'duration': self.elapsed,
+            'samples': self.sampler.samples,
+            'interval': self.sampler.interval,
+            'stacks': collapse(self.sampler.counts),
+            'greenlets': parked_greenlets(),
+            'allocations': table
+        }
+
+
+def profile(duration, allocations=True):
+    """Profiles the process for `duration` seconds (see Profile), waiting in a
+    Greenlet so that the others keep running. Returns the results, or a string
+    explaining why the profile couldn't be taken."""
+    if active:
+        return "already profiling"
+    prof = Profile(allocations)
+    prof.start()
+    try:
+        sleep(limit(duration))
+    finally:
+        prof.stop()
+    while not prof.done:
+        sleep(SAMPLE_INTERVAL)
+    return prof.results()
@@ -0,0 +1,115 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Stores the calibrated parameters of each robot, so that they survive
+restarts."""
+
+from __future__ import print_function
+
+import json
+import os
+import re
+from threading import Lock
+from time import time
+
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace
+
+from scribbler.battery import load_model
+
+
+# Directory that holds a JSON profile for each robot.
+PROFILE_DIR = 'profiles'
+
+# Characters of a robot ID that can't be used in a file name.
+UNSAFE_CHARS = re.compile(r'[^\w.-]')
+
+# Number of entries kept in each list of records in a profile.
+MAX_RECORDS = 50
+
+# Held while a profile is read and written back, so that writers in different
+# threads don't lose each other's changes.
+lock = Lock()
+
+
+def profile_path(robot):
+    """Returns the path of the profile for the robot with the given ID (such as
+    its Bluetooth port)."""
+    name = UNSAFE_CHARS.sub('_', os.path.basename(robot.rstrip('/')))
+    return os.path.join(PROFILE_DIR, name + '.json')
+
+
+def load(robot):
+    """Returns the robot's profile, or an empty dictionary if it has none. A
+    profile has the calibrated 'params', and may have other information about
+    the calibration."""
+    if robot is None:
+        return {}
+    path = profile_path(robot)
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except IOError:
+        return {}
+    except ValueError as e:
+        print("warning: ignoring bad profile {}: {}".format(path, e))
+        return {}
+    return profile if isinstance(profile, dict) else {}
+
+
+def save(robot, params, **info):
+    """Saves the calibrated parameters (and any other information) in the
+    robot's profile, keeping the parameters calibrated earlier that aren't
+    being replaced. Returns the path of the profile."""
+    with lock:
+        profile = load(robot)
+        profile.update(info)
+        profile.setdefault('params', {}).update(params)
+        return write(robot, profile)
+
+
+def record(robot, key, entry):
+    """Appends an entry (a dictionary) to the list of records under `key` in
+    the robot's profile, keeping the latest MAX_RECORDS. Returns the path of
+    the profile."""
+    with lock:
+        profile = load(robot)
+        records = profile.get(key)
+        if not isinstance(records, list):
+            records = []
+        records.append(entry)
+        profile[key] = records[-MAX_RECORDS:]
+        return write(robot, profile)
+
+
+def write(robot, profile):
+    """Writes the robot's profile and returns its path. The profile is written
+    to a temporary file that then replaces the old one, so that a crash can't
+    leave it half written."""
+    profile['robot'] = robot
+    profile['saved'] = time()
+    path = profile_path(robot)
+    if not os.path.isdir(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    replace(temp, path)
+    return path
+
+
+def apply(program, robot):
+    """Makes the calibrated parameters in the robot's profile the program's
+    defaults, for the parameters that the program has, and corrects them for
+    the battery voltage according to the profile. Returns true if there were
+    any."""
+    profile = load(robot)
+    program.voltage_model = load_model(profile)
+    params = profile.get('params', {})
+    params = dict((k, v) for k, v in params.items() if k in program.params)
+    if params:
+        program.add_params(params, {})
+    return bool(params)
@@ -2,8 +2,14 @@
 
 """Makes the Scribbler Bot drive around an obstacle."""
 
-from scribbler.util import average
-from scribbler.programs.base import ModeProgram
+import math
+import os
+
+from scribbler.grid import FREE, OCCUPIED, UNKNOWN, OccupancyGrid
+from scribbler.protocol import Failure, command
+from scribbler.util import equiv_angle
+from scribbler.programs.machine import (
+    CCW, CW, START, Branch, Exit, MachineProgram, Mode)
 
 
 # Short codes for the parameters of the program.
@@ -29,185 +35,234 @@ PARAM_DEFAULTS = {
     'overshoot_front': 10.0, # cm
     'overshoot_side': 14.0, # cm
     'bias': 0, # from -1 to 1
-    'return_factor': 0.75
+    'return_factor': 1.0
 }
 
-# Statuses to be displayed at the beginning of each mode.
-STATUSES = {
-    'fwd-1': "driving forward",
-    'ccw-c': "checking slant",
-    'cw-c': "unchecking slant",
-    'ccw-1': "turning 90 ccw",
-    'fwd-2': "driving along",
-    'cw-1': "checking obstacle",
-    'ccw-2': "unturning",
-    'fwd-3': "going further",
-    'cw-2': "returning",
-    'fwd-4': "past front edge",
-    'fwd-5': "past back edge",
-    'ccw-3': "straightening up"
-}
+# Where to go after driving along the obstacle: if the map already knows
+# whether the obstacle is still beside the robot, there is no need to turn and
+# check (in cw-1) and turn back again.
+AFTER_ALONG = Branch('flag', 'side_blocked', 'fwd-2',
+                     Branch('flag', 'side_clear', 'fwd-3', 'cw-1'))
+
+# Modes of the program, starting with the one after the implicit start mode.
+# The slant checks and the drives near the obstacle use the slower speed.
+MODES = [
+    Mode('fwd-1', 'fwd', "driving forward", [
+        Exit('obstacle', 'obstacle_thresh',
+             Branch('flag', 'side_known', 'ccw-1', 'ccw-c'), 'record_obstacle')
+    ], speed='obstacle_slowdown'),
+    Mode('ccw-c', 'ccw', "checking slant", [
+        Exit('rotated', 'compare_rotation', 'cw-c', 'compare_slant')
+    ], speed='obstacle_slowdown'),
+    Mode('cw-c', 'cw', "unchecking slant", [
+        Exit('rotated', 'compare_rotation', 'ccw-1', 'choose_side')
+    ], speed='obstacle_slowdown'),
+    Mode('ccw-1', 'ccw', "turning 90 ccw", [
+        Exit('right_angle', to='fwd-2')
+    ]),
+    Mode('fwd-2', 'fwd', "driving along", [
+        Exit('travelled', 'check_dist', AFTER_ALONG)
+    ]),
+    Mode('cw-1', 'cw', "checking obstacle", [
+        Exit('right_angle', to=Branch(
+            'fresh_obstacle', 'obstacle_thresh', 'ccw-1', 'ccw-2'),
+             action='halt')
+    ]),
+    Mode('ccw-2', 'ccw', "unturning", [
+        Exit('right_angle', to='fwd-3')
+    ]),
+    Mode('fwd-3', 'fwd', "going further", [
+        Exit('travelled', 'overshoot_front', 'cw-2')
+    ]),
+    Mode('cw-2', 'cw', "returning", [
+        Exit('right_angle', to=Branch('flag', 'at_front', 'fwd-4', 'fwd-5'))
+    ]),
+    Mode('fwd-4', 'fwd', "past front edge", [
+        Exit('travelled', 'overshoot_side', AFTER_ALONG, 'leave_front'),
+        Exit('obstacle', 'obstacle_thresh', 'ccw-1', 'halt')
+    ], speed='obstacle_slowdown'),
+    Mode('fwd-5', 'fwd', "past back edge", [
+        Exit('travelled', 'return_dist', 'ccw-3'),
+        Exit('obstacle', 'obstacle_thresh', 'ccw-1', 'halt')
+    ], speed='obstacle_slowdown'),
+    Mode('ccw-3', 'ccw', "straightening up", [
+        Exit('rotated', 'straighten_angle')
+    ])
+]
+
+# Largest uncertainty in the position (cm) for which the map is trusted.
+MAX_MAP_UNCERTAINTY = 4.0
+
+# Directory that maps are saved to and loaded from. Clients can only name a
+# file in it, never give a path.
+MAP_DIR = 'maps'
+
+# File that the map is saved to and loaded from by default.
+MAP_FILE = 'avoider-map.json'
+
+# Prefix used in commands that save, load, or clear the map.
+MAP_PREFIX = 'map:'
+
+# Smallest cosine of the angle between the heading and the x-axis for which the
+# robot drives straight back to the line. Otherwise it is nearly parallel to
+# the line, and it drives the perpendicular distance instead.
+MIN_RETURN_COS = 0.2
 
 
-class Avoider(ModeProgram):
+def map_path(name):
+    """Returns the path of the map file with the given name in MAP_DIR. Raises
+    ValueError if the name is not a bare file name."""
+    if name in ('', '.', '..') or os.path.basename(name) != name or '/' in name:
+        raise ValueError("not a file name: " + name)
+    return os.path.join(MAP_DIR, name)
+
+
+class Avoider(MachineProgram):
 
     """The fourth generation of the object avoidance program."""
 
+    # What the robot knows about the obstacle it is going around.
+    checkpoint_attrs = MachineProgram.checkpoint_attrs + (
+        'around_mult_f', 'around_mult', 'first_obstacle_reading',
+        'obstacle_pos', 'remembered_side', 'at_front')
+
     def __init__(self):
-        ModeProgram.__init__(self, 0)
+        MachineProgram.__init__(self, MODES, 'fwd-1', "restarting program")
         self.add_params(PARAM_DEFAULTS, PARAM_CODES)
 
+    @command(MAP_PREFIX, arg='string')
+    def map_command(self, arg):
+        """Saves, loads, or clears the map and returns a status message. The
+        argument is the action, followed by '=' and the name of the file in
+        MAP_DIR for saving or loading if it isn't MAP_FILE."""
+        action, _, name = arg.partition('=')
+        if action == 'clear':
+            self.grid.clear()
+            return "map cleared"
+        try:
+            if action == 'save':
+                path = map_path(name or MAP_FILE)
+                if not os.path.isdir(MAP_DIR):
+                    os.makedirs(MAP_DIR)
+                self.grid.save(path)
+                return "map saved to " + path
+            if action == 'load':
+                path = map_path(name or MAP_FILE)
+                self.grid.load(path)
+                return "map loaded from " + path
+        except (IOError, OSError, ValueError) as e:
+            return Failure("map {} failed: {}".format(action, e))
+        return Failure("invalid map command: " + action)
+
     def reset(self):
-        ModeProgram.reset(self)
-        self.x_pos = 0
-        self.heading = 'up'
+        # The map persists across resets, since the course doesn't change.
+        if not hasattr(self, 'grid'):
+            self.grid = OccupancyGrid()
+        MachineProgram.reset(self)
+
+    def reset_course(self):
+        """Forgets everything about the last obstacle. The pose is kept, since
+        the line the robot drives along is always the y-axis."""
         self.around_mult_f = 1
         self.around_mult = 1
         self.first_obstacle_reading = 0
-        self.side = 'front'
+        self.obstacle_pos = (0, 0)
+        self.remembered_side = None
+        self.at_front = True
+
+    @property
+    def turn_mult(self):
+        return self.around_mult
+
+    @property
+    def return_dist(self):
+        """Returns the distance to drive along the current heading to get back
+        to the original line, according to the pose estimate."""
+        x, _, heading = self.position()
+        c = math.cos(heading)
+        if x * c < 0 and abs(c) > MIN_RETURN_COS:
+            dist = -x / c
+        else:
+            dist = abs(x)
+        return dist * self.params['return_factor']
+
+    @property
+    def straighten_angle(self):
+        """Returns how far to rotate (degrees) in the current mode's direction
+        to face along the line again, according to the pose estimate."""
+        _, _, heading = self.position()
+        delta = equiv_angle(math.pi / 2 - heading)
+        return max(0, math.degrees(self.around_mult * delta))
+
+    def side_knowledge(self):
+        """Returns what the map knows about the space that the robot would
+        see if it turned to check beside it (UNKNOWN if the robot isn't sure
+        enough of its position to use the map)."""
+        if self.pose.uncertainty > MAX_MAP_UNCERTAINTY:
+            return UNKNOWN
+        x, y, heading = self.position()
+        return self.grid.probe(x, y, heading - self.around_mult * math.pi / 2)
+
+    @property
+    def side_blocked(self):
+        return self.side_knowledge() == OCCUPIED
+
+    @property
+    def side_clear(self):
+        return self.side_knowledge() == FREE
 
     @property
-    def speed(self):
-        if self.mode in ['fwd-1', 'ccw-c', 'cw-c', 'fwd-4', 'fwd-5']:
-            return self.params['obstacle_slowdown']
-        return self.params['speed']
-
-    def status(self):
-        """Return the status message that should be displayed at the beginning
-        of the current mode."""
-        return STATUSES.get(self.mode, "bad mode" + str(self.mode))
-
-    def goto(self, mode):
-        """Switches to the given mode and returns its status."""
-        self.goto_mode(mode)
-        return self.status()
-
-    def mode_direction(self):
-        """Returns the identifier of the direction of motion for this mode."""
-        if self.mode == 0:
-            return None
-        return self.mode.split('-')[0]
-
-    def has_rotated(self, angle):
-        """Returns true if the robot has rotated by `angle` degrees during the
-        current mode (assuming it is pivoting) and false otherwise. Takes the
-        side of the box and the bias parameter into account."""
-        d = self.mode_direction()
+    def side_known(self):
+        return self.remembered_side is not None
+
+    def obstacle(self, fresh=False):
+        """Reads the obstacle sensors and adds the reading to the map."""
+        reading = MachineProgram.obstacle(self, fresh)
+        x, y, heading = self.position()
+        detected = reading > self.params['obstacle_thresh']
+        self.grid.observe(x, y, heading, detected)
+        return reading
+
+    def rotation_time(self, angle):
+        """Takes the side of the box and the bias parameter into account."""
+        d = self.directions[self.mode]
         m = self.around_mult
         t = self.angle_to_time(angle)
-        if d == 'ccw':
+        if d == CCW:
             t *= 1 + m * self.params['bias']
-        elif d == 'cw':
+        elif d == CW:
             t *= 1 - m * self.params['bias']
-        return self.has_elapsed(t)
-
-    def move(self):
-        ModeProgram.move(self)
-        direction = self.mode_direction()
-        if direction == 'fwd':
-            myro.forward(self.speed)
-        if direction == 'bwd':
-            myro.backward(self.speed)
-        if direction == 'ccw':
-            myro.rotate(self.around_mult * self.speed)
-        if direction == 'cw':
-            myro.rotate(self.around_mult * -self.speed)
-
-    def loop(self):
-        ModeProgram.loop(self)
-        if self.mode == 0:
-            return self.goto('fwd-1')
-        if self.mode == 'fwd-1':
-            d = obstacle_average()
-            if d > self.params['obstacle_thresh']:
-                self.first_obstacle_reading = d
-                return self.goto('ccw-c')
-        if self.mode == 'ccw-c':
-            if self.has_rotated(self.params['compare_rotation']):
-                myro.stop()
-                d = obstacle_average()
-                if d < self.first_obstacle_reading:
-                    self.around_mult_f = 1
-                else:
-                    self.around_mult_f = -1
-                return self.goto('cw-c')
-        if self.mode == 'cw-c':
-            if self.has_rotated(self.params['compare_rotation']):
-                self.around_mult = self.around_mult_f
-                return self.goto('ccw-1')
-        if self.mode == 'ccw-1':
-            if self.at_right_angle():
-                return self.goto('fwd-2')
-        if self.mode == 'fwd-2':
-            if self.has_travelled(self.params['check_dist']):
-                return self.goto('cw-1')
-        if self.mode == 'cw-1':
-            if self.at_right_angle():
-                myro.stop()
-                if obstacle_average() > self.params['obstacle_thresh']:
-                    return self.goto('ccw-1')
-                else:
-                    return self.goto('ccw-2')
-        if self.mode == 'ccw-2':
-            if self.at_right_angle():
-                return self.goto('fwd-3')
-        if self.mode == 'fwd-3':
-            if self.has_travelled(self.params['overshoot_front']):
-                return self.goto('cw-2')
-        if self.mode == 'cw-2':
-            if self.at_right_angle():
-                if self.side == 'front':
-                    return self.goto('fwd-4')
-                else:
-                    return self.goto('fwd-5')
-        if self.mode == 'fwd-4':
-            if self.has_travelled(self.params['overshoot_side']):
-                self.side = 'side'
-                return self.goto('cw-1')
-            if obstacle_average() > self.params['obstacle_thresh']:
-                myro.stop()
-                return self.goto('ccw-1')
-        if self.mode == 'fwd-5':
-            if self.has_travelled(self.x_pos * self.params['return_factor']):
-                return self.goto('ccw-3')
-            if obstacle_average() > self.params['obstacle_thresh']:
-                myro.stop()
-                return self.goto('ccw-1')
-        if self.mode == 'ccw-3':
-            if self.at_right_angle():
-                self.reset()
-                self.start()
-                return "restarting program"
-
-    def end_mode(self):
-        ModeProgram.end_mode(self)
-        if self.mode in ['fwd-1', 'ccw-c', 'cw-c']:
-            return
-        # Keep track of the current x-position.
-        d = self.mode_direction()
-        dist = self.time_to_dist(self.mode_time())
-        if d == 'fwd':
-            if self.heading == 'out':
-                self.x_pos += dist
-            elif self.heading == 'in':
-                self.x_pos -= dist 
-        elif d == 'bwd':
-            if self.heading == 'out':
-                self.x_pos -= dist
-            elif self.heading == 'in':
-                self.x_pos += dist
-        elif d == 'ccw':
-            if self.heading == 'up':
-                self.heading = 'out'
-            elif self.heading == 'in':
-                self.heading = 'up'
-        elif d == 'cw':
-            if self.heading == 'up':
-                self.heading = 'in'
-            elif self.heading == 'out':
-                self.heading = 'up'
-
-
-def obstacle_average():
-    """Returns the average of the three obstacle sensor readings."""
-    return average(myro.getObstacle())
+        return t
+
+    # Actions performed when leaving modes.
+
+    def record_obstacle(self):
+        self.first_obstacle_reading = self.reading
+        x, y, _ = self.position()
+        self.obstacle_pos = (x, y)
+        # Go around the same way as last time, without checking the slant.
+        self.remembered_side = self.grid.side(x, y)
+        if self.side_known:
+            self.around_mult_f = self.around_mult = self.remembered_side
+
+    def compare_slant(self):
+        # The sampler's window spans the rotation, so read where it stopped.
+        self.halt()
+        if self.obstacle(fresh=True) < self.first_obstacle_reading:
+            self.around_mult_f = 1
+        else:
+            self.around_mult_f = -1
+
+    def choose_side(self):
+        self.around_mult = self.around_mult_f
+        x, y = self.obstacle_pos
+        self.grid.remember_side(x, y, self.around_mult)
+
+    def leave_front(self):
+        self.at_front = False
+
+    def begin_mode(self):
+        # The course is reset whenever the program (re)starts.
+        if self.mode == START:
+            self.reset_course()
+        MachineProgram.begin_mode(self)
@@ -2,9 +2,17 @@
 
 """Implements common functionality for Scribbler programs."""
 
+import copy
 import math
 from time import time
 
+from scribbler import protocol
+from scribbler.battery import FACTORS, VoltageModel
+from scribbler.pose import Pose
+from scribbler.protocol import Failure, command
+from scribbler.timing import Timing
+from scribbler.util import average
+
 
 # Short codes for the parameters of the program.
 PARAM_CODES = {
@@ -12,7 +20,9 @@ PARAM_CODES = {
     'bf': 'beep_freq',
     's': 'speed',
     'dtt': 'dist_to_time',
-    'att': 'angle_to_time'
+    'att': 'angle_to_time',
+    'lc': 'latency_comp',
+    'bc': 'battery_comp'
 }
 
 # Default values for the parameters of the program.
@@ -21,23 +31,67 @@ PARAM_DEFAULTS = {
     'beep_freq': 2000, # Hz
     'speed': 0.4, # from 0.0 to 1.0
     'dist_to_time': 0.07, # cm/s
-    'angle_to_time': 0.009 # rad/s
+    'angle_to_time': 0.009, # rad/s
+    'latency_comp': 1, # 1 to end modes early by the predicted lead, 0 not to
+    'battery_comp': 1 # 1 to correct the conversions for the voltage, 0 not to
 }
 
 # Prefix used in commands that change the value of a parameter.
 PARAM_PREFIX = 'set:'
 
 
+def parse_assignment(text):
+    """Parses the argument of a text set command, like 's=0.5', into a
+    dictionary from the short code to the value."""
+    code, value = text.split('=')
+    return {code: value}
+
+
+def call(fn, *args):
+    """Calls the function with the arguments and returns its result."""
+    return fn(*args)
+
+
+def show_info(info):
+    """Shows the robot information returned by an info command as text."""
+    return "battery: " + str(info['battery'])
+
+
+def show_params(values):
+    """Shows the parameter values returned by a set command as text."""
+    return '; '.join("{} = {}".format(name, value)
+                     for name, value in sorted(values.items()))
+
+
 class BaseProgram(object):
 
     """Implements the general aspects of robot programs and basic server
     communcation. Also manages the parameter dictionary."""
 
+    # Reply to a text command that the program doesn't handle.
+    unrecognized = None
+
     def __init__(self):
         """Creates a new base program."""
         self.defaults = PARAM_DEFAULTS.copy()
         self.params = PARAM_DEFAULTS.copy()
         self.codes = PARAM_CODES.copy()
+        # The background sensor sampler, which is set by the controller.
+        self.sensors = None
+        # The ID of the robot for its calibration profile (such as its
+        # Bluetooth port), which is set by the controller.
+        self.robot = None
+        # The background battery sampler, which is set by the controller, and
+        # the model that corrects the conversion factors for the voltage.
+        self.battery = None
+        self.voltage_model = VoltageModel()
+        # Calls a function that may take a long time, like tracing an image,
+        # and returns its result. The controller replaces it with one that
+        # doesn't hold up the main loop while the function runs.
+        self.offload = call
+        # Calls a function that writes a file, without waiting for it. The
+        # controller replaces it with one that calls it in another thread.
+        self.in_background = call
 
     def add_params(self, defaults, codes):
         """Adds parameters to the program given their default values and their
@@ -52,54 +106,118 @@ class BaseProgram(object):
         """Returns the nominal speed of the robot."""
         return self.params['speed']
 
+    @property
+    def voltage(self):
+        """Returns the battery voltage from the background sampler, or None if
+        it is unknown."""
+        return self.battery.voltage if self.battery else None
+
+    def factor(self, name):
+        """Returns the conversion factor `name` ('dist_to_time' or
+        'angle_to_time') corrected for the current battery voltage, unless
+        battery compensation is off."""
+        if not self.params['battery_comp']:
+            return self.params[name]
+        return self.params[name] * self.voltage_model.scale(name, self.voltage)
+
+    def corrections(self):
+        """Returns the scale applied to each conversion factor by name."""
+        return dict((name, self.factor(name) / self.params[name])
+                    for name in FACTORS)
+
     def dist_to_time(self, dist):
         """Returns how long the robot should drive at its current speed in order
         to cover `dist` centimetres."""
-        return self.params['dist_to_time'] * dist / self.speed
+        return self.factor('dist_to_time') * dist / self.speed
 
     def angle_to_time(self, angle):
         """Returns how long the robot should rotate at its current speed in
         order to rotate by `angle` degrees."""
-        return self.params['angle_to_time'] * angle / self.speed
+        return self.factor('angle_to_time') * angle / self.speed
 
     def time_to_dist(self, time):
         """The inverse of `dist_to_time`."""
-        return self.speed * time / self.params['dist_to_time']
+        return self.speed * time / self.factor('dist_to_time')
 
     def time_to_angle(self, time):
         """The inverse of `angle_to_time`."""
-        return self.speed * time / self.params['angle_to_time']
+        return self.speed * time / self.factor('angle_to_time')
+
+    def obstacle(self, fresh=False):
+        """Returns the average obstacle sensor reading. Uses the filtered value
+        from the background sampler if it has one, so that this doesn't block,
+        and otherwise reads the sensors directly. Readings that must reflect
+        where the robot is right now, such as after it stops rotating, should
+        be `fresh`, since the sampler's window lags behind the motion."""
+        if not fresh and self.sensors and self.sensors.ready:
+            return self.sensors.median
+        return average(myro.getObstacle())
 
     # Subclasses should override the following methods (and call super).
     # `__call__` must return a status, and `loop` should sometimes.
 
     def __call__(self, command):
         """Performs an action according to the command passed down from the
-        controller, and returns a status message."""
-        if command == 'other:beep':
-            myro.beep(self.params['beep_len'], self.params['beep_freq'])
-            return "successful beep"
-        if command == 'other:info':
-            return "battery: " + str(myro.getBattery())
-        if command.startswith(PARAM_PREFIX):
-            code, value = command[len(PARAM_PREFIX):].split('=')
+        controller (a string or a Request), and returns the reply. Commands
+        that the program doesn't handle get `unrecognized`."""
+        return protocol.handle(self, command, self.unrecognized)
+
+    @command('other:beep')
+    def beep(self, _):
+        myro.beep(self.params['beep_len'], self.params['beep_freq'])
+        return "successful beep"
+
+    @command('other:info', show=show_info)
+    def info(self, _):
+        return {'battery': myro.getBattery()}
+
+    @command(PARAM_PREFIX, parse=parse_assignment, show=show_params,
+             journal='params', arg='object')
+    def set_params(self, values):
+        """Sets the parameters given by short code in the dictionary, and
+        returns their new values by name. A value of "default" (or a prefix of
+        it) resets the parameter, and an empty value or "?" leaves it as it
+        is, so that its value is returned. If any code or value is invalid,
+        none of the parameters change and the reply is a Failure."""
+        result = {}
+        for code, value in values.items():
             if not code in self.codes:
-                return "invalid code: " + code
+                return Failure("invalid code: " + code)
             name = self.codes[code]
-            # Return the value of the parameter.
-            if value == "" or value == "?":
-                return name + " = " + str(self.params[name])
-            # Reset the parameter to its default.
-            if "default".startswith(value):
-                n = self.defaults[name]
-            else:
-                try:
-                    n = float(value)
-                except ValueError:
-                    return "NaN: " + value
-            # Set the parameter to the new value.
-            self.params[name] = n
-            return name + " = " + str(n)
+            if isinstance(value, protocol.string_types):
+                # Return the value of the parameter.
+                if value == "" or value == "?":
+                    result[name] = self.params[name]
+                    continue
+                # Reset the parameter to its default.
+                if "default".startswith(value):
+                    result[name] = self.defaults[name]
+                    continue
+            try:
+                result[name] = float(value)
+            except (ValueError, TypeError):
+                return Failure("NaN: " + str(value))
+        # Only set the parameters once they are all known to be valid.
+        self.params.update(result)
+        return result
+
+    def changed_params(self):
+        """Returns the parameters that differ from their defaults, by short
+        code, in the form taken by a JSON set command."""
+        return dict((code, self.params[name])
+                    for code, name in self.codes.items()
+                    if self.params[name] != self.defaults[name])
+
+    def finished(self, status):
+        """Returns true if the program has finished its task, given the status
+        returned by the last iteration of the main loop. Programs that have no
+        end never finish."""
+        return False
+
+    def trace(self):
+        """Returns a list of numbers describing the robot's progress for the
+        client to show, or None if the program doesn't support tracing."""
+        return None
 
     def start(self):
         """Called when the controller is started."""
@@ -122,23 +240,40 @@ class ModeProgram(BaseProgram):
 
     """A program that operates in one mode per distinct motion."""
 
+    # The function that returns the current time (seconds). A simulation can
+    # replace it on an instance to run the program on a simulated clock.
+    clock = staticmethod(time)
+
+    # Attributes that describe the program's progress, which are saved in a
+    # checkpoint. Subclasses should extend this with their own.
+    checkpoint_attrs = ('mode',)
+
     def __init__(self, initial_mode):
         """Creates a new ModeProgram it its default state."""
         BaseProgram.__init__(self)
         self.initial_mode = initial_mode
+        # The timing model, which the controller replaces with its own so that
+        # the measurements carry over between programs.
+        self.timing = Timing()
         self.reset()
 
     def reset(self):
         """Stops and resets the program to the first mode."""
         BaseProgram.reset(self)
         self.mode = self.initial_mode
+        self.running = False
+        self.deadline = None
         self.start_time = 0
         self.pause_time = 0
+        self.pose = Pose(self.clock())
 
     def stop(self):
-        """Pauses and records the current time."""
+        """Pauses and records the current time. The time is recorded first, so
+        that the program is paused even if the robot can't be reached."""
+        self.running = False
+        self.pause_time = self.clock()
+        self.pose.move(self.pause_time, 0, 0)
         BaseProgram.stop(self)
-        self.pause_time = time()
 
     def no_start(self):
         """If the program cannot be started at this time, returns a string
@@ -149,27 +284,72 @@ class ModeProgram(BaseProgram):
         """Resumes the program and fixes the timer so that the time while the
         program was paused doesn't count towards the mode's time."""
         BaseProgram.start(self)
-        self.start_time += time() - self.pause_time
+        self.running = True
+        self.start_time += self.clock() - self.pause_time
+        self.deadline = None
         self.move()
 
+    def checkpoint(self):
+        """Returns a snapshot of the program's progress: the attributes in
+        `checkpoint_attrs`, the time elapsed in the current mode, and the pose,
+        as if the robot had stopped right now."""
+        now = self.clock() if self.running else self.pause_time
+        pose = copy.copy(self.pose)
+        pose.move(now, 0, 0)
+        state = dict((a, getattr(self, a)) for a in self.checkpoint_attrs)
+        state['elapsed'] = now - self.start_time
+        state['pose'] = pose
+        return state
+
+    def restore(self, state):
+        """Goes back to a checkpoint, leaving the program paused so that it
+        resumes from there when it is started."""
+        for a in self.checkpoint_attrs:
+            setattr(self, a, state[a])
+        self.running = False
+        self.deadline = None
+        self.pause_time = self.clock()
+        self.start_time = self.pause_time - state['elapsed']
+        self.pose = copy.copy(state['pose'])
+        self.pose.since = self.pause_time
+
     def goto_mode(self, mode):
         """Stops the robot and switches to the given mode. Resets the timer and
         starts the new mode immediately."""
-        myro.stop()
+        self.halt()
         self.end_mode()
         self.mode = mode
-        self.start_time = time()
+        self.deadline = None
+        self.start_time = self.clock()
         self.begin_mode()
         self.move()
 
+    @property
+    def mode_name(self):
+        """Returns the name of the current mode."""
+        return str(self.mode)
+
     def mode_time(self):
         """Returns the time that has elapsed since the mode begun."""
-        return time() - self.start_time
+        return self.clock() - self.start_time
 
     def has_elapsed(self, t):
         """Returns true if `t` seconds have elapsed sicne the current mode begun
-        and false otherwise."""
-        return self.mode_time() > t
+        and false otherwise. With latency compensation, it returns true early
+        by the lead predicted by the timing model, so that the robot stops
+        after `t` seconds of motion. The earliest time it will return true is
+        kept in `deadline`, so the controller can wake up right then."""
+        lead = self.timing.lead if self.params['latency_comp'] else 0
+        end = self.start_time + t - lead
+        now = self.clock()
+        if now >= end:
+            if self.deadline is not None:
+                self.timing.update('lateness', now - self.deadline)
+                self.deadline = None
+            return True
+        if self.deadline is None or end < self.deadline:
+            self.deadline = end
+        return False
 
     def has_travelled(self, dist):
         """Returns true if the robot has driven `dist` centimetres driving the
@@ -187,6 +367,49 @@ class ModeProgram(BaseProgram):
         mode (assuming it is pivoting) and false otherwise."""
         return self.has_rotated(90)
 
+    def position(self):
+        """Returns the estimated `(x, y, heading)` of the robot right now."""
+        return self.pose.at(self.clock())
+
+    # Motor commands. These should be used instead of the Myro functions so
+    # that the pose estimate stays up to date.
+
+    def forward(self, speed):
+        """Drives forward at the given speed."""
+        now = self.set_moving(myro.forward, speed)
+        self.pose.move(now, speed / self.factor('dist_to_time'), 0)
+
+    def backward(self, speed):
+        """Drives backward at the given speed."""
+        now = self.set_moving(myro.backward, speed)
+        self.pose.move(now, -speed / self.factor('dist_to_time'), 0)
+
+    def rotate(self, speed):
+        """Rotates counterclockwise at the given speed (clockwise if it is
+        negative)."""
+        now = self.set_moving(myro.rotate, speed)
+        rate = math.radians(speed / self.factor('angle_to_time'))
+        self.pose.move(now, 0, rate)
+
+    def halt(self):
+        """Stops the robot."""
+        moving = self.pose.velocity or self.pose.turn_rate
+        before = self.clock()
+        myro.stop()
+        now = self.clock()
+        if moving:
+            self.timing.update('stop_latency', now - before)
+        self.pose.move(now, 0, 0)
+
+    def set_moving(self, command, speed):
+        """Sends a Myro motor command, measuring how long it takes for the
+        timing model. Returns the time when it is done."""
+        before = self.clock()
+        command(speed)
+        now = self.clock()
+        self.timing.update('start_latency', now - before)
+        return now
+
     # Subclasses should override the following three methods and `loop`.
 
     def move(self):
@@ -1,50 +1,270 @@
 # Copyright 2014 Mitchell Kember and Charles Bai. Subject to the MIT License.
 
-"""Calibrates the angle-to-time conversion factor."""
+"""Calibrates the distance-to-time and angle-to-time conversion factors."""
 
+from __future__ import print_function
+
+import math
+from time import time
+
+from scribbler import profiles
+from scribbler.battery import VoltageModel
+from scribbler.util import dist_2d
 from scribbler.programs.base import ModeProgram
+from scribbler.protocol import Failure, command
 
 
 # Short codes for the parameters of the program.
 PARAM_CODES = {
     'ca': 'calib_angle',
+    'cd': 'calib_dist'
 }
 
 # Default values for the parameters of the program.
 PARAM_DEFAULTS = {
     'calib_angle': 90, # deg
+    'calib_dist': 30 # cm
+}
+
+# Speeds at which the automatic calibration rotates and drives.
+CALIB_SPEEDS = (0.1, 0.3, 0.5, 0.7)
+
+# The parameter fitted by each kind of trial, and the unit of its measurement.
+FITTED = {
+    'rotate': ('angle_to_time', 'degrees'),
+    'drive': ('dist_to_time', 'cm')
 }
 
+# Prefix used in commands that report a measurement during the calibration.
+MEASURE_PREFIX = 'measure:'
+
+
+def fit(samples):
+    """Fits a conversion factor to trials of the form `(speed, time, amount)`,
+    where the robot moved by `amount` after being told to move for `time`
+    seconds at `speed`. The robot is assumed to keep moving for a constant lag
+    after being told to stop, so `speed * time = factor * amount - speed *
+    lag`, and the factor and lag are found by least squares. If all the trials
+    were at one speed, the lag can't be told apart from the factor, so it is
+    taken to be zero. Returns the factor, the lag (seconds), and the RMS error
+    of the amounts predicted by the fit."""
+    s11 = s12 = s22 = b1 = b2 = 0.0
+    for speed, t, amount in samples:
+        y = speed * t
+        s11 += amount * amount
+        s12 -= amount * speed
+        s22 += speed * speed
+        b1 += amount * y
+        b2 -= speed * y
+    det = s11 * s22 - s12 * s12
+    speeds = set(speed for speed, _, _ in samples)
+    if len(speeds) > 1 and abs(det) > 1e-12 * s11 * s22:
+        factor = (b1 * s22 - b2 * s12) / det
+        lag = (s11 * b2 - s12 * b1) / det
+    else:
+        factor = b1 / s11
+        lag = 0.0
+    sq = sum((amount - speed * (t + lag) / factor) ** 2
+             for speed, t, amount in samples)
+    return factor, lag, math.sqrt(sq / len(samples))
+
 
 class Calib(ModeProgram):
 
-    """Program for calibrating the `att` parameter."""
+    """Program for calibrating the `att` and `dtt` parameters.
+
+    By default the robot rotates until it is stopped, and `short:att` gives the
+    conversion factor for a rotation of `calib_angle` degrees. After the
+    `calib:auto` command, it instead rotates by `calib_angle` and drives
+    `calib_dist` at each of CALIB_SPEEDS, stopping after each motion for the
+    operator to send the measured result. On a simulated robot, the results
+    are measured automatically. Both factors are then fitted by least squares
+    and saved in the robot's profile.
+    """
+
+    # The trial the calibration is on.
+    checkpoint_attrs = ModeProgram.checkpoint_attrs + (
+        'trial', 'go_for', 'true_start')
 
     def __init__(self):
+        self.auto = False
         ModeProgram.__init__(self, 0)
-        self.running = False
         self.add_params(PARAM_DEFAULTS, PARAM_CODES)
 
-    def __call__(self, command):
-        p_status = ModeProgram.__call__(self, command)
-        if p_status:
-            return p_status
-        if command == 'short:att':
-            if self.running:
-                t = self.mode_time()
-                s = self.speed
-                angle = self.params['calib_angle']
-                return str(t * s / angle)
-            else:
-                return "program not running"
-
-    def start(self):
-        ModeProgram.start(self)
-        self.running = True
-
-    def stop(self):
-        ModeProgram.stop(self)
-        self.running = False
+    def reset(self):
+        ModeProgram.reset(self)
+        self.trials = []
+        if self.auto:
+            self.trials = [(kind, speed) for speed in CALIB_SPEEDS
+                           for kind in ('rotate', 'drive')]
+        self.trial = -1 # index of the current trial
+        self.samples = {'rotate': [], 'drive': []}
+        self.go_for = 0 # how long to move in the current trial
+        self.true_start = None # simulated pose when the trial began
+        self.results = [] # descriptions of the fitted factors
+        self.saved_to = None # path of the profile they were saved in
+
+    @command('short:att', show=str)
+    def short_att(self, _):
+        """Returns the angle-to-time factor for a rotation of `calib_angle`
+        degrees in the time the robot has been rotating."""
+        if self.running:
+            t = self.mode_time()
+            s = self.speed
+            angle = self.params['calib_angle']
+            return t * s / angle
+        else:
+            return Failure("program not running")
+
+    @command('calib:auto', journal='calib')
+    def calib_auto(self, _):
+        """Prepares the automatic calibration trials."""
+        self.auto = True
+        self.reset()
+        return "{} calibration trials ready, press start".format(
+            len(self.trials))
+
+    @command('calib:manual', journal='calib')
+    def calib_manual(self, _):
+        """Switches to manual calibration."""
+        self.auto = False
+        self.reset()
+        return "manual calibration"
+
+    @command(MEASURE_PREFIX, arg=('number', 'string'))
+    def measure(self, value):
+        """Records a measurement of the current trial."""
+        if self.mode != 'measure':
+            return Failure("not waiting for a measurement")
+        try:
+            return self.record(float(value))
+        except (ValueError, TypeError):
+            return Failure("NaN: " + str(value))
+
+    @property
+    def speed(self):
+        if self.auto and self.trial >= 0:
+            return self.trials[self.trial][1]
+        return self.params['speed']
+
+    @property
+    def kind(self):
+        """Returns the kind of motion in the current trial."""
+        return self.trials[self.trial][0]
+
+    def next_trial(self):
+        """Starts the next trial, or finishes the calibration."""
+        self.trial += 1
+        if self.trial == len(self.trials):
+            self.finish()
+            return
+        if self.kind == 'rotate':
+            self.go_for = self.angle_to_time(self.params['calib_angle'])
+        else:
+            self.go_for = self.dist_to_time(self.params['calib_dist'])
+        if hasattr(myro, 'getPose'):
+            self.true_start = myro.getPose()
+        self.goto_mode(self.kind)
+
+    def true_motion(self):
+        """Returns how far the simulated robot really moved in the trial."""
+        x0, y0, h0 = self.true_start
+        x1, y1, h1 = myro.getPose()
+        if self.kind == 'rotate':
+            return abs(math.degrees(h1 - h0))
+        return dist_2d(x0, y0, x1, y1)
+
+    def record(self, amount):
+        """Records the measured result of the current trial and moves on.
+        Returns a status message."""
+        speed = self.trials[self.trial][1]
+        self.samples[self.kind].append((speed, self.go_for, amount))
+        msg = "measured {:.2f} {}".format(amount, FITTED[self.kind][1])
+        self.next_trial()
+        return msg + "; " + self.status()
+
+    def finish(self):
+        """Fits the conversion factors to the measurements, uses them, and
+        saves them in the robot's profile in the background. The battery
+        voltage is saved with them, and each calibration is recorded so that
+        the voltage model can be fitted to them."""
+        params = {}
+        self.results = []
+        for kind, samples in sorted(self.samples.items()):
+            if not samples:
+                continue
+            name, unit = FITTED[kind]
+            factor, lag, error = fit(samples)
+            params[name] = factor
+            self.results.append("{} = {:.5f} (lag {:.3f} s, error {:.2f} {})"
+                                .format(name, factor, lag, error, unit))
+        self.add_params(params, {})
+        voltage = self.voltage
+        calibration = dict(params, voltage=voltage, time=time())
+        if self.robot is None:
+            self.voltage_model = VoltageModel(voltage, [calibration])
+        else:
+            records = self.voltage_model.records
+            if voltage is not None:
+                records = (records + [calibration])[-profiles.MAX_RECORDS:]
+            self.voltage_model = VoltageModel(voltage, records)
+            self.saved_to = profiles.profile_path(self.robot)
+            self.in_background(self.save_profile, params, self.results,
+                               calibration)
+        self.goto_mode('done')
+
+    def save_profile(self, params, results, calibration):
+        """Saves the fitted factors and their descriptions in the robot's
+        profile, and records the calibration if the voltage is known."""
+        voltage = calibration['voltage']
+        try:
+            profiles.save(self.robot, params, calibration=results,
+                          voltage=voltage)
+            if voltage is not None:
+                profiles.record(self.robot, 'calibrations', calibration)
+        except (IOError, OSError) as e:
+            print("warning: couldn't save profile: {}".format(e))
 
     def move(self):
-        myro.rotate(self.speed)
+        if self.mode == 0 and not self.auto:
+            self.rotate(self.speed)
+        elif self.mode == 'rotate':
+            self.rotate(self.speed)
+        elif self.mode == 'drive':
+            self.forward(self.speed)
+        else:
+            self.halt()
+
+    def status(self):
+        """Returns the status message for the beginning of the current mode."""
+        if self.mode in ('rotate', 'drive'):
+            amount = self.params['calib_' + ('angle' if self.mode == 'rotate'
+                                             else 'dist')]
+            return "trial {} of {}: {} {} {} at speed {}".format(
+                self.trial + 1, len(self.trials), self.mode, amount,
+                FITTED[self.mode][1], self.speed)
+        if self.mode == 'measure':
+            return "measure the {} in {}, then send measure:<value>".format(
+                'rotation' if self.kind == 'rotate' else 'distance',
+                FITTED[self.kind][1])
+        if self.mode == 'done':
+            where = "not saved"
+            if self.saved_to:
+                where = "saved to " + self.saved_to
+            return "calibrated {} ({})".format('; '.join(self.results), where)
+
+    def finished(self, status):
+        return self.mode == 'done'
+
+    def loop(self):
+        ModeProgram.loop(self)
+        if not self.auto or self.mode == 'done':
+            return
+        if self.mode == 0:
+            self.next_trial()
+            return self.status()
+        if self.mode != 'measure' and self.has_elapsed(self.go_for):
+            self.goto_mode('measure')
+            if self.true_start is not None:
+                return self.record(self.true_motion())
+            return self.status()
@@ -0,0 +1,260 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Runs mode programs that are declared as data instead of branch chains."""
+
+from scribbler.programs.base import ModeProgram
+
+
+# Codes for the motion of the robot during a mode.
+NONE, FWD, BWD, CCW, CW = range(5)
+
+# Map direction identifiers to motion codes.
+DIRECTIONS = {None: NONE, 'fwd': FWD, 'bwd': BWD, 'ccw': CCW, 'cw': CW}
+
+# Index of the implicit mode that the machine is in before it starts.
+START = 0
+
+# Name of the implicit start mode, which can be used as a target.
+START_NAME = 'start'
+
+
+class Mode(object):
+
+    """Declares a mode of a state machine.
+
+    The robot moves in `direction` (one of the keys of DIRECTIONS) at the speed
+    given by the `speed` parameter while it is in the mode, and `status` is
+    displayed when the mode begins. The exits are tried in order on every tick,
+    and the first one whose condition is met is taken.
+    """
+
+    def __init__(self, name, direction, status, exits, speed='speed'):
+        self.name = name
+        self.direction = direction
+        self.status = status
+        self.exits = exits
+        self.speed = speed
+
+
+class Exit(object):
+
+    """Declares a way out of a mode.
+
+    The condition is the name of one of the `cond_` methods of MachineProgram,
+    and `arg` is its argument: a number, the name of a parameter, or the name of
+    an attribute of the program. The argument is only looked up when the mode is
+    begun. When the condition is met, the `action` method is called (if there is
+    one) and then the machine goes to `to`, which is a mode name or a Branch.
+    """
+
+    def __init__(self, condition, arg=None, to=START_NAME, action=None):
+        self.condition = condition
+        self.arg = arg
+        self.to = to
+        self.action = action
+
+
+class Branch(object):
+
+    """Declares a choice between two targets that is made when an exit is
+    taken, according to a condition just like those of exits. Each target is a
+    mode name or another Branch."""
+
+    def __init__(self, condition, arg, yes, no):
+        self.condition = condition
+        self.arg = arg
+        self.yes = yes
+        self.no = no
+
+
+class Compiled(object):
+
+    """An exit or branch with its names resolved to methods and mode indices."""
+
+    def __init__(self, check, prepare, get_arg, action, to):
+        self.check = check
+        self.prepare = prepare
+        self.get_arg = get_arg
+        self.action = action
+        self.to = to
+
+
+class MachineProgram(ModeProgram):
+
+    """A mode program whose modes and transitions are compiled from a list of
+    Mode declarations into tables indexed by integer mode numbers.
+
+    The mode is always an index into the tables, with zero being the start mode.
+    Every time a mode is begun the thresholds of its exits are converted to
+    times or readings once, so each tick only costs a table lookup and a check
+    of the active conditions.
+    """
+
+    # Multiplier for the rotation speed, which subclasses can use to mirror the
+    # rotations (1 for the declared direction, -1 for the opposite one).
+    turn_mult = 1
+
+    # The exits of the current mode and their thresholds are part of the
+    # progress, since they are only worked out when the mode begins.
+    checkpoint_attrs = ModeProgram.checkpoint_attrs + (
+        'active', 'thresholds', 'reading')
+
+    def __init__(self, modes, initial, start_status="starting"):
+        """Creates a machine that goes from the start mode to the mode named
+        `initial` as soon as it is started."""
+        self.compile(modes, initial, start_status)
+        ModeProgram.__init__(self, START)
+
+    def compile(self, modes, initial, start_status="starting"):
+        """Builds the mode tables from the list of Mode declarations."""
+        start = Mode(START_NAME, None, start_status,
+                     [Exit('always', to=initial)])
+        modes = [start] + list(modes)
+        self.mode_names = [m.name for m in modes]
+        self.mode_index = dict((m.name, i) for i, m in enumerate(modes))
+        self.directions = [DIRECTIONS[m.direction] for m in modes]
+        self.speed_params = [m.speed for m in modes]
+        self.statuses = [m.status for m in modes]
+        self.exits = [[self.compile_exit(e) for e in m.exits] for m in modes]
+        self.active = self.exits[START]
+        self.thresholds = [None] * len(self.active)
+
+    def compile_exit(self, e):
+        """Resolves the names in an Exit or Branch declaration."""
+        if isinstance(e, Branch):
+            to = (self.compile_target(e.yes), self.compile_target(e.no))
+            action = None
+        else:
+            to = self.compile_target(e.to)
+            action = getattr(self, e.action) if e.action else None
+        check = getattr(self, 'cond_' + e.condition)
+        prepare = getattr(self, 'prep_' + e.condition, None)
+        return Compiled(check, prepare, self.arg_getter(e.arg), action, to)
+
+    def compile_target(self, to):
+        """Resolves a mode name to its index, or compiles a Branch."""
+        if isinstance(to, Branch):
+            return self.compile_exit(to)
+        return self.mode_index[to]
+
+    def arg_getter(self, arg):
+        """Returns a function that looks up the current value of an argument."""
+        if arg is None or isinstance(arg, (int, float)):
+            return lambda: arg
+        def get():
+            if arg in self.params:
+                return self.params[arg]
+            return getattr(self, arg)
+        return get
+
+    def threshold(self, c):
+        """Returns the threshold for a compiled exit in the current mode."""
+        value = c.get_arg()
+        if c.prepare:
+            return c.prepare(value)
+        return value
+
+    def reset(self):
+        ModeProgram.reset(self)
+        self.reading = 0
+        self.begin_mode()
+
+    @property
+    def speed(self):
+        return self.params[self.speed_params[self.mode]]
+
+    @property
+    def mode_name(self):
+        """Returns the name of the current mode."""
+        return self.mode_names[self.mode]
+
+    def status(self):
+        """Returns the status message for the beginning of the current mode."""
+        return self.statuses[self.mode]
+
+    def finished(self, status):
+        """A machine finishes a pass when it goes back to the start mode."""
+        return bool(status) and self.mode == START
+
+    def rotation_time(self, angle):
+        """Returns how long to rotate by `angle` degrees in the current mode.
+        Subclasses can override this to account for asymmetries."""
+        return self.angle_to_time(angle)
+
+    def begin_mode(self):
+        ModeProgram.begin_mode(self)
+        self.active = self.exits[self.mode]
+        self.thresholds = [self.threshold(c) for c in self.active]
+
+    def move(self):
+        ModeProgram.move(self)
+        d = self.directions[self.mode]
+        if d == FWD:
+            self.forward(self.speed)
+        elif d == BWD:
+            self.backward(self.speed)
+        elif d == CCW:
+            self.rotate(self.turn_mult * self.speed)
+        elif d == CW:
+            self.rotate(self.turn_mult * -self.speed)
+
+    def loop(self):
+        ModeProgram.loop(self)
+        thresholds = self.thresholds
+        for i, c in enumerate(self.active):
+            if c.check(thresholds[i]):
+                return self.take(c)
+
+    def take(self, c):
+        """Takes an exit: performs its action, chooses the target mode, and goes
+        to it. Returns the status of the new mode."""
+        if c.action:
+            c.action()
+        to = c.to
+        while isinstance(to, Compiled):
+            yes, no = to.to
+            to = yes if to.check(self.threshold(to)) else no
+        self.goto_mode(to)
+        return self.status()
+
+    # Conditions. The `prep_` methods convert an argument into the threshold
+    # that is passed to the `cond_` method of the same name on every tick.
+
+    def cond_always(self, _):
+        return True
+
+    def cond_never(self, _):
+        return False
+
+    def cond_elapsed(self, t):
+        return self.has_elapsed(t)
+
+    def prep_travelled(self, dist):
+        return self.dist_to_time(dist)
+
+    cond_travelled = cond_elapsed
+
+    def prep_rotated(self, angle):
+        return self.rotation_time(angle)
+
+    cond_rotated = cond_elapsed
+
+    def prep_right_angle(self, _):
+        return self.rotation_time(90)
+
+    cond_right_angle = cond_elapsed
+
+    def cond_obstacle(self, thresh):
+        self.reading = self.obstacle()
+        return self.reading > thresh
+
+    def cond_clear(self, thresh):
+        return not self.cond_obstacle(thresh)
+
+    def cond_fresh_obstacle(self, thresh):
+        # The sampler's window lags behind a rotation, so read the sensors.
+        self.reading = self.obstacle(fresh=True)
+        return self.reading > thresh
+
+    def cond_flag(self, value):
+        return bool(value)
@@ -1,97 +1,121 @@
 # Copyright 2014 Mitchell Kember. Subject to the MIT License.
 
-"""Implements an early program-type that we are no longer using."""
-
-import time.time
-
-from scribbler.util import average
-from scribbler.programs.base import BaseProgram, obstacle_average
-
-
-class SeqProgram(BaseProgram):
+"""Interprets sequences of instructions that are uploaded as JSON."""
+
+import json
+
+from scribbler.programs.machine import START_NAME, Exit, MachineProgram, Mode
+from scribbler.protocol import Failure, command
+
+
+# Map instructions to the direction of motion.
+INSTRUCTIONS = {'fwd': 'fwd', 'bwd': 'bwd', 'ccw': 'ccw', 'cw': 'cw'}
+
+# Map conditions to the machine conditions that implement them.
+CONDITIONS = {
+    'ir>': 'obstacle',
+    'time': 'elapsed',
+    'dist': 'travelled',
+    'angle': 'rotated',
+    'forever': 'never'
+}
+
+# Sequences that are available before anything is uploaded.
+SEQUENCES = {
+    'square': [
+        ['fwd', 'dist', 20, "driving along side"],
+        ['ccw', 'angle', 90, "turning corner"]
+    ],
+    'bounce': [
+        ['fwd', 'ir>', 1, "driving until obstacle"],
+        ['bwd', 'dist', 10, "backing up"],
+        ['cw', 'angle', 135, "turning away"]
+    ]
+}
+
+# The sequence that is initially active.
+DEFAULT_SEQUENCE = 'square'
+
+# Prefix used in commands that upload a sequence.
+SEQUENCE_PREFIX = 'sequence:'
+
+# Prefix used in commands that switch to another sequence.
+USE_PREFIX = 'use:'
+
+
+def compile_sequence(seq):
+    """Converts a sequence into a list of Mode declarations. A sequence is a
+    list of modes, each of the form `[i, c, p, s]` where `i` is an
+    instruction, `c` is the condition, `p` is the parameter of the condition,
+    and `s` is the status message to display. Each mode moves on to the next
+    one when its condition is met, and the last one goes back to the start
+    mode (and from there to the first), so that each pass through the sequence
+    ends. Raises ValueError if the sequence is malformed."""
+    if not seq:
+        raise ValueError("empty sequence")
+    modes = []
+    for n, step in enumerate(seq):
+        if len(step) != 4:
+            raise ValueError("mode {} is not [i, c, p, s]".format(n))
+        i, c, p, s = step
+        if i not in INSTRUCTIONS:
+            raise ValueError("bad instruction: {}".format(i))
+        if c not in CONDITIONS:
+            raise ValueError("bad condition: {}".format(c))
+        to = str(n + 1) if n + 1 < len(seq) else START_NAME
+        out = Exit(CONDITIONS[c], float(p or 0), to)
+        modes.append(Mode(str(n), INSTRUCTIONS[i], str(s), [out]))
+    return modes
+
+
+class SeqProgram(MachineProgram):
 
     """A program that interprets a sequence of instructions.
 
-    The sequence is a list of modes. A mode is represented by a triple of the
-    form `(i, c, p, s)` where `i` is an instruction string, `c` is the
-    condition, `p` is the parameter of the condition, and `s` is the status
-    message to display. The program beings by performing the instruction of the
-    first mode, and it moves on to the next mode when the condition of the first
-    mode is met. After the last mode, we return to the first mode.
+    Sequences are uploaded by name in JSON and compiled into a state machine,
+    so the conditions cost no more per tick than in a hand-written program. The
+    program begins by performing the instruction of the first mode, and it moves
+    on to the next mode when the condition of the first mode is met. After the
+    last mode, it passes through the start mode and begins again.
     """
 
-    def __init__(self, seq):
-        """Creates a program that interprets the given sequence."""
-        BaseProgram.__init__(self)
-        self.seq = seq
-        self.build_maps()
+    unrecognized = "unrecognized command"
+
+    def __init__(self):
+        self.sequences = dict(SEQUENCES)
+        self.current = DEFAULT_SEQUENCE
+        MachineProgram.__init__(
+            self, compile_sequence(self.sequences[self.current]), '0')
+
+    def use(self, name):
+        """Stops the robot and switches to the named sequence, starting again
+        from its first mode."""
+        self.compile(compile_sequence(self.sequences[name]), '0')
+        self.current = name
+        self.halt()
         self.reset()
 
-    def build_maps(self):
-        self.instructions = {
-            'fwd': lambda t: myro.forward(self.speed),
-            'bwd': lambda t: myro.backward(self.speed),
-            'ccw': lambda t: myro.rotate(self.speed),
-            'cw': lambda t: myro.rotate(-self.speed)
-        }
-        self.conditions = {
-            'ir>': lambda v: average(myro.getObstacle()) > v,
-            'time': lambda t: self.time > t,
-            'dist': lambda d: self.time > dist_to_time(d, self.speed),
-            'angle': lambda a: self.time > angle_to_time(a, self.speed),
-            'forever': lambda _: False,
-        }
-
-    @property
-    def time(self):
-        """Returns the time elapsed since the current mode was started."""
-        return time.time() - self.start_time
-
-    def increment_mode(self):
-        """Increments the mode index (wrapping around if necessary), updates
-        mode variables, and resets the timer."""
-        myro.stop()
-        self.mode_ind += 1
-        self.mode_ind %= len(self.seq)
-        self.i, self.c, self.p, self.s = self.seq[self.mode_ind]
-        self.start_time = time.time()
-
-    def reset(self):
-        """Resets the program to the first mode."""
-        BaseProgram.reset(self)
-        self.mode_ind = -1
-
-    def stop(self):
-        """Record the time when the program is paused."""
-        BaseProgram.stop(self)
-        self.pause_time = time.time()
-
-    def start(self):
-        """Fixes the start time so that the pause doesn't count towards the
-        elapsed time, and continues the previous motion of the robot."""
-        BaseProgram.start(self)
-        self.start_time += time.time() - self.pause_time
-        self.perform_instruction()
-
-    def perform_instruction(self):
-        """Performs the instruction dictated by the current mode."""
-        self.instructions[self.i](self.p)
-
-    def condition_satisfied(self):
-        """Returns whether the current mode's condition is satisfied."""
-        return self.mode_ind == -1 or self.conditions[self.c](self.p)
-
-    def loop(self):
-        """Advances to the next mode and performs the instruction when it is
-        time (when the condition is met), otherwise does nothing."""
-        BaseProgram.loop(self)
-        if self.condition_satisfied():
-            self.increment_mode()
-            self.perform_instruction()
-            return self.s
-
-    def __call__(self, command):
-        base_response = BaseProgram.__call__(self, command)
-        if base_response:
-            return base_response
-        return "unrecognized command"
+    @command(SEQUENCE_PREFIX, parse=json.loads, journal=True, arg='object')
+    def upload(self, obj):
+        """Stores an uploaded sequence of the form `{"name": n, "seq": [...]}`
+        under its name. Returns a status message."""
+        try:
+            name = str(obj['name'])
+            compile_sequence(obj['seq'])
+        except (ValueError, KeyError, TypeError) as e:
+            return Failure("bad sequence: {}".format(e))
+        self.sequences[name] = obj['seq']
+        if name == self.current:
+            self.use(name)
+        return "received sequence {} ({} modes)".format(name, len(obj['seq']))
+
+    @command(USE_PREFIX, journal='use', arg='string')
+    def use_command(self, name):
+        if name not in self.sequences:
+            return Failure("no such sequence: " + name)
+        self.use(name)
+        return "using sequence " + name
+
+    @command('short:sequences', show=' '.join)
+    def list_sequences(self, _):
+        return sorted(self.sequences)
@@ -2,19 +2,33 @@
 
 """Makes the Scribbler Bot trace shapes with a marker."""
 
+import base64
 import json
 import math
+from functools import partial
 from time import time
 
+from scribbler import svg
+from scribbler.jobs import SKIPPED, JobQueue
 from scribbler.util import deg_to_rad, rad_to_deg, dist_2d, equiv_angle
 from scribbler.programs.base import ModeProgram
+from scribbler.protocol import Failure, command
+
+# Converting images, ordering strokes, and previews need NumPy, which is
+# optional.
+try:
+    from scribbler import preview, strokes, vectorize
+except ImportError:
+    preview = strokes = vectorize = None
 
 
 # Short codes for the parameters of the program.
 PARAM_CODES = {
     'rs': 'rotation_speed',
     'ps': 'point_scale',
-    'mr': 'min_rotation'
+    'mr': 'min_rotation',
+    'pp': 'pen_pause',
+    'ft': 'flatten_tolerance'
 }
 
 # Default values for the parameters of the program.
@@ -23,26 +37,133 @@ PARAM_DEFAULTS = {
     'angle_to_time': 0.0052,
     'rotation_speed': 0.1, # 0.4, # from 0.0 to 1.0
     'point_scale': 0.02, #0.05, # cm/px
-    'min_rotation': 2 # deg
+    'min_rotation': 2, # deg
+    'pen_pause': 3, # s
+    'flatten_tolerance': 0.1 # cm
 }
 
 POINTS_PREFIX = 'points:'
 
+# Prefix used in commands that upload an image (in base64) to be traced.
+IMAGE_PREFIX = 'image:'
+
+# Prefix used in commands that upload a drawing made of separate strokes.
+# The data is a list of strokes, or an object with the list under 'strokes'
+# and optionally a start 'delay' (seconds) and 'optimize' (false to keep the
+# strokes in the given order).
+STROKES_PREFIX = 'strokes:'
+
+# Prefix used in commands that upload an SVG document to be drawn.
+SVG_PREFIX = 'svg:'
+
+# Prefix used in commands that preview the drawing to be made next. The data is
+# empty or an object with any of the options of `scribbler.preview.preview`,
+# such as 'fmt' ('svg' or 'png'), 'noise', and the robot's true
+# 'dist_to_time' and 'angle_to_time'.
+PREVIEW_PREFIX = 'preview:'
+
+# Prefix used in commands that add a drawing to the job queue. The data is an
+# object with the drawing under 'points', 'strokes', 'svg', or 'image' (in the
+# format of the command of that name), and optionally a 'name' and the
+# 'params' to use while drawing it (short codes and values).
+JOB_PREFIX = 'job:add:'
+
+# Parameters that the robot's motions are divided by or scaled with, which a
+# job can only set to positive numbers.
+POSITIVE_PARAMS = ('speed', 'rotation_speed', 'point_scale', 'dist_to_time',
+                   'angle_to_time', 'flatten_tolerance')
+
+# Map the kinds of drawings that a job can have to the methods that load them.
+JOB_DRAWINGS = {
+    'points': 'receive_points',
+    'strokes': 'receive_strokes',
+    'svg': 'load_svg',
+    'image': 'load_image'
+}
+
+
+def show_trace(values):
+    """Shows the trace values as text, separated by spaces."""
+    return ' '.join(map(str, values))
+
+
+def parse_options(text):
+    """Parses the JSON options of a text command, which may be empty."""
+    return json.loads(text) if text else {}
+
+
+def parse_points(data):
+    """Returns the point data as a list of objects with 'x' and 'y' keys. The
+    data is either such a list already, or a flat list of coordinates of the
+    form `[x1, y1, x2, y2, ...]` as saved in the drawing view. Saved data is in
+    canvas coordinates, so the y-axis is flipped to point upwards. Raises
+    ValueError if a flat list has an odd number of coordinates."""
+    if data and not isinstance(data[0], dict):
+        if len(data) % 2:
+            raise ValueError("odd number of coordinates")
+        return [{'x': data[i], 'y': -data[i+1]} for i in range(0, len(data), 2)]
+    return data
+
+
+def parse_strokes(data):
+    """Returns the stroke data as a list of strokes, each a list of `(x, y)`
+    tuples. Each stroke in the data is in one of the formats accepted by
+    `parse_points`. Raises ValueError if the data is malformed."""
+    try:
+        return [[(float(p['x']), float(p['y'])) for p in parse_points(s)]
+                for s in data]
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError("bad stroke: {}".format(e))
+
+
+def join_strokes(lines):
+    """Joins the strokes into one list of points. Returns the points and the
+    set of indices of the points that are travelled to with the pen up."""
+    points = []
+    lifts = set()
+    for line in lines:
+        line = [(float(x), float(y)) for x, y in line]
+        if points and line[0] == points[-1]:
+            line = line[1:]
+        elif points:
+            lifts.add(len(points))
+        points.extend(line)
+    return points, lifts
+
 
 class Tracie(ModeProgram):
 
     """Tracie takes a set of points as input and draws the shape with a pen."""
 
+    # Where the robot is in the drawing, and the motion it is making.
+    checkpoint_attrs = ModeProgram.checkpoint_attrs + (
+        'points', 'lifts', 'pen_up', 'delay', 'index', 'heading', 'rot_dir',
+        'go_for', 'delta_angle', 'delta_pos')
+
     def __init__(self):
-        # self.new_points is the list of points that will be used next.
-        # It persists across resets.
+        # self.new_points is the list of points that will be used next, and
+        # self.new_lifts has the indices of the points that are travelled to
+        # with the pen lifted. They persist across resets.
         self.new_points = []
+        self.new_lifts = set()
+        self.new_delay = 0
+        # The queued drawings, and the values to put back after the job being
+        # drawn of the parameters it changed (None if there isn't a job). They
+        # persist across resets.
+        self.jobs = JobQueue()
+        self.base_params = None
         ModeProgram.__init__(self, 0)
         self.add_params(PARAM_DEFAULTS, PARAM_CODES)
 
     def reset(self):
         ModeProgram.reset(self)
+        # A job that was being drawn starts over.
+        self.jobs.requeue()
+        self.restore_params()
         self.points = None # path the the robot draws
+        self.lifts = set() # indices of points reached with the pen up
+        self.pen_up = False # whether the pen is lifted
+        self.delay = 0 # time to wait before starting
         self.index = 0 # index of point robot is going towards
         self.heading = math.pi / 2 # the current heading, in standard position
         self.rot_dir = 1 # 1 for counterclockwise, -1 for clockwise
@@ -52,35 +173,256 @@ class Tracie(ModeProgram):
         self.delta_angle = 0
         self.delta_pos = 0
 
-    def __call__(self, command):
-        p_status = ModeProgram.__call__(self, command)
-        if p_status:
-            return p_status
-        if command.startswith(POINTS_PREFIX):
-            json_str = command[len(POINTS_PREFIX):]
-            self.new_points = self.transform_points(json.loads(json_str))
-            return "received {} points".format(str(len(self.new_points)))
-        if command == 'short:trace':
-            if self.mode == 0:
-                return "0 {}".format(self.heading)
-            if self.mode == 'halt':
-                return "{} {}".format(len(self.points)-1, self.heading)
-            t = self.mode_time()
-            T = self.go_for
-            i = self.index - 1
-            delta_i = 1
-            theta = self.heading
-            delta_theta = 0
-            if self.mode == 'rotate':
-                delta_i = 0
-                delta_theta = self.delta_angle
-                theta -= delta_theta
-            vals = [t, T, i, delta_i, theta, delta_theta]
-            return ' '.join(map(str, vals));
+    @command(POINTS_PREFIX, parse=json.loads, journal='drawing', arg='list')
+    def receive_points(self, data):
+        """Sets the points to draw next, and returns a status message."""
+        try:
+            new_points = self.transform_points(parse_points(data))
+        except (ValueError, KeyError, TypeError) as e:
+            return Failure("bad points: {}".format(e))
+        self.new_points = new_points
+        self.new_lifts = set()
+        self.new_delay = 0
+        return "received {} points".format(str(len(self.new_points)))
+
+    @command(STROKES_PREFIX, parse=json.loads, journal='drawing',
+             arg=('list', 'object'))
+    def receive_strokes(self, data):
+        """Sets the strokes to draw next, given either a list of strokes or an
+        object with the strokes, the delay before starting, and whether to
+        optimize them. Returns a status message."""
+        try:
+            if not isinstance(data, dict):
+                data = {'strokes': data}
+            lines = parse_strokes(data['strokes'])
+            delay = float(data.get('delay', 0))
+        except (ValueError, KeyError, TypeError) as e:
+            return Failure("bad strokes: {}".format(e))
+        return self.set_strokes(lines, data.get('optimize', True), delay)
+
+    @command('job:list', show=json.dumps)
+    def job_list(self, _):
+        return self.jobs.describe(self.progress())
+
+    @command('job:clear')
+    def job_clear(self, _):
+        return "removed {} waiting jobs".format(self.jobs.clear())
+
+    @command('job:skip')
+    def job_skip(self, _):
+        return self.skip_job()
+
+    @command('short:trace', show=show_trace)
+    def short_trace(self, _):
+        return self.trace()
+
+    @command(IMAGE_PREFIX, journal='drawing', arg='string')
+    def load_image(self, encoded):
+        """Converts a base64-encoded image into the points to draw next, and
+        returns a status message."""
+        if vectorize is None:
+            return Failure("tracing images requires numpy")
+        try:
+            lines = self.offload(vectorize.trace_image,
+                                 base64.b64decode(encoded))
+        except (TypeError, ValueError) as e:
+            return Failure("bad image: {}".format(e))
+        if not lines:
+            return Failure("nothing to draw in image")
+        return self.set_strokes(lines, optimize=False)
+
+    @command(SVG_PREFIX, journal='drawing', arg='string')
+    def load_svg(self, text):
+        """Converts an SVG document into the strokes to draw next, and returns
+        a status message. Curves are flattened to within `flatten_tolerance`
+        centimetres of the drawing as scaled by `point_scale`. The document is
+        parsed and flattened with `offload`, like an image."""
+        if not self.params['point_scale'] > 0:
+            return Failure("bad svg: point_scale must be positive")
+        tolerance = (self.params['flatten_tolerance'] /
+                     self.params['point_scale'])
+        try:
+            lines = self.offload(svg.load_svg, text, tolerance)
+        except ValueError as e:
+            return Failure("bad svg: {}".format(e))
+        if not lines:
+            return Failure("nothing to draw in svg")
+        return self.set_strokes(lines)
+
+    @command(PREVIEW_PREFIX, parse=parse_options, show=json.dumps,
+             arg=('object', 'null'))
+    def preview_drawing(self, options):
+        """Previews the drawing to be made next with the current parameters,
+        and returns the image and deviation statistics (see
+        `scribbler.preview`). The preview is rendered with `offload`, since
+        large drawings take a while."""
+        if preview is None:
+            return Failure("previews require numpy")
+        if len(self.new_points) <= 1:
+            return Failure("not enough points")
+        try:
+            render = partial(preview.preview, **(options or {}))
+            return self.offload(render, self.new_points, self.new_lifts,
+                                dict(self.params))
+        except (ValueError, TypeError) as e:
+            return Failure("bad preview: {}".format(e))
+
+    @command(JOB_PREFIX, parse=json.loads, arg='object')
+    def add_job(self, spec):
+        """Adds a drawing to the job queue and returns a status message. The
+        drawing is converted into points right away (with the job's
+        parameters), so that it can start as soon as the one before it ends."""
+        try:
+            kinds = [k for k in JOB_DRAWINGS if k in spec]
+            if len(kinds) != 1:
+                raise ValueError("needs one of " +
+                                 ', '.join(sorted(JOB_DRAWINGS)))
+            params = {}
+            for code, value in spec.get('params', {}).items():
+                if code not in self.codes:
+                    raise ValueError("invalid code: " + code)
+                name = self.codes[code]
+                value = float(value)
+                if math.isnan(value) or math.isinf(value):
+                    raise ValueError("{} must be finite".format(code))
+                if name in POSITIVE_PARAMS and value <= 0:
+                    raise ValueError("{} must be positive".format(code))
+                params[name] = value
+        except (ValueError, TypeError, AttributeError) as e:
+            return Failure("bad job: {}".format(e))
+        kind = kinds[0]
+        load = getattr(self, JOB_DRAWINGS[kind])
+        failure = load.command.check(spec[kind])
+        if failure is not None:
+            return Failure("bad job: " + failure.message)
+        saved = self.new_points, self.new_lifts, self.new_delay
+        old_params = dict((name, self.params[name]) for name in params)
+        self.params.update(params)
+        try:
+            status = load(spec[kind])
+            points, lifts = self.new_points, self.new_lifts
+            delay = self.new_delay
+        except (ValueError, KeyError, TypeError, IndexError,
+                ZeroDivisionError) as e:
+            status = str(e) or "not enough points"
+            points = saved[0]
+        finally:
+            self.params.update(old_params)
+            self.new_points, self.new_lifts, self.new_delay = saved
+        if isinstance(status, Failure):
+            return Failure("bad job: " + status.message)
+        if points is saved[0] or len(points) <= 1:
+            return Failure("bad job: " + str(status))
+        job = self.jobs.add(spec.get('name'), params, points, lifts, delay,
+                            self.clock())
+        return "queued job {} ({}): {}; {} waiting".format(
+            job.number, job.name, status, len(self.jobs))
+
+    def next_job(self):
+        """Starts drawing the next job from where the robot is, and returns a
+        status message."""
+        self.goto_mode(0)
+        job = self.jobs.start(self.clock())
+        self.base_params = dict((name, self.params[name])
+                                for name in job.params)
+        self.params.update(job.params)
+        self.new_points, self.new_lifts, self.new_delay = \
+            job.points, job.lifts, job.delay
+        # The drawing starts where the robot is, facing the way it is facing.
+        self.pose.x = self.pose.y = 0.0
+        self.heading = self.pose.heading
+        self.index = 0
+        self.pen_up = False
+        return "starting job {} ({}), {} waiting".format(
+            job.number, job.name, len(self.jobs))
+
+    def skip_job(self):
+        """Abandons the job being drawn and moves on to the next one, and
+        returns a status message."""
+        job = self.jobs.finish(self.clock(), SKIPPED)
+        if job is None:
+            return Failure("no job being drawn")
+        self.restore_params()
+        msg = "skipped job {} ({})".format(job.number, job.name)
+        if self.jobs:
+            return msg + "; " + self.next_job()
+        self.goto_mode('halt')
+        return msg
+
+    def restore_params(self):
+        """Puts the parameters that the current job changed back the way they
+        were before it."""
+        if self.base_params is not None:
+            self.params.update(self.base_params)
+            self.base_params = None
+
+    def progress(self):
+        """Returns the fraction of the points that have been reached, or None
+        if the robot isn't drawing."""
+        if not self.points or len(self.points) < 2:
+            return None
+        return min(1.0, float(self.index) / (len(self.points) - 1))
+
+    def set_strokes(self, lines, optimize=True, delay=0):
+        """Sets the drawing to make next from a list of strokes, each a list
+        of `(x, y)` points, with the pen lifted to travel between them. Unless
+        `optimize` is false, the strokes are reordered and reversed to keep
+        the travel short (if NumPy is available). The robot waits `delay`
+        seconds after being started before it moves. Returns a status
+        message."""
+        lines = [l for l in lines if len(l) > 1]
+        if not lines:
+            return Failure("not enough points")
+        start = lines[0][0]
+        was = None
+        if optimize and strokes is not None:
+            was = strokes.travel(lines, start)
+            lines = self.offload(strokes.order, lines, start)
+        points, lifts = join_strokes(lines)
+        x0, y0 = points[0]
+        self.new_points = [(x - x0, y - y0) for x, y in points]
+        self.new_lifts = lifts
+        self.new_delay = delay
+        travel = sum(dist_2d(*(points[i-1] + points[i])) for i in lifts)
+        scale = self.params['point_scale']
+        msg = "received {} points in {} strokes, {:.1f} cm of travel".format(
+            len(points), len(lines), scale * travel)
+        if was is not None:
+            msg += " (was {:.1f} cm)".format(scale * was)
+        if delay:
+            msg += ", starting after {:.1f} s".format(delay)
+        return msg
+
+    def trace(self):
+        """Returns the index of the point the robot is at and its heading if it
+        is not moving, and otherwise the elapsed and total time of the current
+        motion, the index of the point it started from, the change in index,
+        the heading it started with, and the change in heading."""
+        if self.mode == 0 or self.mode == 'wait':
+            return [0, self.heading]
+        if self.mode == 'lift':
+            return [self.index - 1, self.heading]
+        if self.mode == 'lower':
+            return [self.index, self.heading]
+        if self.mode == 'halt':
+            return [len(self.points)-1, self.heading]
+        t = self.mode_time()
+        T = self.go_for
+        i = self.index - 1
+        delta_i = 1
+        theta = self.heading
+        delta_theta = 0
+        if self.mode == 'rotate':
+            delta_i = 0
+            delta_theta = self.delta_angle
+            theta -= delta_theta
+        return [t, T, i, delta_i, theta, delta_theta]
 
     def transform_points(self, data):
         """Parses the point data and translates all points to make the firs
         point the origin. Returns the resulting points list."""
+        if not data:
+            return []
         x0 = float(data[0]['x'])
         y0 = float(data[0]['y'])
         return [(float(p['x']) - x0, float(p['y']) - y0) for p in data]
@@ -88,8 +430,9 @@ class Tracie(ModeProgram):
     @property
     def speed(self):
         # This looks wrong, but the speed is actually used just before the mode
-        # switch, so it needs to be this way.
-        if self.mode == 'drive':
+        # switch, so it needs to be this way. The pen modes come between drives
+        # and rotations, so they count as drives.
+        if self.mode in ('drive', 'lift', 'lower'):
             return self.params['rotation_speed']
         return self.params['speed']
 
@@ -107,62 +450,101 @@ class Tracie(ModeProgram):
         if self.mode == 0:
             # Use the points that were sent most recently.
             self.points = self.new_points[:]
-        if self.mode == 'rotate':
+            self.lifts = set(self.new_lifts)
+            self.delay = self.new_delay
+        if self.mode == 0 and self.delay > 0:
+            self.go_for = self.delay
+            self.goto_mode('wait')
+        elif self.mode == 'rotate':
             self.set_drive_time()
             self.goto_mode('drive')
-        elif self.mode == 0 or self.mode == 'drive':
+        elif self.mode == 'lift':
+            self.head_to_next()
+        elif self.mode == 'drive' and self.pen_up and self.stroke_ahead():
+            # Arrived at the start of a stroke after travelling.
+            self.pen_up = False
+            self.go_for = self.params['pen_pause']
+            self.goto_mode('lower')
+        elif self.mode in (0, 'wait', 'drive', 'lower'):
             self.index += 1
-            if self.index < len(self.points):
-                self.set_rotate_time()
-                # Don't even try to rotate if it's a very small angle, because
-                # the robot will go too far; it is better to go straight.
-                min_rad = deg_to_rad(self.params['min_rotation'])
-                if abs(self.delta_angle) < min_rad:
-                    self.set_drive_time()
-                    self.goto_mode('drive')
-                else:
-                    self.goto_mode('rotate')
-            else:
+            if self.index >= len(self.points):
                 self.goto_mode('halt')
+                if self.jobs.finish(self.clock()):
+                    self.restore_params()
+            elif self.index in self.lifts and not self.pen_up:
+                self.pen_up = True
+                self.go_for = self.params['pen_pause']
+                self.goto_mode('lift')
+            else:
+                self.head_to_next()
 
-    def set_drive_time(self):
-        """Sets the time duration for which the robot should drive in order to
-        get to the next point."""
-        x1, y1 = self.points[self.index -1]
-        x2, y2 = self.points[self.index]
+    def stroke_ahead(self):
+        """Returns true if the segment after the current point is drawn."""
+        following = self.index + 1
+        return following < len(self.points) and following not in self.lifts
+
+    def head_to_next(self):
+        """Starts rotating or driving towards the point at the current index."""
+        self.set_rotate_time()
+        # Don't even try to rotate if it's a very small angle, because the
+        # robot will go too far; it is better to go straight.
+        min_rad = deg_to_rad(self.params['min_rotation'])
+        if abs(self.delta_angle) < min_rad:
+            self.set_drive_time()
+            self.goto_mode('drive')
+        else:
+            self.goto_mode('rotate')
+
+    def target(self):
+        """Returns the position of the next point in centimetres."""
+        x, y = self.points[self.index]
         # Scale by the point_sacle now, rather than in the transform method,
         # because the user can change this value at any time.
-        distance = self.params['point_scale'] * dist_2d(x1, y1, x2, y2)
+        scale = self.params['point_scale']
+        return scale * x, scale * y
+
+    def set_drive_time(self):
+        """Sets the time duration for which the robot should drive in order to
+        get to the next point. The distance is measured from the estimated
+        position rather than the previous point, so that errors don't build up
+        when a small rotation is skipped."""
+        x1, y1, _ = self.position()
+        x2, y2 = self.target()
+        distance = dist_2d(x1, y1, x2, y2)
         self.go_for = self.dist_to_time(distance)
         self.delta_pos = distance
 
     def set_rotate_time(self):
         """Sets the time duration for which the robot should rotate in order to
-        be facing the next point."""
+        be facing the next point. The rotation starts from the estimated heading
+        so that the drift from skipped rotations and late stops is corrected."""
         new_heading = self.next_point_angle()
-        delta = equiv_angle(new_heading - self.heading)
+        _, _, heading = self.position()
+        delta = equiv_angle(new_heading - heading)
         self.rot_dir = 1 if delta > 0 else -1
         self.go_for = self.angle_to_time(rad_to_deg(self.rot_dir * delta))
         self.heading = new_heading
         self.delta_angle = delta
 
     def next_point_angle(self):
-        """Calculates the angle that the line connecting the current point and
-        the next point makes in standard position."""
-        x1, y1 = self.points[self.index-1]
-        x2, y2 = self.points[self.index]
+        """Calculates the angle that the line connecting the estimated position
+        and the next point makes in standard position."""
+        x1, y1, _ = self.position()
+        x2, y2 = self.target()
         return math.atan2(y2 - y1, x2 - x1)
 
     def move(self):
         """Makes Myro calls to move the robot according to the current mode.
         Called when the mode is begun and whenever the program is resumed."""
         ModeProgram.move(self)
-        if self.mode == 0 or self.mode == 'halt':
-            myro.stop()
+        if self.mode in (0, 'wait', 'halt', 'lift', 'lower'):
+            self.halt()
+        if self.mode in ('lift', 'lower'):
+            myro.beep(self.params['beep_len'], self.params['beep_freq'])
         if self.mode == 'drive':
-            myro.forward(self.speed)
+            self.forward(self.speed)
         if self.mode == 'rotate':
-            myro.rotate(self.rot_dir * self.speed)
+            self.rotate(self.rot_dir * self.speed)
 
     def status(self):
         """Return the status message that should be displayed at the beginning
@@ -171,18 +553,33 @@ class Tracie(ModeProgram):
             return "impossible"
         if self.mode == 'halt':
             return "finished drawing"
+        if self.mode == 'wait':
+            return "waiting {:.1f} s".format(self.delay)
+        if self.mode == 'lift':
+            return "lift pen"
+        if self.mode == 'lower':
+            return "lower pen"
+        if self.mode == 'drive' and self.pen_up:
+            return "travel {:.2f} cm".format(self.delta_pos)
         if self.mode == 'drive':
             return "drive {:.2f} cm".format(self.delta_pos)
         if self.mode == 'rotate':
             return "rotate {:.2f} degrees".format(rad_to_deg(self.delta_angle))
 
+    def finished(self, status):
+        return self.mode == 'halt' and not self.jobs
+
     def no_start(self):
-        if len(self.new_points) <= 1:
+        if len(self.new_points) <= 1 and not self.jobs:
             return "not enough points"
         return False
 
     def loop(self):
         ModeProgram.loop(self)
+        # Queued jobs are drawn whenever the robot is idle.
+        idle = self.mode in (0, 'halt') and self.jobs.current is None
+        if idle and self.jobs:
+            return self.next_job()
         if self.is_mode_done():
             self.next_mode()
             return self.status()
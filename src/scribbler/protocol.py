@@ -0,0 +1,245 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Parses commands and routes them to the methods that handle them.
+
+A command has a name and an argument. The web app sends commands as text, like
+'set:s=0.5', and other clients can send them as JSON objects instead, like
+`{"cmd": "set", "arg": {"s": 0.5}}`. The reply to a text command is text, as
+it always was, and the reply to a JSON command is a JSON object holding the
+handler's reply as it is, such as a number, a list, or an object. A handler
+that refuses a command returns a Failure, which JSON clients get as an error.
+
+Each class marks the methods that handle commands with the `command`
+decorator, and the commands of a class (including the ones it inherits) are
+collected into tables the first time one of its instances gets a command.
+Finding the handler is then a dictionary lookup, whichever the command is.
+"""
+
+import json
+
+try:
+    string_types = basestring
+    number_types = (int, long, float)
+except NameError:
+    string_types = str
+    number_types = (int, float)
+
+
+# Character that separates the name of a text command from its argument.
+SEPARATOR = ':'
+
+# Most separators that the name of a text command can contain, including the
+# one at its end (as in 'job:add:').
+MAX_SEPARATORS = 2
+
+# How the caller of a command should run it: right away, in its own Greenlet
+# or task (for commands that wait, like long polls), or in the controller's
+# actor (for commands that change its state).
+IMMEDIATE, WAITING, QUEUED = range(3)
+
+# Reply to a JSON command that nothing handles.
+UNKNOWN = "unknown command"
+
+# The types that a command's argument can be required to have, by name, and
+# how to describe them in a reply.
+ARG_TYPES = {
+    'object': ((dict,), "an object"),
+    'list': ((list,), "a list"),
+    'string': ((string_types,), "a string"),
+    'number': (number_types, "a number"),
+    'null': ((type(None),), "null")
+}
+
+# The command tables of each class that has received a command.
+tables = {}
+
+
+class Command(object):
+
+    """A command handled by a method.
+
+    The text form is the name followed by a colon if the command takes an
+    argument, like 'set:', and the name alone if it doesn't. The JSON name
+    leaves out the colon. In text form, the argument is converted by `parse`
+    (if given) before it reaches the method, and the method's reply is
+    converted to text by `show` (if given) unless it is None or a string.
+    If `arg` names a type in ARG_TYPES (or is a tuple of names), an argument
+    of any other type is refused before it reaches the method, whether it
+    came as JSON or was parsed from text.
+
+    Commands that change state which should survive a restart have a journal
+    key (see `scribbler.journal`). A snapshot keeps only the latest command
+    with each key, and a key of True stands for the command's own body, so
+    that only exact repeats replace each other.
+    """
+
+    def __init__(self, text, method, parse=None, show=None, kind=QUEUED,
+                 structured=True, journal=None, arg=None):
+        self.text = text
+        self.name = text.rstrip(SEPARATOR)
+        self.method = method
+        self.parse = parse
+        self.show = show
+        self.kind = kind
+        self.structured = structured
+        self.journal = journal
+        self.arg = (arg,) if isinstance(arg, str) else arg
+
+    def check(self, arg):
+        """Returns a Failure if the argument doesn't have one of the types the
+        command takes, and None if it does (or if it can be anything)."""
+        if self.arg is None:
+            return None
+        for name in self.arg:
+            types, _ = ARG_TYPES[name]
+            if isinstance(arg, types) and not isinstance(arg, bool):
+                return None
+        return Failure("bad {}: argument must be {}".format(
+            self.name, ' or '.join(ARG_TYPES[n][1] for n in self.arg)))
+
+
+class Failure(object):
+
+    """A handler's reply saying that it refused the command, such as for a bad
+    argument. Text commands get the message as the reply, and JSON commands
+    get it under 'error' instead of 'reply', so that clients can tell it apart
+    from a successful reply."""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def command(text, parse=None, show=None, kind=QUEUED, structured=True,
+            journal=None, arg=None):
+    """Decorates a method to make it handle the command with the given text
+    form (see Command). The command can only be sent as text if `structured`
+    is false."""
+    def mark(method):
+        method.command = Command(text, method.__name__, parse, show, kind,
+                                 structured, journal, arg)
+        return method
+    return mark
+
+
+def table(cls):
+    """Returns the commands of a class as a tuple of dictionaries, one by text
+    form and one by JSON name. Commands defined in subclasses take precedence
+    over the ones they inherit."""
+    found = tables.get(cls)
+    if found is None:
+        by_text, by_name = {}, {}
+        for klass in reversed(cls.__mro__):
+            for attr in vars(klass).values():
+                cmd = getattr(attr, 'command', None)
+                if isinstance(cmd, Command):
+                    by_text[cmd.text] = cmd
+                    if cmd.structured:
+                        by_name[cmd.name] = cmd
+        found = tables[cls] = (by_text, by_name)
+    return found
+
+
+class Request(object):
+
+    """A command received from a client, not yet matched to a handler. Text
+    commands keep their whole body, since where the name ends depends on which
+    commands there are."""
+
+    def __init__(self, body, name=None, arg=None, text=True):
+        self.body = body
+        self.name = name
+        self.arg = arg
+        self.text = text
+
+
+def parse(body):
+    """Returns the request for the body of a POST. Bodies that look like JSON
+    objects are JSON commands, and anything else is a text command."""
+    if not body.startswith('{'):
+        return Request(body)
+    try:
+        obj = json.loads(body)
+        return Request(body, str(obj['cmd']), obj.get('arg'), text=False)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return Request(body, text=False)
+
+
+def request(command):
+    """Returns the command as a Request, parsing it if it is a string."""
+    if isinstance(command, Request):
+        return command
+    return parse(command)
+
+
+def lookup(obj, req):
+    """Finds the command that the object handles for the request. Returns the
+    command and its argument, or None and None if the object doesn't handle
+    it. Text commands that take no argument get None."""
+    by_text, by_name = table(type(obj))
+    if not req.text:
+        cmd = by_name.get(req.name)
+        return (cmd, req.arg) if cmd else (None, None)
+    body = req.body
+    cmd = by_text.get(body)
+    if cmd:
+        return cmd, '' if body.endswith(SEPARATOR) else None
+    end = 0
+    for _ in range(MAX_SEPARATORS):
+        end = body.find(SEPARATOR, end) + 1
+        if not end:
+            break
+        cmd = by_text.get(body[:end])
+        if cmd:
+            return cmd, body[end:]
+    return None, None
+
+
+def call(obj, cmd, req, arg):
+    """Calls the object's handler for the command and returns its reply (which
+    is a coroutine for the asyncio controller's waiting commands). A text
+    argument that can't be parsed, or an argument of the wrong type, gets a
+    Failure instead."""
+    if req.text and cmd.parse and arg is not None:
+        try:
+            arg = cmd.parse(arg)
+        except (ValueError, TypeError) as e:
+            return Failure("bad {}: {}".format(cmd.name, e))
+    failure = cmd.check(arg)
+    if failure is not None:
+        return failure
+    return getattr(obj, cmd.method)(arg)
+
+
+def reply(cmd, req, value):
+    """Returns the reply to send to the client, given the handler's reply."""
+    if isinstance(value, Failure):
+        if req.text:
+            return value.message
+        return json.dumps({'cmd': cmd.name, 'error': value.message})
+    if not req.text:
+        return json.dumps({'cmd': cmd.name, 'reply': value})
+    if cmd.show and value is not None and not isinstance(value, string_types):
+        return cmd.show(value)
+    return value
+
+
+def unknown(req, text_reply=None):
+    """Returns the reply to a command that nothing handles. Text commands get
+    `text_reply`."""
+    if req.text:
+        return text_reply
+    return json.dumps({'cmd': req.name, 'error': UNKNOWN})
+
+
+def handle(obj, command, text_reply=None):
+    """Handles a command (a string or a Request) with the object's handler,
+    and returns the reply to send. Commands that the object doesn't handle
+    get the same reply as from `unknown`."""
+    req = request(command)
+    cmd, arg = lookup(obj, req)
+    if cmd is None:
+        return unknown(req, text_reply)
+    return reply(cmd, req, call(obj, cmd, req, arg))
@@ -0,0 +1,97 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Samples the obstacle sensors in the background and filters the readings."""
+
+from bisect import bisect_left, insort
+from time import time
+
+try:
+    from gevent import Greenlet, sleep
+except ImportError:
+    Greenlet = sleep = None
+
+from scribbler.link import LinkDown
+from scribbler.util import average
+
+
+# Number of times to sample the obstacle sensors per second.
+SAMPLE_RATE = 30
+
+# Number of samples in the running median. Larger windows reject more noise
+# but lag further behind the robot's motion.
+WINDOW = 5
+
+
+class Sampler(object):
+
+    """Samples the obstacle sensors at a fixed rate in a Greenlet.
+
+    The blocking Myro call is made in a worker thread by the link supervisor,
+    so waiting on the serial port never holds up the program's main loop. The
+    averages of the three sensors go into a preallocated ring buffer, and the
+    running median is updated with each sample, so reading the filtered value
+    never blocks.
+    """
+
+    def __init__(self, rate=SAMPLE_RATE, window=WINDOW):
+        """Creates a sampler. It doesn't start sampling until started."""
+        self.period = 1.0 / rate
+        self.window = window
+        self.buffer = [0.0] * window
+        self.green = None
+        self.clear()
+
+    def clear(self):
+        """Forgets all samples."""
+        self.count = 0
+        self.ordered = []
+        self.median = 0.0
+
+    @property
+    def ready(self):
+        """Returns true if there has been at least one sample."""
+        return self.count > 0
+
+    def add(self, value):
+        """Adds a sample and updates the filters."""
+        i = self.count % self.window
+        if self.count >= self.window:
+            del self.ordered[bisect_left(self.ordered, self.buffer[i])]
+        self.buffer[i] = value
+        insort(self.ordered, value)
+        n = len(self.ordered)
+        if n % 2:
+            self.median = self.ordered[n // 2]
+        else:
+            mid = n // 2
+            self.median = (self.ordered[mid - 1] + self.ordered[mid]) / 2.0
+        self.count += 1
+
+    def start(self):
+        """Starts sampling from scratch, if it is not already sampling."""
+        if self.green:
+            return
+        self.clear()
+        self.green = Greenlet(self.run)
+        self.green.start()
+
+    def stop(self):
+        """Stops sampling."""
+        if self.green:
+            self.green.kill()
+            self.green = None
+
+    def run(self):
+        """Samples the sensors forever at the sampling rate, skipping samples
+        while the link to the robot is down."""
+        while True:
+            t = time()
+            self.sample()
+            sleep(max(0, self.period - (time() - t)))
+
+    def sample(self):
+        """Takes one sample, unless the link to the robot is down."""
+        try:
+            self.add(average(myro.getObstacle()))
+        except LinkDown:
+            pass
@@ -2,20 +2,31 @@
 
 """Implements the server for the web application."""
 
-import gevent
+import json
 import os.path
+import traceback
 import webbrowser
 from datetime import datetime
-from gevent import pywsgi
 from sys import exit
 
+try:
+    import gevent
+    from gevent import pywsgi
+except ImportError:
+    gevent = pywsgi = None
+
+from scribbler import partition
 from scribbler.controller import Controller
+from scribbler.programs.tracie import (
+    POINTS_PREFIX, STROKES_PREFIX, parse_strokes)
+from scribbler.sensors import SAMPLE_RATE
 
 
 # Response statuses.
 STATUS_200 = '200 OK'
 STATUS_204 = '204 NO CONTENT'
 STATUS_404 = '404 NOT FOUND'
+STATUS_500 = '500 INTERNAL SERVER ERROR'
 
 # MIME types for file extensions.
 MIME_PLAIN = 'text/plain'
@@ -25,25 +36,114 @@ MIMES = {'html': 'text/html', 'css': 'text/css', 'js': 'application/javascript'}
 PATH_INDEX = '/index.html'
 PATH_404 = '/404.html'
 
+# Commands posted to this path go to all the robots.
+ALL_ROBOTS = 'all'
 
-class Server(object):
+# Prefix to a command for all the robots which splits a drawing between them.
+PLAN_PREFIX = 'plan:'
+
+# Command that clears the drawing of a robot that has no part in a plan, so
+# that starting all the robots doesn't make it draw an old one.
+CLEAR_DRAWING = POINTS_PREFIX + '[]'
 
-    """A very simple web server."""
 
-    def __init__(self, host, port, root, whitelist):
+class BaseServer(object):
+
+    """The part of the web server that doesn't depend on how it is scheduled:
+    finding the files to serve and the controllers that commands go to, and
+    planning drawings for several robots. Subclasses handle the requests with
+    gevent (Server) or asyncio (AsyncServer in `scribbler.aio`). This class is
+    abstract: subclasses must implement `broadcast`, which waits on the
+    controllers in their own way."""
+
+    def __init__(self, host, port, root, whitelist, controllers):
         """Create a server that serves from root on host:port.
 
         Only paths in the root directory that are also present in the whitelist
         will be served. The whitelist paths are absolute, so they must begin
         with a slash. The paths '/', '/index.html', and '/404.html' must be
         included for the website to work properly.
+
+        Commands posted to '/' go to the first controller, and those posted to
+        '/n' go to controller number n. Those posted to '/all' go to all the
+        controllers at once, except for plan commands.
         """
-        self.httpd = pywsgi.WSGIServer((host, port), self.handle_request)
         self.url = "http://{}:{}".format(host, port)
         self.root = root.rstrip('/')
         self.whitelist = whitelist
         self.running = False
-        self.controller = Controller()
+        self.controllers = controllers
+
+    def controller(self, path_info):
+        """Returns the controller that the POST path refers to, or None if
+        there is no such controller."""
+        robot = path_info.strip('/')
+        if not robot:
+            return self.controllers[0]
+        if robot == ALL_ROBOTS:
+            return self.broadcast
+        try:
+            return self.controllers[int(robot)]
+        except (ValueError, IndexError):
+            return None
+
+    def broadcast(self, command):
+        """Sends the command to all the controllers at the same time, and
+        returns their replies as from `broadcast_reply`."""
+        raise NotImplementedError("broadcast is implemented by subclasses")
+
+    def plan_commands(self, data):
+        """Splits a drawing (in the format of Tracie's strokes command) between
+        the robots. Returns a list with each robot's part of the plan and the
+        strokes command that gives the robot its part, or a string explaining
+        why the drawing couldn't be planned. Robots left out of the plan have
+        no part (None) and get a command that clears their drawing. This can
+        take a few seconds, so subclasses call it in a thread."""
+        try:
+            lines = parse_strokes(json.loads(data))
+        except ValueError as e:
+            return "bad plan: {}".format(e)
+        robots = partition.plan(lines, len(self.controllers))
+        commands = []
+        for robot in robots:
+            strokes = [[{'x': x, 'y': y} for x, y in s]
+                       for s in robot['strokes']]
+            commands.append((robot, STROKES_PREFIX + json.dumps({
+                'strokes': strokes,
+                'delay': robot['delay'],
+                'optimize': False
+            })))
+        for _ in range(len(robots), len(self.controllers)):
+            commands.append((None, CLEAR_DRAWING))
+        return commands
+
+    def path(self, path_info):
+        """Returns the relative path that should be followed for the request.
+        The root will go to index file. Anything not present in the server's
+        whitelist will cause a 404."""
+        if path_info in self.whitelist:
+            if path_info == '/':
+                path_info = PATH_INDEX
+        else:
+            path_info = PATH_404
+        return self.root + path_info
+
+
+class Server(BaseServer):
+
+    """A very simple web server."""
+
+    def __init__(self, host, port, root, whitelist, sample_rate=SAMPLE_RATE,
+                 controllers=None):
+        """Create a server that serves from root on host:port (see
+        BaseServer). The robot's sensors are sampled at `sample_rate` (Hz)
+        while a program is running. By default there is one controller in this
+        process, but a list of controllers (such as RemoteControllers for
+        robots in worker processes) can be passed instead."""
+        if controllers is None:
+            controllers = [Controller(sample_rate=sample_rate)]
+        BaseServer.__init__(self, host, port, root, whitelist, controllers)
+        self.httpd = pywsgi.WSGIServer((host, port), self.handle_request)
 
     def start(self, open_browser=True, verbose=True):
         """Starts the server if it is not already running. Unless False
@@ -61,7 +161,8 @@ class Server(object):
     def stop(self):
         """Stops the program and the server. Does nothing if already stopped."""
         if self.running:
-            self.controller.stop()
+            for controller in self.controllers:
+                controller.close()
             self.httpd.stop()
 
     def stay_alive(self):
@@ -79,7 +180,12 @@ class Server(object):
         if method == 'GET':
             return self.handle_get(env['PATH_INFO'], start_response)
         elif method == 'POST':
-            return self.handle_post(extract_data(env), start_response)
+            controller = self.controller(env['PATH_INFO'])
+            if not controller:
+                start_response(STATUS_404, headers(get_mime(), 0))
+                return [""]
+            return self.handle_post(controller, extract_data(env),
+                                    start_response)
 
     def handle_get(self, path_info, start_response):
         """Handles a GET request, which is used for getting resources."""
@@ -88,9 +194,15 @@ class Server(object):
         start_response(get_status(path), head)
         return open(path)
 
-    def handle_post(self, data, start_response):
-        """Handles a POST request, which is used for AJAX communication."""
-        msg = self.controller(data)
+    def handle_post(self, controller, data, start_response):
+        """Handles a POST request, which is used for AJAX communication. An
+        error in handling the command is reported, and the reply is a 500."""
+        try:
+            msg = controller(data)
+        except Exception:
+            traceback.print_exc()
+            start_response(STATUS_500, headers(get_mime(), 0))
+            return [""]
         if msg == None:
             head = headers(get_mime(), 0)
             start_response(STATUS_204, head)
@@ -99,16 +211,53 @@ class Server(object):
         start_response(get_status(), head)
         return [msg]
 
-    def path(self, path_info):
-        """Returns the relative path that should be followed for the request.
-        The root will go to index file. Anything not present in the server's
-        whitelist will cause a 404."""
-        if path_info in self.whitelist:
-            if path_info == '/':
-                path_info = PATH_INDEX
-        else:
-            path_info = PATH_404
-        return self.root + path_info
+    def broadcast(self, command):
+        """Sends the command to all the controllers at the same time, or plans
+        a drawing for them if it is a plan command. Returns their replies, one
+        per line, or None if none of them replied."""
+        if command.startswith(PLAN_PREFIX):
+            return self.plan(command[len(PLAN_PREFIX):])
+        jobs = [gevent.spawn(c, command) for c in self.controllers]
+        gevent.joinall(jobs)
+        return broadcast_reply([job.value for job in jobs])
+
+    def plan(self, data):
+        """Splits a drawing between the robots in gevent's thread pool, sends
+        each its part, and returns where to place each robot relative to the
+        first one."""
+        commands = gevent.get_hub().threadpool.apply(self.plan_commands,
+                                                     (data,))
+        if isinstance(commands, str):
+            return commands
+        replies = [controller(command) for controller, (_, command)
+                   in zip(self.controllers, commands)]
+        return plan_reply([robot for robot, _ in commands], replies)
+
+
+def broadcast_reply(replies):
+    """Returns the replies of the controllers to a broadcast command, one per
+    line, or None if none of them replied."""
+    lines = ["{}: {}".format(i, reply)
+             for i, reply in enumerate(replies) if reply is not None]
+    return '\n'.join(lines) or None
+
+
+def plan_reply(robots, replies):
+    """Returns where to place each robot relative to the first one, along with
+    its reply to the command giving it its part of the plan. Robots without a
+    part are reported as idle."""
+    lines = []
+    for i, (robot, reply) in enumerate(zip(robots, replies)):
+        if robot is None:
+            lines.append("{}: idle, nothing to draw: {}".format(i, reply))
+            continue
+        x, y = robot['offset']
+        msg = "{}: place at ({:.1f}, {:.1f}) cm, about {:.0f} s: {}".format(
+            i, x, y, robot['time'], reply)
+        if not robot['clear']:
+            msg += " (may come close to another robot)"
+        lines.append(msg)
+    return '\n'.join(lines)
 
 
 def get_status(path=None):
@@ -0,0 +1,173 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Simulates the Scribbler and a clock so that programs can run without one."""
+
+import math
+import random
+
+try:
+    import __builtin__
+except ImportError:
+    import builtins as __builtin__
+
+from scribbler.programs.base import PARAM_DEFAULTS
+
+
+# Maximum value of an obstacle sensor reading.
+IR_MAX = 6400
+
+# Distance at which the obstacle sensors start to see an obstacle (cm).
+IR_RANGE = 20.0
+
+# Step used when looking for obstacles in front of the robot (cm).
+IR_STEP = 0.5
+
+# Radius of the robot, for detecting collisions (cm).
+ROBOT_RADIUS = 8.0
+
+
+def install(backend):
+    """Makes programs use the given backend (such as a SimRobot) as Myro."""
+    __builtin__.myro = backend
+
+
+class SimClock(object):
+
+    """A clock that only advances when it is told to."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        """Returns the current simulated time (seconds)."""
+        return self.now
+
+    def advance(self, dt):
+        """Moves the clock forward by `dt` seconds."""
+        self.now += dt
+
+
+class SimRobot(object):
+
+    """A simulated Scribbler that implements the Myro functions used by the
+    programs.
+
+    The robot drives at a velocity proportional to the speed it is given, using
+    the true conversion factors passed to the constructor (which are unknown to
+    the programs). Each motor command is perturbed by Gaussian noise with the
+    given relative standard deviation. Obstacles are axis-aligned rectangles of
+    the form `(x0, y0, x1, y1)` in centimetres, and a collision is counted each
+    time the robot runs into one (not for as long as it stays there). The
+    robot starts at the origin facing up (in the positive y direction). The
+    battery starts at `battery` volts and loses `drain` volts per second, and
+    the robot's speed is proportional to the voltage, so the conversion
+    factors only hold at the start.
+    """
+
+    def __init__(self, clock, dist_to_time=None, angle_to_time=None,
+                 obstacles=(), noise=0.0, seed=None, battery=9.0, drain=0.0):
+        self.clock = clock
+        self.dist_to_time = dist_to_time or PARAM_DEFAULTS['dist_to_time']
+        self.angle_to_time = angle_to_time or PARAM_DEFAULTS['angle_to_time']
+        self.obstacles = list(obstacles)
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.battery = battery
+        self.drain = drain
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = math.pi / 2
+        self.velocity = 0.0
+        self.turn_rate = 0.0
+        self.last = clock.time()
+        self.started = self.last
+        self.path = [(self.last, self.x, self.y, self.heading)]
+        self.collisions = 0
+        self.colliding = False
+
+    def update(self):
+        """Moves the robot according to its motion since the last update."""
+        now = self.clock.time()
+        dt = now - self.last
+        self.last = now
+        if dt <= 0:
+            return
+        v, w, theta = self.velocity, self.turn_rate, self.heading
+        if w == 0:
+            self.x += v * math.cos(theta) * dt
+            self.y += v * math.sin(theta) * dt
+        else:
+            self.x += v / w * (math.sin(theta + w * dt) - math.sin(theta))
+            self.y -= v / w * (math.cos(theta + w * dt) - math.cos(theta))
+            self.heading += w * dt
+        colliding = self.inside(self.x, self.y, ROBOT_RADIUS)
+        if colliding and not self.colliding:
+            self.collisions += 1
+        self.colliding = colliding
+
+    def command(self, velocity, turn_rate):
+        """Updates the position and then changes the motion of the robot."""
+        self.update()
+        factor = 1 + self.random.gauss(0, self.noise) if self.noise else 1
+        factor *= self.voltage() / self.battery
+        self.velocity = velocity * factor
+        self.turn_rate = turn_rate * factor
+        self.path.append((self.last, self.x, self.y, self.heading))
+
+    def inside(self, x, y, margin=0.0):
+        """Returns true if the point is within `margin` of an obstacle."""
+        for x0, y0, x1, y1 in self.obstacles:
+            if x0 - margin < x < x1 + margin and y0 - margin < y < y1 + margin:
+                return True
+        return False
+
+    def voltage(self):
+        """Returns the battery voltage right now."""
+        return max(0.0, self.battery - self.drain * (self.clock.time() -
+                                                      self.started))
+
+    def reading(self):
+        """Returns the obstacle sensor reading for the current position."""
+        if not self.obstacles:
+            return 0
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        d = 0.0
+        while d < IR_RANGE:
+            if self.inside(self.x + d * c, self.y + d * s):
+                return int(IR_MAX * (1 - d / IR_RANGE))
+            d += IR_STEP
+        return 0
+
+    # The Myro functions.
+
+    def initialize(self, port):
+        pass
+
+    def forward(self, speed):
+        self.command(speed / self.dist_to_time, 0)
+
+    def backward(self, speed):
+        self.command(-speed / self.dist_to_time, 0)
+
+    def rotate(self, speed):
+        self.command(0, math.radians(speed / self.angle_to_time))
+
+    def stop(self):
+        self.command(0, 0)
+
+    def beep(self, length, freq):
+        pass
+
+    def getObstacle(self):
+        self.update()
+        r = self.reading()
+        return [r, r, r]
+
+    def getBattery(self):
+        return self.voltage()
+
+    # Not part of Myro: lets calibration measure the true motion.
+
+    def getPose(self):
+        self.update()
+        return self.x, self.y, self.heading
@@ -0,0 +1,79 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Keeps a bounded log of status messages that any number of clients can
+read."""
+
+try:
+    from gevent.event import Event
+except ImportError:
+    Event = None
+
+
+# Number of messages kept in the log. Older messages are overwritten.
+CAPACITY = 256
+
+
+class StatusLog(object):
+
+    """A fixed-capacity ring buffer of sequence-numbered status messages.
+
+    Each message gets the next sequence number, starting at zero. A reader keeps
+    a cursor (the sequence number of the next message it wants) and asks for
+    everything from there on, so every reader sees the same stream regardless
+    of how many there are. A reader that falls more than `capacity` messages
+    behind is told how many it missed instead of silently skipping them.
+
+    Readers wait on a gevent Event. Subclasses for other concurrency backends
+    set `event_class` and do their own waiting in `read`.
+    """
+
+    # The kind of event that waiting readers block on.
+    event_class = Event
+
+    def __init__(self, capacity=CAPACITY):
+        """Creates an empty log that holds at most `capacity` messages."""
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+        self.next_seq = 0
+        self.event = self.event_class()
+
+    @property
+    def oldest(self):
+        """Returns the sequence number of the oldest message still held."""
+        return max(0, self.next_seq - self.capacity)
+
+    def put(self, msg):
+        """Appends a message to the log and wakes up all waiting readers."""
+        self.buffer[self.next_seq % self.capacity] = msg
+        self.next_seq += 1
+        event, self.event = self.event, self.event_class()
+        event.set()
+
+    def read(self, cursor=None, timeout=None):
+        """Returns the messages from `cursor` onwards as a tuple of the form
+        `(messages, cursor, missed)`, where `cursor` is the one to pass next
+        time and `missed` is the number of messages that were overwritten before
+        they could be read. Blocks for up to `timeout` seconds if there are no
+        new messages yet. A cursor of None means only new messages are wanted;
+        a cursor from the future (the server restarted) starts at the oldest."""
+        cursor = self.start(cursor)
+        if cursor == self.next_seq:
+            self.event.wait(timeout)
+        return self.collect(cursor)
+
+    def start(self, cursor):
+        """Returns the sequence number that a read from `cursor` starts at."""
+        if cursor is None:
+            return self.next_seq
+        if cursor > self.next_seq:
+            return self.oldest
+        return cursor
+
+    def collect(self, cursor):
+        """Returns the messages from `cursor` onwards without waiting, in the
+        same form as `read`."""
+        missed = max(0, self.oldest - cursor)
+        cursor += missed
+        end = self.next_seq
+        msgs = [self.buffer[i % self.capacity] for i in range(cursor, end)]
+        return msgs, end, missed
@@ -0,0 +1,215 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Orders the strokes of a drawing to keep the pen travel between them short."""
+
+from time import time
+
+import numpy as np
+
+
+# Maximum number of 2-opt passes over the whole tour.
+MAX_PASSES = 20
+
+# Longest run of strokes that 2-opt tries reversing. Longer reversals rarely
+# help after a nearest-neighbour tour, and this keeps each pass linear in the
+# number of strokes.
+MAX_RUN = 100
+
+# Longest time spent improving a tour with 2-opt (seconds).
+TIME_LIMIT = 0.3
+
+# Smallest improvement that counts, so that rounding errors can't make the
+# 2-opt passes go on forever.
+EPSILON = 1e-9
+
+# Average number of entry points in each cell of the grid that finds the
+# nearest stroke.
+CELL_ENTRIES = 4
+
+
+def is_closed(stroke):
+    """Returns true if the stroke ends where it starts."""
+    return len(stroke) > 2 and np.array_equal(stroke[0], stroke[-1])
+
+
+def travel(strokes, start=(0, 0)):
+    """Returns the total distance travelled between the strokes when they are
+    drawn in order, starting from `start`."""
+    if not len(strokes):
+        return 0.0
+    heads = np.array([s[0] for s in strokes], dtype=float)
+    tails = np.array([start] + [s[-1] for s in strokes[:-1]], dtype=float)
+    return float(np.hypot(*(heads - tails).T).sum())
+
+
+class EntryGrid(object):
+
+    """A uniform grid of points, for finding the nearest of those that are
+    left while they are taken away. Each search looks at a square of cells
+    around the query that doubles in size until it must hold the nearest
+    point, so it only looks at the points nearby. The cells are rebuilt
+    without the points that are gone once half of those in them are."""
+
+    def __init__(self, points):
+        self.points = points
+        self.left = np.ones(len(points), dtype=bool)
+        self.lo = points.min(axis=0)
+        span = points.max(axis=0) - self.lo
+        area = max(span[0], 1e-9) * max(span[1], 1e-9)
+        self.size = np.sqrt(area * CELL_ENTRIES / len(points))
+        self.cols, self.rows = (span // self.size).astype(int) + 1
+        self.build()
+
+    def cell(self, p):
+        """Returns the column and row of the cell nearest to the point."""
+        c = ((p - self.lo) // self.size).astype(int)
+        return (min(max(c[0], 0), self.cols - 1),
+                min(max(c[1], 0), self.rows - 1))
+
+    def build(self):
+        """Sorts the points that are left by cell."""
+        idx = np.flatnonzero(self.left)
+        c = ((self.points[idx] - self.lo) // self.size).astype(int)
+        key = np.minimum(c[:, 1], self.rows - 1) * self.cols + np.minimum(
+            c[:, 0], self.cols - 1)
+        order = np.argsort(key, kind='mergesort')
+        self.members = idx[order]
+        self.starts = np.searchsorted(key[order],
+                                      np.arange(self.rows * self.cols + 1))
+        self.gone = 0
+
+    def remove(self, lo, hi):
+        """Takes away the points from index `lo` up to `hi`."""
+        self.gone += np.count_nonzero(self.left[lo:hi])
+        self.left[lo:hi] = False
+        if 2 * self.gone > len(self.members) and self.left.any():
+            self.build()
+
+    def nearest(self, p):
+        """Returns the index of the nearest point that is left to `p`, or None
+        if there are none."""
+        cx, cy = self.cell(p)
+        r = 1
+        while True:
+            x0, x1 = max(cx - r, 0), min(cx + r, self.cols - 1)
+            y0, y1 = max(cy - r, 0), min(cy + r, self.rows - 1)
+            rows = np.arange(y0, y1 + 1) * self.cols
+            begin = self.starts[rows + x0]
+            counts = self.starts[rows + x1 + 1] - begin
+            total = counts.sum()
+            offset = np.cumsum(counts) - counts
+            found = self.members[np.arange(total) + np.repeat(begin - offset,
+                                                              counts)]
+            found = found[self.left[found]]
+            whole = x0 == 0 and y0 == 0 and x1 == self.cols - 1 and \
+                y1 == self.rows - 1
+            if len(found):
+                dist = np.hypot(*(self.points[found] - p).T)
+                k = np.argmin(dist)
+                # Points outside the square are at least this far away.
+                edges = [np.inf] * 4
+                if x0 > 0:
+                    edges[0] = p[0] - (self.lo[0] + x0 * self.size)
+                if x1 < self.cols - 1:
+                    edges[1] = self.lo[0] + (x1 + 1) * self.size - p[0]
+                if y0 > 0:
+                    edges[2] = p[1] - (self.lo[1] + y0 * self.size)
+                if y1 < self.rows - 1:
+                    edges[3] = self.lo[1] + (y1 + 1) * self.size - p[1]
+                if dist[k] <= min(edges):
+                    return found[k]
+            elif whole:
+                return None
+            r *= 2
+
+
+def nearest_neighbour(strokes, start=(0, 0)):
+    """Orders the strokes by always going to the nearest place where an
+    unfinished stroke can be started. Closed strokes can be started at any of
+    their points, and open strokes at either end. Returns the strokes in order,
+    each rotated or reversed so that it begins where the robot enters it."""
+    entries = []
+    points = []
+    for stroke in strokes:
+        if is_closed(stroke):
+            idx = np.arange(len(stroke) - 1)
+        else:
+            idx = np.array([0, len(stroke) - 1])
+        entries.append(idx)
+        points.append(stroke[idx])
+    # The entries of each stroke are together, from first[s] to first[s + 1].
+    first = np.cumsum([0] + [len(e) for e in entries])
+    owner = np.repeat(np.arange(len(strokes)), np.diff(first))
+    entries = np.concatenate(entries)
+    grid = EntryGrid(np.concatenate(points))
+    here = np.asarray(start, dtype=float)
+    ordered = []
+    for _ in range(len(strokes)):
+        e = grid.nearest(here)
+        s, i = owner[e], entries[e]
+        grid.remove(first[s], first[s + 1])
+        stroke = strokes[s]
+        if is_closed(stroke):
+            stroke = np.concatenate((stroke[i:-1], stroke[:i+1]))
+        elif i > 0:
+            stroke = stroke[::-1]
+        ordered.append(stroke)
+        here = stroke[-1]
+    return ordered
+
+
+def two_opt(strokes, start=(0, 0), max_passes=MAX_PASSES, max_run=MAX_RUN,
+            time_limit=TIME_LIMIT):
+    """Improves an order of the strokes by reversing runs of it (and the
+    direction of each stroke in the run) whenever that shortens the travel.
+    All the runs of up to `max_run` strokes starting at one position are tried
+    at once. Gives up after `time_limit` seconds, keeping the improvements
+    made so far."""
+    deadline = time() + time_limit
+    n = len(strokes)
+    heads = np.array([s[0] for s in strokes], dtype=float)
+    tails = np.array([s[-1] for s in strokes], dtype=float)
+    order = np.arange(n)
+    flipped = np.zeros(n, dtype=bool)
+    start = np.asarray(start, dtype=float)
+    link = np.zeros(n)
+    rejoin = np.zeros(n)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n):
+            if time() > deadline:
+                break
+            before = tails[i - 1] if i else start
+            # Reversing the run from i to j joins `before` to the tail of j,
+            # and the head of i to the head of j + 1.
+            m = min(n - i, max_run)
+            j = np.arange(i + 1, i + m + 1)
+            joined = j < n
+            after = heads[np.minimum(j, n - 1)]
+            link[:m] = np.where(joined, np.hypot(*(tails[j-1] - after).T), 0)
+            rejoin[:m] = np.where(joined, np.hypot(*(heads[i] - after).T), 0)
+            gain = (np.hypot(*(before - heads[i])) + link[:m]
+                    - np.hypot(*(before - tails[i:i+m]).T) - rejoin[:m])
+            k = np.argmax(gain)
+            if gain[k] > EPSILON:
+                j = i + k + 1
+                new_heads = tails[i:j][::-1].copy()
+                tails[i:j] = heads[i:j][::-1]
+                heads[i:j] = new_heads
+                order[i:j] = order[i:j][::-1].copy()
+                flipped[i:j] = ~flipped[i:j][::-1]
+                improved = True
+        if not improved or time() > deadline:
+            break
+    return [strokes[s][::-1] if f else strokes[s]
+            for s, f in zip(order, flipped)]
+
+
+def order(strokes, start=(0, 0)):
+    """Orders and orients the strokes (arrays of points) to keep the travel
+    between them short. Returns the strokes in the order they should be
+    drawn, each starting where the robot should begin drawing it."""
+    if not strokes:
+        return []
+    strokes = [np.asarray(s, dtype=float) for s in strokes]
+    return two_opt(nearest_neighbour(strokes, start), start)
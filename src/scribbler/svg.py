@@ -0,0 +1,391 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Imports vector drawings from SVG files as strokes for Tracie."""
+
+import math
+import re
+from xml.etree import ElementTree
+
+
+# Greatest depth to which a Bezier curve is subdivided, so that a degenerate
+# curve can't take forever to flatten.
+MAX_DEPTH = 16
+
+# Elements whose children are not drawn directly.
+HIDDEN = {'defs', 'clipPath', 'mask', 'symbol', 'marker', 'pattern', 'title',
+          'desc', 'metadata', 'style'}
+
+# The identity transform, as the matrix (a, b, c, d, e, f) used by SVG.
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+# Numbers and commands in path data and transform lists.
+NUMBER = re.compile(r'[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?')
+TRANSFORM = re.compile(r'(\w+)\s*\(([^)]*)\)')
+
+# Number of parameters taken by each path command.
+PATH_ARGS = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2,
+             'A': 7, 'Z': 0}
+
+
+def finite(text):
+    """Converts a number in the document to a float. Raises ValueError if it
+    isn't a number or is too large to represent, like 1e400."""
+    x = float(text)
+    if not is_finite(x):
+        raise ValueError("number out of range: {}".format(text))
+    return x
+
+
+def is_finite(x):
+    """Returns true if the float is neither infinite nor NaN."""
+    return not (math.isinf(x) or math.isnan(x))
+
+
+def multiply(m, n):
+    """Returns the transform that applies `n` and then `m`."""
+    a, b, c, d, e, f = m
+    p, q, r, s, t, u = n
+    return (a*p + c*q, b*p + d*q, a*r + c*s, b*r + d*s,
+            a*t + c*u + e, b*t + d*u + f)
+
+
+def apply(m, point):
+    """Transforms a point."""
+    a, b, c, d, e, f = m
+    x, y = point
+    return (a*x + c*y + e, b*x + d*y + f)
+
+
+def parse_transform(text):
+    """Parses an SVG transform list into a single transform. Raises ValueError
+    if it contains an unknown transform."""
+    m = IDENTITY
+    for name, args in TRANSFORM.findall(text or ''):
+        v = [finite(n) for n in NUMBER.findall(args)]
+        if name == 'matrix' and len(v) == 6:
+            t = tuple(v)
+        elif name == 'translate' and v:
+            t = (1, 0, 0, 1, v[0], v[1] if len(v) > 1 else 0)
+        elif name == 'scale' and v:
+            t = (v[0], 0, 0, v[1] if len(v) > 1 else v[0], 0, 0)
+        elif name == 'rotate' and v:
+            a = math.radians(v[0])
+            t = (math.cos(a), math.sin(a), -math.sin(a), math.cos(a), 0, 0)
+            if len(v) == 3:
+                t = multiply((1, 0, 0, 1, v[1], v[2]),
+                             multiply(t, (1, 0, 0, 1, -v[1], -v[2])))
+        elif name == 'skewX' and v:
+            t = (1, 0, math.tan(math.radians(v[0])), 1, 0, 0)
+        elif name == 'skewY' and v:
+            t = (1, math.tan(math.radians(v[0])), 0, 1, 0, 0)
+        else:
+            raise ValueError("bad transform: {}({})".format(name, args))
+        m = multiply(m, t)
+    return m
+
+
+def scale_of(m):
+    """Returns the factor by which a transform scales lengths on average."""
+    return math.sqrt(abs(m[0] * m[3] - m[1] * m[2])) or 1.0
+
+
+def flatten_cubic(p0, p1, p2, p3, tolerance, out):
+    """Appends points approximating a cubic Bezier curve (excluding its start)
+    to `out`. The curve is split in half until the control points are within
+    `tolerance` of the chord, so gentle curves get few points and tight curves
+    get many."""
+    stack = [(p0, p1, p2, p3, 0)]
+    while stack:
+        a, b, c, d, depth = stack.pop()
+        if depth >= MAX_DEPTH or flat_enough(a, b, c, d, tolerance):
+            out.append(d)
+            continue
+        ab, bc, cd = midpoint(a, b), midpoint(b, c), midpoint(c, d)
+        abc, bcd = midpoint(ab, bc), midpoint(bc, cd)
+        mid = midpoint(abc, bcd)
+        # Push the second half first so that the first half comes out first.
+        stack.append((mid, bcd, cd, d, depth + 1))
+        stack.append((a, ab, abc, mid, depth + 1))
+
+
+def flat_enough(a, b, c, d, tolerance):
+    """Returns true if the cubic curve is within `tolerance` of the chord from
+    a to d. The curve strays at most 3/4 as far from the chord as the farthest
+    of the control points b and c."""
+    dx, dy = d[0] - a[0], d[1] - a[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return max(math.hypot(b[0] - a[0], b[1] - a[1]),
+                   math.hypot(c[0] - a[0], c[1] - a[1])) <= tolerance
+    db = abs(dx * (b[1] - a[1]) - dy * (b[0] - a[0])) / length
+    dc = abs(dx * (c[1] - a[1]) - dy * (c[0] - a[0])) / length
+    return 0.75 * max(db, dc) <= tolerance
+
+
+def midpoint(p, q):
+    return ((p[0] + q[0]) / 2, (p[1] + q[1]) / 2)
+
+
+def arc_points(start, rx, ry, phi, large, sweep, end, tolerance):
+    """Returns points approximating an SVG elliptical arc (excluding its
+    start). The step angle is chosen so that the sagitta of each chord on the
+    larger radius is within `tolerance`."""
+    if start == end:
+        return []
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0:
+        return [end]
+    cos_phi, sin_phi = math.cos(phi), math.sin(phi)
+    # Convert from endpoint to centre parametrization (SVG spec F.6.5).
+    hx, hy = (start[0] - end[0]) / 2, (start[1] - end[1]) / 2
+    x1 = cos_phi * hx + sin_phi * hy
+    y1 = -sin_phi * hx + cos_phi * hy
+    grow = (x1 / rx) ** 2 + (y1 / ry) ** 2
+    if grow > 1:
+        rx, ry = rx * math.sqrt(grow), ry * math.sqrt(grow)
+    num = rx*rx*ry*ry - rx*rx*y1*y1 - ry*ry*x1*x1
+    den = rx*rx*y1*y1 + ry*ry*x1*x1
+    k = math.sqrt(max(0, num / den)) if den else 0
+    if large == sweep:
+        k = -k
+    cx1, cy1 = k * rx * y1 / ry, -k * ry * x1 / rx
+    cx = cos_phi * cx1 - sin_phi * cy1 + (start[0] + end[0]) / 2
+    cy = sin_phi * cx1 + cos_phi * cy1 + (start[1] + end[1]) / 2
+    theta = math.atan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    delta = math.atan2((-y1 - cy1) / ry, (-x1 - cx1) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    r = max(rx, ry)
+    step = math.pi
+    if tolerance < r:
+        step = 2 * math.acos(max(-1, 1 - tolerance / r))
+    n = min(max(1, int(math.ceil(abs(delta) / step))), 2 ** MAX_DEPTH)
+    points = []
+    for i in range(1, n):
+        t = theta + delta * i / n
+        x, y = rx * math.cos(t), ry * math.sin(t)
+        points.append((cos_phi * x - sin_phi * y + cx,
+                       sin_phi * x + cos_phi * y + cy))
+    points.append(end)
+    return points
+
+
+class PathReader(object):
+
+    """Reads the commands and numbers in SVG path data."""
+
+    def __init__(self, d):
+        self.d = d
+        self.pos = 0
+
+    def skip(self):
+        """Skips whitespace and commas."""
+        while self.pos < len(self.d) and self.d[self.pos] in ' \t\r\n,':
+            self.pos += 1
+
+    def command(self):
+        """Returns the next command letter, or None at the end."""
+        self.skip()
+        if self.pos >= len(self.d):
+            return None
+        c = self.d[self.pos]
+        if c.upper() not in PATH_ARGS:
+            return None
+        self.pos += 1
+        return c
+
+    def has_number(self):
+        """Returns true if a number comes next."""
+        self.skip()
+        return bool(NUMBER.match(self.d, self.pos))
+
+    def number(self):
+        """Reads a number. Raises ValueError if there isn't one."""
+        self.skip()
+        match = NUMBER.match(self.d, self.pos)
+        if not match:
+            raise ValueError("bad path data at {}".format(self.pos))
+        self.pos = match.end()
+        return finite(match.group())
+
+    def flag(self):
+        """Reads an arc flag, which may be written without a separator."""
+        self.skip()
+        c = self.d[self.pos:self.pos+1]
+        if c not in ('0', '1'):
+            raise ValueError("bad arc flag at {}".format(self.pos))
+        self.pos += 1
+        return c == '1'
+
+
+def path_strokes(d, m, tolerance):
+    """Flattens SVG path data under the transform `m`. Returns a list of
+    strokes, one per subpath, each a list of `(x, y)` points."""
+    reader = PathReader(d)
+    strokes = []
+    stroke = None
+    here = start = (0.0, 0.0)
+    control = None # reflected control point for S and T
+    scale = scale_of(m)
+    last = None
+    while True:
+        c = reader.command()
+        if c is None:
+            if reader.pos < len(reader.d):
+                raise ValueError("bad path command at {}".format(reader.pos))
+            break
+        rel = c.islower()
+        c = c.upper()
+        first = True
+        while first or (PATH_ARGS[c] and reader.has_number()):
+            ox, oy = here if rel else (0.0, 0.0)
+            pt = lambda: (ox + reader.number(), oy + reader.number())
+            out = []
+            if c == 'M':
+                here = start = pt()
+                stroke = [apply(m, here)]
+                strokes.append(stroke)
+                # Further coordinate pairs are implicit lines.
+                c = 'L'
+            elif c == 'Z':
+                out.append(start)
+                here = start
+            elif c == 'L':
+                here = pt()
+                out.append(here)
+            elif c == 'H':
+                here = (ox + reader.number(), here[1])
+                out.append(here)
+            elif c == 'V':
+                here = (here[0], oy + reader.number())
+                out.append(here)
+            elif c in 'CS':
+                if c == 'C':
+                    c1 = pt()
+                elif last in ('C', 'S'):
+                    c1 = (2 * here[0] - control[0], 2 * here[1] - control[1])
+                else:
+                    c1 = here
+                c2, end = pt(), pt()
+                pts = []
+                flatten_cubic(apply(m, here), apply(m, c1), apply(m, c2),
+                              apply(m, end), tolerance, pts)
+                control, here = c2, end
+                out = pts
+            elif c in 'QT':
+                if c == 'Q':
+                    q = pt()
+                elif last in ('Q', 'T'):
+                    q = (2 * here[0] - control[0], 2 * here[1] - control[1])
+                else:
+                    q = here
+                end = pt()
+                # Raise the quadratic curve to a cubic one.
+                c1 = (here[0] + 2 * (q[0] - here[0]) / 3,
+                      here[1] + 2 * (q[1] - here[1]) / 3)
+                c2 = (end[0] + 2 * (q[0] - end[0]) / 3,
+                      end[1] + 2 * (q[1] - end[1]) / 3)
+                pts = []
+                flatten_cubic(apply(m, here), apply(m, c1), apply(m, c2),
+                              apply(m, end), tolerance, pts)
+                control, here = q, end
+                out = pts
+            elif c == 'A':
+                rx, ry = reader.number(), reader.number()
+                phi = math.radians(reader.number())
+                large, sweep = reader.flag(), reader.flag()
+                end = pt()
+                # Flatten in the arc's own coordinates, where the tolerance is
+                # scaled down by the transform's scale.
+                pts = arc_points(here, rx, ry, phi, large, sweep, end,
+                                 tolerance / scale)
+                here = end
+                out = [apply(m, p) for p in pts]
+            if c not in 'CSQT':
+                control = None
+            if c != 'M':
+                if stroke is None:
+                    stroke = [apply(m, start)]
+                    strokes.append(stroke)
+                if c in 'CSQTA':
+                    stroke.extend(out)
+                else:
+                    stroke.extend(apply(m, p) for p in out)
+            last = c
+            first = False
+            if c == 'Z':
+                stroke = None
+                break
+    return strokes
+
+
+def shape_path(tag, attrib):
+    """Returns equivalent path data for a basic shape element, or None if it is
+    not a shape."""
+    f = lambda name: finite(attrib.get(name, 0) or 0)
+    if tag == 'path':
+        return attrib.get('d', '')
+    if tag == 'line':
+        return "M{} {} L{} {}".format(f('x1'), f('y1'), f('x2'), f('y2'))
+    if tag in ('polyline', 'polygon'):
+        v = NUMBER.findall(attrib.get('points', ''))
+        if len(v) < 4:
+            return ''
+        d = "M" + " ".join(v[:len(v) // 2 * 2])
+        return d + "Z" if tag == 'polygon' else d
+    if tag == 'rect':
+        x, y, w, h = f('x'), f('y'), f('width'), f('height')
+        return "M{} {} h{} v{} h{} Z".format(x, y, w, h, -w)
+    if tag in ('circle', 'ellipse'):
+        cx, cy = f('cx'), f('cy')
+        rx = f('r') if tag == 'circle' else f('rx')
+        ry = f('r') if tag == 'circle' else f('ry')
+        return ("M{0} {1} A{2} {3} 0 1 0 {4} {1} A{2} {3} 0 1 0 {0} {1} Z"
+                .format(cx - rx, cy, rx, ry, cx + rx))
+    return None
+
+
+def load_svg(text, tolerance):
+    """Converts an SVG document into strokes for Tracie, with the curves
+    flattened to within `tolerance` (in user units, which are taken to be
+    canvas pixels). The y-axis is flipped to point upwards. Raises ValueError
+    if the tolerance isn't positive, or if the document can't be read or has
+    coordinates too large to represent."""
+    if not tolerance > 0:
+        raise ValueError("tolerance must be positive")
+    try:
+        root = ElementTree.fromstring(text)
+    except SyntaxError as e:
+        raise ValueError("bad SVG: {}".format(e))
+    strokes = []
+    walk(root, IDENTITY, tolerance, strokes)
+    strokes = [dedupe(s) for s in strokes]
+    # Transforms can still take finite numbers out of range.
+    if not all(is_finite(x) and is_finite(y) for s in strokes for x, y in s):
+        raise ValueError("coordinates out of range")
+    return [[(x, -y) for x, y in s] for s in strokes if len(s) > 1]
+
+
+def walk(element, m, tolerance, strokes):
+    """Adds the strokes of an element and its children to the list."""
+    tag = element.tag.split('}')[-1]
+    if tag in HIDDEN:
+        return
+    m = multiply(m, parse_transform(element.get('transform')))
+    d = shape_path(tag, element.attrib)
+    if d:
+        strokes.extend(path_strokes(d, m, tolerance))
+    for child in element:
+        walk(child, m, tolerance, strokes)
+
+
+def dedupe(stroke):
+    """Removes consecutive duplicate points, which would make Tracie stop for
+    nothing."""
+    result = []
+    for p in stroke:
+        if not result or p != result[-1]:
+            result.append(p)
+    return result
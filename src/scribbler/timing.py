@@ -0,0 +1,54 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Predicts how early to end each mode so that the robot stops on time."""
+
+
+# Weight of each new measurement in the moving averages.
+ALPHA = 0.2
+
+# Largest lead ever used (seconds), so that a stalled call can't make the modes
+# end far too early.
+MAX_LEAD = 0.1
+
+
+class Timing(object):
+
+    """Keeps moving averages of the delays between a mode's nominal end and
+    the moment the robot actually stops.
+
+    The program only notices that a mode is over on the first tick after its
+    deadline (the lateness). The stop command then takes a while to reach the
+    robot, but so did the command that started the motion, so only the
+    difference between the two latencies adds to the motion. The lead is the
+    sum, and ending each mode that much early makes it last as long as
+    intended.
+    """
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.lateness = 0.0
+        self.start_latency = 0.0
+        self.stop_latency = 0.0
+        self.counts = {}
+
+    def update(self, name, value):
+        """Adds a measurement (seconds) to the named moving average."""
+        n = self.counts.get(name, 0)
+        if n == 0:
+            setattr(self, name, value)
+        else:
+            avg = getattr(self, name)
+            setattr(self, name, avg + self.alpha * (value - avg))
+        self.counts[name] = n + 1
+
+    @property
+    def lead(self):
+        """Returns how early to end a mode (seconds)."""
+        lead = self.lateness + self.stop_latency - self.start_latency
+        return max(0.0, min(MAX_LEAD, lead))
+
+    def __str__(self):
+        return ("lateness {:.1f}ms, start {:.1f}ms, stop {:.1f}ms, "
+                "lead {:.1f}ms").format(
+                    1000 * self.lateness, 1000 * self.start_latency,
+                    1000 * self.stop_latency, 1000 * self.lead)
@@ -0,0 +1,155 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tunes program parameters by running the programs on a simulated robot."""
+
+import itertools
+import math
+import random
+from multiprocessing import Pool
+
+from scribbler.util import dist_2d, equiv_angle
+from scribbler.programs.avoider import Avoider
+from scribbler.programs.tracie import Tracie
+from scribbler.sim import SimClock, SimRobot, install
+
+
+# Map program IDs to the classes that can be tuned.
+PROGRAMS = {
+    'avoid': Avoider,
+    'tracie': Tracie
+}
+
+# Simulated time between main loop iterations (seconds). This should be the
+# same as LOOP_DELAY in the controller.
+TICK = 0.01
+
+# Simulated time after which a run is abandoned (seconds).
+TIME_LIMIT = 600.0
+
+# Seconds added to the score for each centimetre of path error.
+ERROR_WEIGHT = 2.0
+
+# Centimetres of path error for each radian of heading error.
+HEADING_WEIGHT = 10.0
+
+# Seconds added to the score for each collision with an obstacle.
+COLLISION_PENALTY = 30.0
+
+# The obstacle in front of the robot when tuning the avoider (cm).
+DEFAULT_OBSTACLE = (-10.0, 25.0, 10.0, 45.0)
+
+
+def parse_range(spec):
+    """Parses a parameter range of the form `code=lo:hi:steps`, `code=a,b,c`,
+    or `code=value` and returns the code and the list of values."""
+    code, values = spec.split('=')
+    if ':' in values:
+        lo, hi, steps = values.split(':')
+        lo, hi, steps = float(lo), float(hi), int(steps)
+        if steps < 2:
+            return code, [lo]
+        return code, [lo + (hi - lo) * i / (steps - 1) for i in range(steps)]
+    return code, [float(v) for v in values.split(',')]
+
+
+def grid(ranges):
+    """Returns all combinations of the values in a dictionary mapping parameter
+    codes to lists of values."""
+    codes = sorted(ranges)
+    combos = itertools.product(*[ranges[c] for c in codes])
+    return [dict(zip(codes, values)) for values in combos]
+
+
+def sample(ranges, n, seed=None):
+    """Returns `n` random combinations drawn uniformly from the intervals that
+    span the values in a dictionary like the one passed to `grid`."""
+    rng = random.Random(seed)
+    bounds = dict((c, (min(vs), max(vs))) for c, vs in ranges.items())
+    return [dict((c, rng.uniform(lo, hi)) for c, (lo, hi) in bounds.items())
+            for _ in range(n)]
+
+
+def commands(settings):
+    """Returns the commands that apply the given parameter settings."""
+    return ['set:{}={}'.format(c, v) for c, v in sorted(settings.items())]
+
+
+def simulate(program_id, settings, scenario, seed=None):
+    """Runs a program on a simulated robot until it finishes or the time limit
+    is reached. The scenario is a dictionary which can contain the points for
+    Tracie, the obstacles for the simulation, the noise level, and the robot's
+    true conversion factors. Returns a tuple of the form `(finished, elapsed,
+    error, collisions)`, where the error is in centimetres."""
+    clock = SimClock()
+    robot = SimRobot(
+        clock,
+        dist_to_time=scenario.get('dist_to_time'),
+        angle_to_time=scenario.get('angle_to_time'),
+        obstacles=scenario.get('obstacles', ()),
+        noise=scenario.get('noise', 0.0),
+        seed=seed)
+    install(robot)
+    program = PROGRAMS[program_id]()
+    program.clock = clock.time
+    for command in commands(settings):
+        program(command)
+    if program_id == 'tracie':
+        program.new_points = program.transform_points(scenario['points'])
+    program.start()
+    finished = False
+    while clock.time() < TIME_LIMIT:
+        finished = program.finished(program.loop())
+        if finished:
+            break
+        clock.advance(TICK)
+    robot.stop()
+    if program_id == 'tracie':
+        error = trace_error(program, robot)
+    else:
+        heading_error = abs(equiv_angle(robot.heading - math.pi / 2))
+        error = abs(robot.x) + HEADING_WEIGHT * heading_error
+    return finished, clock.time(), error, robot.collisions
+
+
+def trace_error(program, robot):
+    """Returns the mean distance (cm) from each point of Tracie's drawing to
+    the closest place where the simulated robot stopped or changed motion."""
+    scale = program.params['point_scale']
+    total = 0.0
+    for px, py in program.points:
+        x, y = scale * px, scale * py
+        total += min(dist_2d(x, y, rx, ry) for _, rx, ry, _ in robot.path)
+    return total / len(program.points)
+
+
+def evaluate(job):
+    """Runs one parameter setting for a number of trials and returns a
+    dictionary with the settings and the average score, time, and error. The
+    job is a tuple of the form `(program_id, settings, scenario, trials,
+    seed)`, so that it can be passed through a process pool."""
+    program_id, settings, scenario, trials, seed = job
+    score = elapsed = error = 0.0
+    for i in range(trials):
+        finished, t, e, collisions = simulate(
+            program_id, settings, scenario, seed + i)
+        s = t + ERROR_WEIGHT * e + COLLISION_PENALTY * collisions
+        if not finished:
+            s += TIME_LIMIT
+        score += s / trials
+        elapsed += t / trials
+        error += e / trials
+    return {'settings': settings, 'score': score, 'time': elapsed,
+            'error': error}
+
+
+def tune(program_id, candidates, scenario, trials=1, processes=None, seed=0):
+    """Evaluates each of the candidate settings in a pool of processes and
+    returns the results sorted from best to worst."""
+    jobs = [(program_id, c, scenario, trials, seed) for c in candidates]
+    pool = Pool(processes)
+    try:
+        results = pool.map(evaluate, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return sorted(results, key=lambda r: r['score'])
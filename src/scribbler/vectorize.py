@@ -0,0 +1,291 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Converts raster images into paths for Tracie to draw."""
+
+from io import BytesIO
+
+import numpy as np
+
+from scribbler.strokes import order
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# Width and height of the drawing canvas (px). This should match the canvas in
+# the index template, so that a converted image is the same size as a drawing.
+CANVAS_SIZE = 485
+
+# Maximum distance between a simplified path and the contour it replaces
+# (pixels of the image).
+TOLERANCE = 1.5
+
+# Contours with fewer edges than this are dropped as specks (pixels of the
+# image).
+MIN_LENGTH = 8
+
+# Largest image that is traced (pixels), and most contours that an image may
+# have once the specks are dropped. Anything bigger or busier, such as a
+# photograph or noise, would take far too long to convert and to draw.
+MAX_PIXELS = 4000000
+MAX_CONTOURS = 2000
+
+# Segments of the contour within each marching squares cell, by case. The case
+# has a bit for each corner inside the shape (top-left 8, top-right 4,
+# bottom-right 2, bottom-left 1), and each segment joins two edges of the cell
+# (T, R, B, L). The saddles (5 and 10) keep the inside corners connected.
+T, R, B, L = range(4)
+CELL_SEGMENTS = {
+    1: [(L, B)],
+    2: [(B, R)],
+    3: [(L, R)],
+    4: [(T, R)],
+    5: [(T, L), (B, R)],
+    6: [(T, B)],
+    7: [(T, L)],
+    8: [(T, L)],
+    9: [(T, B)],
+    10: [(T, R), (L, B)],
+    11: [(T, R)],
+    12: [(L, R)],
+    13: [(B, R)],
+    14: [(L, B)]
+}
+
+
+def read_pgm(data):
+    """Decodes a binary (P5) or plain (P2) PGM image and returns its pixels as
+    an array of bytes. Raises ValueError if the image is malformed."""
+    fields = []
+    i = 2
+    while len(fields) < 3:
+        while data[i:i+1].isspace():
+            i += 1
+        if data[i:i+1] == b'#':
+            i = data.index(b'\n', i) + 1
+            continue
+        j = i
+        while j < len(data) and data[j:j+1].isdigit():
+            j += 1
+        if j == i:
+            raise ValueError("bad PGM header")
+        fields.append(int(data[i:j]))
+        i = j
+    width, height, maxval = fields
+    if data[:2] == b'P5':
+        dtype = np.uint8 if maxval < 256 else np.dtype('>u2')
+        pixels = np.frombuffer(data[i+1:], dtype=dtype)
+    else:
+        pixels = np.array(data[i:].split(), dtype=int)
+    if pixels.size < width * height or maxval <= 0:
+        raise ValueError("bad PGM data")
+    check_size(width, height)
+    pixels = pixels[:width * height].reshape(height, width)
+    return (pixels * (255.0 / maxval)).astype(np.uint8)
+
+
+def check_size(width, height):
+    """Raises ValueError if an image is too big to trace."""
+    if width * height > MAX_PIXELS:
+        raise ValueError("image too big ({}x{}, at most {} pixels)".format(
+            width, height, MAX_PIXELS))
+
+
+def load_image(data):
+    """Decodes an image file into a greyscale array of bytes. PGM images are
+    always supported, and other formats need the Python Imaging Library.
+    Raises ValueError if the image can't be decoded."""
+    if data[:2] in (b'P2', b'P5'):
+        return read_pgm(data)
+    if Image is None:
+        raise ValueError("only PGM images are supported without PIL")
+    try:
+        image = Image.open(BytesIO(data))
+        check_size(*image.size)
+        image = image.convert('L')
+    except IOError as e:
+        raise ValueError("bad image: {}".format(e))
+    return np.asarray(image, dtype=np.uint8)
+
+
+def threshold(gray):
+    """Separates the drawing from the background using Otsu's method, which
+    picks the grey level that maximizes the variance between the two classes.
+    The smaller class is taken to be the drawing. Returns a boolean mask."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(float)
+    p = hist / hist.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    level = np.argmax(np.nan_to_num(between))
+    mask = gray <= level
+    if mask.mean() > 0.5:
+        mask = ~mask
+    return mask
+
+
+def cycle_leaders(succ):
+    """Splits a permutation, given as the successor of each element, into its
+    cycles. Returns the smallest element of each element's cycle, found by
+    pointer jumping: this takes a logarithmic number of passes over the
+    arrays rather than a step for each element."""
+    # After k passes, each element has the smallest of the 2**k elements from
+    # it on. Once a pass changes nothing, those windows cover every cycle.
+    leader = np.arange(len(succ), dtype=succ.dtype)
+    jump = succ
+    while True:
+        smaller = np.minimum(leader, leader[jump])
+        if np.array_equal(smaller, leader):
+            return leader
+        leader = smaller
+        jump = jump[jump]
+
+
+def cycle_steps(succ, leader):
+    """Returns the number of steps from the leader of each element's cycle (as
+    returned by `cycle_leaders`) to the element, also by pointer jumping."""
+    # Count the steps from each element forward to its leader, then turn that
+    # around using the lengths of the cycles.
+    is_leader = leader == np.arange(len(succ))
+    nxt = np.where(is_leader, leader, succ)
+    steps = (~is_leader).astype(succ.dtype)
+    while not np.array_equal(nxt, leader):
+        steps = steps + steps[nxt]
+        nxt = nxt[nxt]
+    length = np.bincount(leader)[leader]
+    return (length - steps) % length
+
+
+def contours(mask, min_length=0, max_count=None):
+    """Traces the boundaries of the shapes in the mask using marching squares.
+    Returns a list of closed paths with more than `min_length` points, each an
+    array of `(x, y)` points in image pixels whose last point is the same as
+    its first. Raises ValueError if there are more than `max_count` of them."""
+    m = np.pad(mask, 1, mode='constant').astype(np.uint8)
+    rows, cols = m.shape
+    case = 8 * m[:-1, :-1] + 4 * m[:-1, 1:] + 2 * m[1:, 1:] + m[1:, :-1]
+    # Number the edges between grid points: horizontal edges first, then
+    # vertical edges. Each segment is a pair of edge numbers.
+    n_horiz = rows * (cols - 1)
+    ends = [[], []]
+    for k, segments in CELL_SEGMENTS.items():
+        i, j = np.nonzero(case == k)
+        if not i.size:
+            continue
+        edges = [
+            i * (cols - 1) + j,
+            n_horiz + i * cols + j + 1,
+            (i + 1) * (cols - 1) + j,
+            n_horiz + i * cols + j
+        ]
+        for a, b in segments:
+            ends[0].append(edges[a])
+            ends[1].append(edges[b])
+    if not ends[0]:
+        return []
+    ends = np.concatenate([np.concatenate(e) for e in ends])
+    n = len(ends) // 2
+    # Every edge is the end of exactly two segments, because the padding
+    # closes all the contours. Pair up the slots holding the same edge.
+    order = np.argsort(ends, kind='mergesort')
+    partner = np.empty_like(order)
+    partner[order[0::2]] = order[1::2]
+    partner[order[1::2]] = order[0::2]
+    # Following a contour goes from a slot to the other end of its segment,
+    # and on to the slot of the next segment at that edge. That permutes the
+    # slots, and each contour is two of its cycles, one in each direction.
+    # The one holding the smaller slot is kept.
+    slots = np.arange(2 * n, dtype=np.int32)
+    other = (slots + n) % (2 * n)
+    succ = partner.astype(np.int32)[other]
+    leader = cycle_leaders(succ)
+    length = np.bincount(leader, minlength=2 * n)
+    keep = (leader < leader[other]) & (length[leader] + 1 > min_length)
+    leaders = np.flatnonzero(keep & (leader == slots))
+    if max_count is not None and len(leaders) > max_count:
+        raise ValueError("too many shapes in image ({}, at most {})".format(
+            len(leaders), max_count))
+    # Put the slots that are kept in order along their contours, renumbering
+    # them so that the steps are only counted for those.
+    slots = np.flatnonzero(keep)
+    index = np.zeros(2 * n, dtype=np.int32)
+    index[slots] = np.arange(len(slots))
+    lead = index[leader[slots]]
+    step = cycle_steps(index[succ[slots]], lead)
+    slots = slots[np.lexsort((step, lead))]
+    points = edge_points(ends[slots], rows, cols, n_horiz)
+    bounds = np.cumsum(length[leaders])[:-1]
+    return [np.vstack((p, p[:1])) for p in np.split(points, bounds)]
+
+
+def edge_points(edges, rows, cols, n_horiz):
+    """Returns the midpoints of the numbered edges, in the coordinates of the
+    image before padding."""
+    horiz = edges < n_horiz
+    v = edges - n_horiz
+    x = np.where(horiz, edges % (cols - 1) + 0.5, v % cols)
+    y = np.where(horiz, edges // (cols - 1), v // cols + 0.5)
+    return np.column_stack((x - 1, y - 1))
+
+
+def simplify(paths, tolerance):
+    """Simplifies paths with the Ramer-Douglas-Peucker algorithm, keeping the
+    points needed to stay within `tolerance` of the originals. All the paths
+    are split at once, one level of the recursion at a time, so the work is
+    done in a few passes over all the points instead of a loop per split."""
+    if not paths:
+        return []
+    sizes = np.array([len(p) for p in paths])
+    points = np.concatenate(paths).astype(float)
+    keep = np.zeros(len(points), dtype=bool)
+    last = np.cumsum(sizes) - 1
+    first = last - sizes + 1
+    keep[first] = keep[last] = True
+    i, j = first, last
+    while True:
+        inner = j > i + 1
+        i, j = i[inner], j[inner]
+        if not len(i):
+            break
+        # The points strictly between the ends of each span, span by span.
+        counts = j - i - 1
+        span = np.repeat(np.arange(len(i)), counts)
+        offset = np.cumsum(counts) - counts
+        idx = np.arange(counts.sum()) - offset[span] + i[span] + 1
+        d = points[j] - points[i]
+        rel = points[idx] - points[i][span]
+        norm = np.hypot(d[:, 0], d[:, 1])[span]
+        cross = np.abs(d[span, 0] * rel[:, 1] - d[span, 1] * rel[:, 0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.where(norm == 0, np.hypot(rel[:, 0], rel[:, 1]),
+                            cross / norm)
+        # The farthest point of each span (the first, if there is a tie).
+        far = np.maximum.reduceat(dist, offset)
+        hits = np.flatnonzero(dist == far[span])
+        hits = hits[np.r_[True, np.diff(span[hits]) != 0]]
+        split = far > tolerance
+        mid = idx[hits][split]
+        keep[mid] = True
+        i = np.concatenate((i[split], mid))
+        j = np.concatenate((mid, j[split]))
+    return np.split(points[keep], np.cumsum(
+        np.add.reduceat(keep.astype(int), first))[:-1])
+
+
+def trace_image(data, size=CANVAS_SIZE, tolerance=TOLERANCE,
+                min_length=MIN_LENGTH):
+    """Converts an image file into strokes for Tracie. Returns the strokes in
+    drawing order, as arrays of points in canvas pixels with the y-axis
+    pointing upwards and the longest side of the image scaled to `size`."""
+    gray = load_image(data)
+    paths = contours(threshold(gray), min_length, MAX_CONTOURS)
+    if not paths:
+        return []
+    strokes = order(simplify(paths, tolerance))
+    height, width = gray.shape
+    scale = float(size) / max(width, height)
+    return [np.column_stack((s[:, 0], height - s[:, 1])) * scale
+            for s in strokes]
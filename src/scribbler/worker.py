@@ -0,0 +1,255 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Runs each robot's controller and program in a separate process."""
+
+import ctypes
+import json
+import multiprocessing
+from itertools import count
+from multiprocessing.sharedctypes import RawValue
+from time import time
+
+import gevent
+from gevent import sleep, spawn
+from gevent.event import AsyncResult
+from gevent.socket import wait_read
+
+from scribbler.controller import Controller
+from scribbler.link import supervise
+from scribbler.sensors import SAMPLE_RATE
+
+
+# Amount of time between publishing the robot's state (seconds).
+PUBLISH_INTERVAL = 0.02
+
+# Amount of time to wait before restarting a worker that died (seconds).
+RESTART_DELAY = 1.0
+
+# Amount of time to wait for a worker to finish when stopping it (seconds).
+STOP_TIMEOUT = 2.0
+
+# Maximum length of the names stored in the status plane.
+NAME_LEN = 16
+
+# Maximum number of trace values stored in the status plane.
+MAX_TRACE = 8
+
+# Index of the elapsed time in a list of trace values for a moving robot.
+TRACE_ELAPSED = 0
+
+# Number of trace values for a moving robot (see `Tracie.trace`).
+TRACE_MOVING = 6
+
+
+class Plane(ctypes.Structure):
+
+    """The layout of a robot's state in shared memory."""
+
+    _fields_ = [
+        ('version', ctypes.c_uint),
+        ('program', ctypes.c_char * NAME_LEN),
+        ('mode', ctypes.c_char * NAME_LEN),
+        ('running', ctypes.c_bool),
+        ('can_reset', ctypes.c_bool),
+        ('status_seq', ctypes.c_long),
+        ('heading', ctypes.c_double),
+        ('trace_len', ctypes.c_int),
+        ('trace', ctypes.c_double * MAX_TRACE),
+        ('stamp', ctypes.c_double)
+    ]
+
+
+def encode_name(name):
+    """Returns a name as bytes for the status plane, cut to NAME_LEN."""
+    return name.encode('utf-8')[:NAME_LEN]
+
+
+def decode_name(raw):
+    """Returns a name read from the status plane as text."""
+    return raw.decode('utf-8', 'replace')
+
+
+class StatusPlane(object):
+
+    """A robot's state in shared memory, written by its worker process and read
+    by the server without a round trip.
+
+    There is only one writer, so the plane is guarded by a sequence lock: the
+    version is odd while the state is being written, and readers retry if the
+    version was odd or changed while they were copying the state.
+    """
+
+    def __init__(self):
+        self.shared = RawValue(Plane)
+
+    def publish(self, controller):
+        """Writes the state of the controller into shared memory."""
+        state = controller.state()
+        trace = controller.program.trace() or []
+        p = self.shared
+        p.version += 1
+        p.program = encode_name(state['program'])
+        p.mode = encode_name(state['mode'])
+        p.running = state['running']
+        p.can_reset = state['can_reset']
+        p.status_seq = state['status_seq']
+        p.heading = state['heading']
+        p.trace_len = len(trace)
+        for i, x in enumerate(trace):
+            p.trace[i] = x
+        p.stamp = time()
+        p.version += 1
+
+    def snapshot(self):
+        """Returns a consistent copy of the state."""
+        while True:
+            v = self.shared.version
+            copy = Plane.from_buffer_copy(self.shared)
+            if v % 2 == 0 and self.shared.version == v:
+                return copy
+
+
+def work(conn, plane, port, dummy, sample_rate, journal):
+    """The main function of a worker process. Connects to the robot and runs a
+    controller, performing the commands that come through the connection and
+    publishing the robot's state to the status plane. A message of None, or
+    the end of the connection, closes the controller and ends the process."""
+    gevent.reinit()
+    if dummy:
+        import scribbler.programs.nomyro as myro
+    else:
+        import myro
+    supervise(myro, port)
+    controller = Controller(sample_rate=sample_rate, robot=port,
+                            journal=journal)
+    spawn(publish_forever, plane, controller)
+    while True:
+        wait_read(conn.fileno())
+        try:
+            message = conn.recv()
+        except EOFError:
+            message = None
+        if message is None:
+            controller.close()
+            return
+        req_id, command = message
+        spawn(reply, conn, controller, req_id, command)
+
+
+def publish_forever(plane, controller):
+    """Publishes the state of the controller at regular intervals."""
+    while True:
+        plane.publish(controller)
+        sleep(PUBLISH_INTERVAL)
+
+
+def reply(conn, controller, req_id, command):
+    """Performs a command and sends back the reply with the request ID."""
+    try:
+        msg = controller(command)
+    except Exception as e:
+        msg = "error: {}".format(e)
+    conn.send((req_id, msg))
+
+
+class RemoteController(object):
+
+    """Controls a robot whose controller runs in a worker process.
+
+    Commands are forwarded to the worker over a pipe, tagged with request IDs
+    so that any number of them can be waiting at once. Queries about the state
+    of the robot are answered from the status plane instead. If the worker
+    dies, the commands waiting on it fail and it is restarted, without any
+    effect on the other robots.
+    """
+
+    def __init__(self, port, dummy=False, sample_rate=SAMPLE_RATE,
+                 journal=False):
+        """Starts a worker for the robot on the given Bluetooth port. The
+        worker's controller journals the robot's state if `journal` is true, so
+        a restarted worker picks up where the last one left off."""
+        self.args = (port, dummy, sample_rate, journal)
+        self.plane = StatusPlane()
+        self.ids = count()
+        self.pending = {}
+        self.launch()
+
+    def launch(self):
+        """Starts the worker process and the Greenlet that reads its replies."""
+        self.conn, child = multiprocessing.Pipe()
+        args = (child, self.plane) + self.args
+        self.process = multiprocessing.Process(target=work, args=args)
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.reader = spawn(self.read_replies)
+
+    def read_replies(self):
+        """Passes replies from the worker to the commands waiting for them, and
+        restarts the worker if it dies."""
+        while True:
+            try:
+                wait_read(self.conn.fileno())
+                req_id, msg = self.conn.recv()
+            except (EOFError, IOError):
+                break
+            result = self.pending.pop(req_id, None)
+            if result:
+                result.set(msg)
+        for result in self.pending.values():
+            result.set("robot crashed")
+        self.pending.clear()
+        self.conn.close()
+        sleep(RESTART_DELAY)
+        self.launch()
+
+    def close(self):
+        """Stops the worker process. The worker is told to close its
+        controller first, so that its journal and profile are written, and it
+        is terminated if it hasn't finished within STOP_TIMEOUT."""
+        self.reader.kill()
+        try:
+            self.conn.send(None)
+        except IOError:
+            pass
+        self.conn.close()
+        self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def trace(self, p):
+        """Returns the trace values in the status plane, brought up to date."""
+        vals = list(p.trace[:p.trace_len])
+        if p.trace_len == TRACE_MOVING:
+            vals[TRACE_ELAPSED] += time() - p.stamp
+        return vals
+
+    def __call__(self, command):
+        """Accepts a command and returns a status message, like a Controller."""
+        if command == 'short:sync':
+            p = self.plane.snapshot()
+            return "{} {} {}".format(decode_name(p.program), p.running,
+                                     p.can_reset)
+        if command == 'short:state':
+            p = self.plane.snapshot()
+            return json.dumps({
+                'program': decode_name(p.program),
+                'mode': decode_name(p.mode),
+                'running': p.running,
+                'can_reset': p.can_reset,
+                'status_seq': p.status_seq,
+                'heading': p.heading
+            })
+        if command == 'short:trace':
+            p = self.plane.snapshot()
+            if p.trace_len:
+                return ' '.join(map(str, self.trace(p)))
+        req_id = next(self.ids)
+        result = AsyncResult()
+        self.pending[req_id] = result
+        try:
+            self.conn.send((req_id, command))
+        except IOError:
+            del self.pending[req_id]
+            return "robot unavailable"
+        return result.get()
@@ -0,0 +1,46 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""The asyncio backend for the tests. It is kept apart from conftest.py since
+it only compiles on Python 3."""
+
+import asyncio
+
+from scribbler import aio
+
+import scribbler.programs.nomyro as nomyro
+from conftest import PORT
+
+
+class AsyncioBackend(object):
+
+    """Runs an AsyncController on its own asyncio event loop."""
+
+    name = 'asyncio'
+
+    def __init__(self, **kwargs):
+        self.loop = aio.new_event_loop()
+        aio.install(nomyro, PORT)
+        self.controller = aio.AsyncController(loop=self.loop, **kwargs)
+
+    def send(self, command):
+        """Sends a command and returns the reply."""
+        return self.loop.run_until_complete(self.controller(command))
+
+    def send_all(self, commands, delay=0):
+        """Sends the commands concurrently, each `delay` seconds after the one
+        before it, and returns the replies in order."""
+        async def later(i, command):
+            await asyncio.sleep(i * delay)
+            return await self.controller(command)
+        tasks = [later(i, c) for i, c in enumerate(commands)]
+        return self.loop.run_until_complete(asyncio.gather(*tasks))
+
+    def wait(self, seconds):
+        """Lets the controller run for the given number of seconds."""
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def close(self):
+        self.controller.close()
+        self.controller.actor.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
@@ -0,0 +1,99 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Fixtures that run the same tests against the gevent and asyncio backends.
+
+Each backend wraps a controller driving the dummy Myro library, and knows how
+to send it commands (one at a time or concurrently) and how to wait without
+blocking it. Run the tests with `python -m pytest` from the `src` directory.
+"""
+
+import os
+import sys
+
+import pytest
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scribbler.programs.nomyro as nomyro
+
+# Port given to the dummy Myro library.
+PORT = 'dummy'
+
+# Names of the backends that every test in test_backends.py runs on.
+BACKENDS = ['gevent', 'asyncio']
+
+# Test modules that only compile on Python 3.
+if sys.version_info[0] < 3:
+    collect_ignore = ['test_aio.py']
+
+
+class GeventBackend(object):
+
+    """Runs a Controller on gevent, with the link supervisor in front of the
+    dummy Myro library, as main.py does."""
+
+    name = 'gevent'
+
+    def __init__(self, **kwargs):
+        from scribbler.controller import Controller
+        from scribbler.link import supervise
+        import gevent
+        self.gevent = gevent
+        supervise(nomyro, PORT)
+        self.controller = Controller(**kwargs)
+
+    def send(self, command):
+        """Sends a command and returns the reply."""
+        return self.controller(command)
+
+    def send_all(self, commands, delay=0):
+        """Sends the commands concurrently, each `delay` seconds after the one
+        before it, and returns the replies in order."""
+        greenlets = []
+        for i, command in enumerate(commands):
+            greenlets.append(self.gevent.spawn_later(
+                i * delay, self.controller, command))
+        self.gevent.joinall(greenlets, raise_error=True)
+        return [g.value for g in greenlets]
+
+    def wait(self, seconds):
+        """Lets the controller run for the given number of seconds."""
+        self.gevent.sleep(seconds)
+
+    def close(self):
+        self.controller.close()
+
+
+def new_backend(name, **kwargs):
+    """Returns a backend of the given name, wrapping a new controller created
+    with the keyword arguments. Skips the test if the backend can't run here:
+    gevent needs to be installed and asyncio needs Python 3."""
+    if name == 'asyncio':
+        if sys.version_info[0] < 3:
+            pytest.skip("the asyncio backend needs Python 3")
+        from asyncio_backend import AsyncioBackend
+        return AsyncioBackend(**kwargs)
+    pytest.importorskip('gevent')
+    return GeventBackend(**kwargs)
+
+
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    """Runs the test in a temporary directory, so that profiles, journals, and
+    maps don't end up in the source tree, and restores Myro afterwards."""
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(builtins, 'myro', None, raising=False)
+    return tmpdir
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, workdir):
+    """A backend with a controller running the default program."""
+    backend = new_backend(request.param)
+    yield backend
+    backend.close()
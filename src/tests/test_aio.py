@@ -0,0 +1,58 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the asyncio web server, which only runs on Python 3."""
+
+import asyncio
+
+from scribbler import aio, strokes
+
+from asyncio_backend import AsyncioBackend
+
+
+def request(port, bodies):
+    """Returns a coroutine that POSTs each body to the server in turn on one
+    connection, and returns the status lines of the responses."""
+    async def post():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        statuses = []
+        for body in bodies:
+            data = body.encode('utf-8')
+            writer.write("POST / HTTP/1.1\r\nContent-Length: {}\r\n\r\n"
+                         .format(len(data)).encode('latin-1') + data)
+            statuses.append((await reader.readline()).decode().strip())
+            length = 0
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+        writer.close()
+        # Let the server see that the connection closed.
+        await asyncio.sleep(0.05)
+        return statuses
+    return post()
+
+
+def test_handler_error_replies_500(workdir, monkeypatch):
+    def broken_order(lines, start):
+        raise RuntimeError("broken")
+    monkeypatch.setattr(strokes, 'order', broken_order)
+    backend = AsyncioBackend()
+    server = aio.AsyncServer('127.0.0.1', 0, str(workdir), [],
+                             controllers=[backend.controller],
+                             loop=backend.loop)
+    server.start(open_browser=False, verbose=False)
+    try:
+        port = server.server.sockets[0].getsockname()[1]
+        drawing = 'strokes:[[0, 0, 10, 0], [0, 10, 10, 10]]'
+        statuses = backend.loop.run_until_complete(
+            request(port, [drawing, 'short:sync']))
+    finally:
+        server.server.close()
+        server.running = False
+        backend.close()
+    assert statuses == ["HTTP/1.1 500 INTERNAL SERVER ERROR",
+                        "HTTP/1.1 200 OK"]
@@ -0,0 +1,230 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Behavioural tests that both backends must pass in the same way."""
+
+import json
+import time
+
+import pytest
+
+from conftest import BACKENDS, PORT, new_backend
+from scribbler import controller, journal, profiles, strokes
+
+# A small square for Tracie to draw, in the drawing view's format.
+SQUARE = json.dumps([0, 0, 10, 0, 10, -10, 0, -10])
+
+
+def test_text_command(backend):
+    assert backend.send('short:sync') == "tracie False False"
+
+
+def test_json_command(backend):
+    reply = json.loads(backend.send('{"cmd": "short:sync"}'))
+    assert reply == {
+        'cmd': 'short:sync',
+        'reply': {'program': 'tracie', 'running': False, 'can_reset': False}
+    }
+
+
+def test_unknown_json_command(backend):
+    reply = json.loads(backend.send('{"cmd": "nonsense"}'))
+    assert reply == {'cmd': 'nonsense', 'error': 'unknown command'}
+
+
+def test_start_without_points(backend):
+    assert backend.send('control:start') == "not enough points"
+
+
+def test_start_poll_stop(backend):
+    backend.send('points:' + SQUARE)
+    assert backend.send('control:start') == "program resumed"
+    backend.wait(0.3)
+    assert backend.send('short:sync') == "tracie True True"
+    status = json.loads(backend.send('long:status:0'))
+    assert status['messages']
+    assert status['cursor'] == len(status['messages'])
+    assert backend.send('control:stop') == "program paused"
+    assert backend.send('short:sync') == "tracie False True"
+
+
+def test_switch_program(backend):
+    assert backend.send('program:avoid') == "switched to avoid"
+    assert backend.send('short:sync') == "avoid False False"
+    assert backend.send('program:nonsense') == "no such program: nonsense"
+
+
+def test_concurrent_commands_take_turns(backend):
+    replies = backend.send_all(['program:avoid', 'program:tracie',
+                                'short:sync'])
+    assert replies[:2] == ["switched to avoid", "switched to tracie"]
+
+
+def test_stop_behind_slow_command(backend, monkeypatch):
+    # Ordering the strokes holds up the actor, so the stop must be answered
+    # without it.
+    def slow_order(lines, start):
+        time.sleep(0.5)
+        return lines
+    monkeypatch.setattr(strokes, 'order', slow_order)
+    monkeypatch.setattr(controller, 'PRIORITY_TIMEOUT', 0.1)
+    if backend.name == 'asyncio':
+        from scribbler import aio
+        monkeypatch.setattr(aio, 'PRIORITY_TIMEOUT', 0.1)
+    backend.send('points:' + SQUARE)
+    backend.send('control:start')
+    drawing, stop = backend.send_all(['strokes:[{0}, {0}]'.format(SQUARE),
+                                      'control:stop'], delay=0.2)
+    assert drawing.startswith("received 8 points in 2 strokes")
+    assert stop == "robot stopped; control:stop will finish after the " \
+        "current command"
+    backend.wait(0.1)
+    assert backend.send('short:sync') == "tracie False True"
+    assert backend.controller.held is not None
+    assert backend.send('control:start') == "program resumed"
+    assert backend.controller.held is None
+
+
+def test_start_queued_before_emergency_stop(backend, monkeypatch):
+    def slow_order(lines, start):
+        time.sleep(0.5)
+        return lines
+    monkeypatch.setattr(strokes, 'order', slow_order)
+    monkeypatch.setattr(controller, 'PRIORITY_TIMEOUT', 0.1)
+    if backend.name == 'asyncio':
+        from scribbler import aio
+        monkeypatch.setattr(aio, 'PRIORITY_TIMEOUT', 0.1)
+    backend.send('points:' + SQUARE)
+    _, start, _ = backend.send_all([
+        'strokes:[{0}, {0}]'.format(SQUARE), 'control:start', 'control:stop'
+    ], delay=0.1)
+    assert start == "not started, since it was sent before the emergency stop"
+    assert backend.send('short:sync') == "tracie False False"
+
+
+def test_set_is_all_or_nothing(backend):
+    before = backend.send('set:s=?')
+    reply = json.loads(backend.send(
+        '{"cmd": "set", "arg": {"s": 0.3, "zz": 1}}'))
+    assert reply == {'cmd': 'set', 'error': 'invalid code: zz'}
+    reply = json.loads(backend.send(
+        '{"cmd": "set", "arg": {"s": 0.3, "bl": "x"}}'))
+    assert reply == {'cmd': 'set', 'error': 'NaN: x'}
+    assert backend.send('set:s=?') == before
+    assert backend.send('set:s=0.3') == "speed = 0.3"
+    assert backend.send('set:zz=1') == "invalid code: zz"
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_journal_restores_state(name, workdir):
+    first = new_backend(name, robot=PORT, journal=True)
+    try:
+        first.send('program:avoid')
+        first.send('set:s=0.3')
+        first.send('program:tracie')
+        first.send('set:s=0.4')
+        first.send('points:' + SQUARE)
+    finally:
+        first.close()
+    second = new_backend(name, robot=PORT, journal=True)
+    try:
+        assert second.send('short:sync') == "tracie False False"
+        assert second.send('set:s=?') == "speed = 0.4"
+        assert second.send('control:start') == "program resumed"
+    finally:
+        second.close()
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_failures_are_not_journaled(name, workdir):
+    backend = new_backend(name, robot=PORT, journal=True)
+    try:
+        backend.send('set:zz=1')
+        backend.send('points:5')
+        backend.send('program:nonsense')
+        backend.send('control:stop')
+        backend.send('set:s=0.3')
+    finally:
+        backend.close()
+    log_path, _ = journal.journal_paths(PORT)
+    with open(log_path) as f:
+        commands = [json.loads(line)['cmd'] for line in f]
+    assert commands == ['set:s=0.3']
+
+
+def test_preview(backend):
+    backend.send('points:' + SQUARE)
+    reply = json.loads(backend.send('preview:{"noise": 0.05, "seed": 1}'))
+    assert reply['format'] == 'svg'
+    assert reply['stats']
+    assert backend.send('preview:{"noise": -1}') == \
+        "bad preview: noise must be at least 0"
+    assert backend.send('preview:{"colour": "red"}').startswith("bad preview")
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_stop_records_run(name, workdir):
+    backend = new_backend(name, robot=PORT)
+    try:
+        backend.send('points:' + SQUARE)
+        backend.wait(0.1)
+        backend.send('control:start')
+        backend.wait(0.2)
+        backend.send('control:stop')
+        backend.wait(0.1)
+    finally:
+        backend.close()
+    with open(profiles.profile_path(PORT)) as f:
+        runs = json.load(f)['runs']
+    assert len(runs) == 1
+    assert runs[0]['program'] == 'tracie'
+    assert workdir.join('profiles').listdir() == \
+        [workdir.join(profiles.profile_path(PORT))]
+
+
+@pytest.mark.parametrize('cmd, arg, error', [
+    ('set', [1], "bad set: argument must be an object"),
+    ('set', "s=0.5", "bad set: argument must be an object"),
+    ('points', 5, "bad points: argument must be a list"),
+    ('points', [[1, 2]], "bad points: odd number of coordinates"),
+    ('points', [{'x': 1}], "bad points: 'y'"),
+    ('strokes', 5, "bad strokes: argument must be a list or an object"),
+    ('program', ["x"], "bad program: argument must be a string"),
+    ('program', "x", "no such program: x"),
+    ('profile', -1, "bad profile: duration must be at least 0"),
+    ('long:status', "x", "bad cursor: x"),
+    ('preview', 5, "bad preview: argument must be an object or null"),
+    ('job:add', [], "bad job:add: argument must be an object"),
+    ('job:add', {'svg': 5}, "bad job: bad svg: argument must be a string"),
+    ('job:skip', None, "no job being drawn"),
+    ('control:stop', None, "not running"),
+])
+def test_refusals_are_errors(backend, cmd, arg, error):
+    reply = json.loads(backend.send(json.dumps({'cmd': cmd, 'arg': arg})))
+    assert reply == {'cmd': cmd, 'error': error}
+
+
+def test_text_refusals(backend):
+    assert backend.send('points:5') == "bad points: argument must be a list"
+    assert backend.send('profile:-1') == \
+        "bad profile: duration must be at least 0"
+    assert backend.send('program:x') == "no such program: x"
+
+
+@pytest.mark.parametrize('params, error', [
+    ({'s': 0}, "bad job: s must be positive"),
+    ({'ps': -1}, "bad job: ps must be positive"),
+    ({'mr': "nan"}, "bad job: mr must be finite"),
+    ({'zz': 1}, "bad job: invalid code: zz"),
+])
+def test_job_params_are_checked(backend, params, error):
+    job = {'points': json.loads(SQUARE), 'params': params}
+    assert backend.send('job:add:' + json.dumps(job)) == error
+    assert json.loads(backend.send('job:list')) == []
+
+
+def test_svg_needs_a_positive_scale(backend):
+    line = '<svg><line x1="0" y1="0" x2="100" y2="0"/></svg>'
+    assert backend.send('svg:' + line).startswith("received 2 points")
+    backend.send('set:ps=0')
+    assert backend.send('svg:' + line) == \
+        "bad svg: point_scale must be positive"
@@ -0,0 +1,65 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the model that corrects the conversion factors for the battery
+voltage."""
+
+import pytest
+
+from scribbler import battery
+
+
+def records(stall, voltages, name='dist_to_time'):
+    """Returns calibration records for a robot whose speed is proportional to
+    how far the voltage is above `stall`."""
+    return [{'voltage': v, name: 1.0 / (v - stall)} for v in voltages]
+
+
+def test_fit_stall_recovers_the_stall_voltage():
+    recs = records(3.0, [5.0, 6.0, 7.0])
+    assert battery.fit_stall(recs, 'dist_to_time') == pytest.approx(3.0)
+
+
+def test_fit_stall_ignores_other_factors_and_missing_voltages():
+    recs = records(3.0, [5.0, 7.0]) + [
+        {'voltage': None, 'dist_to_time': 1.0},
+        {'voltage': 6.0, 'angle_to_time': 1.0}
+    ]
+    assert battery.fit_stall(recs, 'dist_to_time') == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize('recs', [
+    [],
+    records(3.0, [6.0, 6.1]),
+    [{'voltage': 5.0, 'dist_to_time': 1.0},
+     {'voltage': 7.0, 'dist_to_time': 2.0}],
+])
+def test_fit_stall_falls_back_to_zero(recs):
+    assert battery.fit_stall(recs, 'dist_to_time') == 0.0
+
+
+def test_fit_stall_stays_below_the_voltages():
+    recs = records(6.9, [7.0, 7.5])
+    stall = battery.fit_stall(recs, 'dist_to_time')
+    assert stall == pytest.approx(7.0 - battery.MIN_SPREAD)
+
+
+def test_model_scales_the_factors():
+    model = battery.VoltageModel(7.0, records(3.0, [5.0, 7.0]))
+    assert model.scale('dist_to_time', 7.0) == pytest.approx(1.0)
+    assert model.scale('dist_to_time', 6.0) == pytest.approx(4 / 3.0)
+    # Without calibrations of its own, a factor is taken to be proportional.
+    assert model.scale('angle_to_time', 7.7) == pytest.approx(7 / 7.7)
+
+
+def test_model_corrections_are_limited():
+    model = battery.VoltageModel(7.0, records(3.0, [5.0, 7.0]))
+    assert model.scale('dist_to_time', 5.0) == battery.MAX_CORRECTION
+    assert model.scale('dist_to_time', 2.0) == battery.MAX_CORRECTION
+    assert model.scale('angle_to_time', 20.0) == \
+        pytest.approx(1 / battery.MAX_CORRECTION)
+
+
+def test_model_without_a_reference_corrects_nothing():
+    model = battery.VoltageModel(None, records(3.0, [5.0, 7.0]))
+    assert model.scale('dist_to_time', 5.0) == 1.0
+    assert battery.VoltageModel(7.0).scale('dist_to_time', None) == 1.0
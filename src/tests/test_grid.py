@@ -0,0 +1,86 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the occupancy grid that Avoider uses to remember obstacles."""
+
+import json
+import math
+
+import pytest
+
+from scribbler import grid
+
+
+def test_detections_mark_the_cell_ahead():
+    g = grid.OccupancyGrid()
+    assert g.probe(0, 0, 0) == grid.UNKNOWN
+    for _ in range(3):
+        g.observe(0, 0, 0, True)
+    assert g.probe(0, 0, 0) == grid.OCCUPIED
+    assert g.probe(0, 0, math.pi) == grid.UNKNOWN
+
+
+def test_clear_readings_mark_the_space_free():
+    g = grid.OccupancyGrid()
+    for _ in range(3):
+        g.observe(0, 0, 0, False)
+    assert g.probe(0, 0, 0) == grid.FREE
+
+
+def test_log_odds_are_limited():
+    g = grid.OccupancyGrid()
+    for _ in range(100):
+        g.observe(0, 0, 0, True)
+    assert max(g.cells) == grid.LIMIT
+    for _ in range(20):
+        g.observe(0, 0, 0, False)
+    assert g.probe(0, 0, 0) != grid.OCCUPIED
+
+
+def test_readings_outside_are_ignored():
+    g = grid.OccupancyGrid(size=4)
+    g.observe(1000, 1000, 0, True)
+    g.remember_side(1000, 1000, 1)
+    assert not any(g.cells)
+    assert g.sides == {}
+    assert g.probe(1000, 1000, 0) == grid.UNKNOWN
+
+
+def test_sides_are_found_nearby():
+    g = grid.OccupancyGrid()
+    g.remember_side(10, 10, -1)
+    assert g.side(10 + g.cell, 10 - g.cell) == -1
+    assert g.side(10 + 3 * g.cell, 10) is None
+
+
+def test_save_and_load(tmpdir):
+    path = str(tmpdir.join('map.json'))
+    g = grid.OccupancyGrid(size=16, cell=2.0)
+    g.observe(0, 0, 0, True)
+    g.remember_side(0, 0, 1)
+    g.save(path)
+    h = grid.OccupancyGrid()
+    h.load(path)
+    assert (h.size, h.cell) == (16, 2.0)
+    assert h.cells == g.cells
+    assert h.sides == g.sides
+
+
+@pytest.mark.parametrize('data, error', [
+    ({'size': 2, 'cells': [0] * 4, 'sides': []}, "bad map: 'cell'"),
+    ({'size': 2, 'cell': 'x', 'cells': [0] * 4, 'sides': []}, "bad map"),
+    ({'size': 2, 'cell': 0, 'cells': [0] * 4, 'sides': []},
+     "bad map: cell size must be positive"),
+    ({'size': 2, 'cell': 1, 'cells': [0] * 3, 'sides': []},
+     "bad map: wrong number of cells"),
+    ([1, 2], "bad map"),
+])
+def test_bad_maps_are_refused(tmpdir, data, error):
+    path = str(tmpdir.join('map.json'))
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    g = grid.OccupancyGrid()
+    before = g.cells
+    with pytest.raises(ValueError) as info:
+        g.load(path)
+    assert str(info.value).startswith(error)
+    assert g.cells is before
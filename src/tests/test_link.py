@@ -0,0 +1,52 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the link supervisor, which needs gevent."""
+
+import time
+
+import pytest
+
+gevent = pytest.importorskip('gevent')
+
+from scribbler.link import LinkDown, LinkSupervisor
+
+
+class SlowBackend(object):
+
+    """Stands in for Myro, with a beep that blocks for a while."""
+
+    def __init__(self):
+        self.stops = 0
+
+    def initialize(self, port):
+        pass
+
+    def beep(self, length, freq):
+        time.sleep(length)
+
+    def stop(self):
+        self.stops += 1
+
+
+def test_stop_now_skips_a_stuck_call():
+    backend = SlowBackend()
+    link = LinkSupervisor(backend, 'dummy', timeout=5)
+    assert link.connect()
+    beep = gevent.spawn(link.beep, 1.0, 440)
+    gevent.sleep(0.1)
+    started = time.time()
+    link.stop_now()
+    assert time.time() - started < 0.5
+    assert backend.stops == 1
+    assert not beep.ready()
+    beep.join()
+
+
+def test_stop_now_times_out():
+    backend = SlowBackend()
+    backend.stop = lambda: time.sleep(1.0)
+    link = LinkSupervisor(backend, 'dummy', timeout=0.1)
+    with pytest.raises(LinkDown):
+        link.stop_now()
+    backend.stop = lambda: None
+    link.stop_now()
@@ -0,0 +1,101 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the table-driven state machine engine, on a simulated robot."""
+
+import pytest
+
+from scribbler import sim
+from scribbler.programs.machine import (
+    START_NAME, Branch, Exit, MachineProgram, Mode)
+
+# Time between iterations of the main loop (seconds).
+TICK = 0.05
+
+
+class Shuttle(MachineProgram):
+
+    """Drives out, turns around, and goes out again until told to stop."""
+
+    def __init__(self, clock):
+        self.again = True
+        self.turns = 0
+        MachineProgram.__init__(self, [
+            Mode('out', 'fwd', "going out", [
+                Exit('elapsed', 'leg', 'turn')
+            ]),
+            Mode('turn', 'ccw', "turning", [
+                Exit('elapsed', 0.5, to=Branch(
+                    'flag', 'again', 'out', START_NAME), action='count')
+            ]),
+        ], 'out')
+        self.add_params({'leg': 1.0}, {'lg': 'leg'})
+        self.params['latency_comp'] = 0
+        self.clock = clock.time
+        self.reset()
+
+    def count(self):
+        self.turns += 1
+
+
+@pytest.fixture
+def clock(workdir):
+    """A simulated clock, with a simulated robot installed as Myro."""
+    clock = sim.SimClock()
+    sim.install(sim.SimRobot(clock))
+    return clock
+
+
+def run(program, clock, seconds):
+    """Runs the program's main loop for the given number of seconds, and
+    returns the statuses and the mode names at each tick."""
+    statuses, modes = [], []
+    end = clock.time() + seconds
+    while clock.time() < end - 1e-9:
+        status = program.loop()
+        if status:
+            statuses.append(status)
+        modes.append(program.mode_name)
+        clock.advance(TICK)
+    return statuses, modes
+
+
+def test_modes_follow_the_exits(clock):
+    program = Shuttle(clock)
+    program.start()
+    statuses, modes = run(program, clock, 2.3)
+    assert statuses == ["going out", "turning", "going out"]
+    assert modes[0] == 'out'
+    assert 'turn' in modes
+    assert program.turns == 1
+
+
+def test_arguments_are_looked_up_when_the_mode_begins(clock):
+    program = Shuttle(clock)
+    program.params['leg'] = 2.0
+    program.start()
+    _, modes = run(program, clock, 1.9)
+    assert set(modes) == {'out'}
+
+
+def test_branch_returns_to_the_start(clock):
+    program = Shuttle(clock)
+    program.again = False
+    program.start()
+    statuses, _ = run(program, clock, 1.52)
+    assert statuses == ["going out", "turning", "starting"]
+    assert program.finished(statuses[-1])
+
+
+def test_checkpoint_resumes_in_the_same_mode(clock):
+    program = Shuttle(clock)
+    program.start()
+    run(program, clock, 1.2)
+    assert program.mode_name == 'turn'
+    saved = program.checkpoint()
+    run(program, clock, 1.0)
+    program.stop()
+    program.restore(saved)
+    assert program.mode_name == 'turn'
+    program.start()
+    statuses, _ = run(program, clock, 0.5)
+    assert statuses == ["going out"]
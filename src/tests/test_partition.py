@@ -0,0 +1,66 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of splitting a drawing between several robots."""
+
+import pytest
+
+from scribbler import partition
+from scribbler.server import plan_reply
+
+# Tracie's parameters, with drawing units of centimetres.
+PARAMS = partition.tracie_params({'point_scale': 1.0})
+
+
+def robot(points):
+    """Returns a robot for `schedule` that draws a single stroke."""
+    return {'points': points, 'lifts': set()}
+
+
+def test_far_apart_robots_start_together():
+    robots = [robot([(0, 0), (0, 50)]), robot([(100, 0), (100, 50)])]
+    partition.schedule(robots, PARAMS)
+    assert [(r['delay'], r['clear']) for r in robots] == \
+        [(0, True), (0, True)]
+
+
+def test_robot_crossing_the_path_waits():
+    robots = [robot([(0, 0), (0, 200)]), robot([(-60, 100), (60, 100)])]
+    partition.schedule(robots, PARAMS)
+    first, second = robots
+    assert second['clear']
+    assert second['delay'] > 0
+    assert not partition.too_close(first['timeline'], second['timeline'])
+
+
+def test_robot_that_is_never_clear_is_flagged():
+    # The second robot ends next to where the first one ends, so it would
+    # come too close however long it waited.
+    robots = [robot([(0, 0), (0, 100)]), robot([(60, 110), (0, 110)])]
+    partition.schedule(robots, PARAMS)
+    second = robots[1]
+    assert not second['clear']
+    assert second['delay'] == robots[0]['timeline'][-1][0]
+
+
+def test_plan_reports_each_robot():
+    lines = [[(x, 0), (x, 100)] for x in range(0, 400, 40)]
+    robots = partition.plan(lines, 3, {'point_scale': 1.0})
+    assert 1 <= len(robots) <= 3
+    assert robots[0]['offset'] == (0, 0)
+    for r in robots:
+        assert set(r) == {'strokes', 'offset', 'delay', 'time', 'clear'}
+        assert r['time'] >= r['delay'] >= 0
+    drawn = sum(len(s) - 1 for r in robots for s in r['strokes'])
+    assert drawn >= len(lines)
+
+
+def test_plan_reply_warns_about_robots_that_are_not_clear():
+    robots = [
+        {'offset': (0, 0), 'time': 10, 'clear': True},
+        {'offset': (50, 0), 'time': 20, 'clear': False},
+        None
+    ]
+    lines = plan_reply(robots, ["ok", "ok", "cleared"]).split('\n')
+    assert not lines[0].endswith("another robot)")
+    assert lines[1].endswith("(may come close to another robot)")
+    assert lines[2] == "2: idle, nothing to draw: cleared"
@@ -0,0 +1,58 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of dead reckoning from the motor commands."""
+
+import math
+
+import pytest
+
+from scribbler.pose import Pose
+
+
+def test_starts_at_the_origin_facing_up():
+    pose = Pose()
+    assert pose.at(5) == (0, 0, math.pi / 2)
+    assert pose.uncertainty == 0
+
+
+def test_driving_straight():
+    pose = Pose()
+    pose.move(0, 10, 0)
+    x, y, heading = pose.at(2)
+    assert (x, y, heading) == pytest.approx((0, 20, math.pi / 2))
+
+
+def test_rotating_in_place():
+    pose = Pose()
+    pose.move(0, 0, math.pi / 2)
+    x, y, heading = pose.at(1)
+    assert (x, y, heading) == pytest.approx((0, 0, math.pi))
+
+
+def test_arc_returns_after_a_full_turn():
+    pose = Pose()
+    pose.move(0, 10, math.pi)
+    x, y, heading = pose.at(2)
+    assert (x, y) == pytest.approx((0, 0), abs=1e-9)
+    assert heading == pytest.approx(math.pi / 2 + 2 * math.pi)
+    x, _, _ = pose.at(1)
+    assert x == pytest.approx(-20 / math.pi)
+
+
+def test_at_does_not_change_the_pose():
+    pose = Pose()
+    pose.move(0, 10, 0)
+    pose.at(3)
+    assert (pose.x, pose.y, pose.since) == (0, 0, 0)
+
+
+def test_uncertainty_grows_with_motion():
+    pose = Pose()
+    pose.move(0, 10, 0.5)
+    pose.move(2, 10, 0)
+    first = pose.uncertainty
+    pose.move(4, 0, 0)
+    assert 0 < first < pose.uncertainty
+    assert pose.heading_uncertainty > 0
+    pose.move(10, 0, 0)
+    assert pose.at(10) == (pose.x, pose.y, pose.heading)
@@ -0,0 +1,94 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of previewing Tracie's drawings."""
+
+import base64
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from scribbler import partition, preview
+
+# Tracie's parameters, with drawing units of centimetres.
+PARAMS = partition.tracie_params({'point_scale': 1.0, 'min_rotation': 5})
+
+# A square drawn from the origin.
+SQUARE = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]
+
+
+def test_plan_follows_the_points():
+    turns, dists, planned = preview.plan(SQUARE, PARAMS)
+    assert list(dists) == [10] * 4
+    assert turns == pytest.approx([0] + [-np.pi / 2] * 3)
+    assert planned == pytest.approx(np.array(SQUARE, dtype=float), abs=1e-9)
+
+
+def test_plan_skips_small_rotations():
+    points = [(0, 0), (0, 10), (0.5, 20)]
+    turns, _, planned = preview.plan(points, PARAMS)
+    assert list(turns) == [0, 0]
+    # The robot carries on straight, so it misses the point.
+    assert planned[-1] == pytest.approx([0, 20 + 0.5 ** 2 / 20.0], abs=0.01)
+
+
+def test_execute_without_noise_matches_the_plan():
+    turns, dists, planned = preview.plan(SQUARE, PARAMS)
+    executed = preview.execute(turns, dists, PARAMS, noise=0)
+    assert executed == pytest.approx(planned, abs=1e-9)
+
+
+def test_execute_with_a_bad_calibration():
+    turns, dists, planned = preview.plan(SQUARE, PARAMS)
+    executed = preview.execute(turns, dists, PARAMS, noise=0,
+                               dist_to_time=PARAMS['dist_to_time'] / 2)
+    assert executed == pytest.approx(2 * planned, abs=1e-9)
+
+
+def test_execute_is_repeatable_with_a_seed():
+    turns, dists, _ = preview.plan(SQUARE, PARAMS)
+    a = preview.execute(turns, dists, PARAMS, noise=0.1, seed=3)
+    b = preview.execute(turns, dists, PARAMS, noise=0.1, seed=3)
+    assert np.array_equal(a, b)
+
+
+def test_drawn_mask():
+    assert list(preview.drawn_mask(5, [2, 4, 9])) == \
+        [True, False, True, False]
+
+
+def test_svg_preview_and_statistics():
+    result = preview.preview(SQUARE, [2], PARAMS, noise=0)
+    assert result['format'] == 'svg'
+    assert result['image'].startswith('<svg')
+    stats = result['stats']
+    assert (stats['segments'], stats['rotations']) == (4, 3)
+    assert (stats['drawn'], stats['travel']) == (30, 10)
+    assert stats['plan_error']['max'] == pytest.approx(0, abs=1e-9)
+    assert stats['error']['final'] == pytest.approx(0, abs=1e-9)
+
+
+def test_png_preview():
+    result = preview.preview(SQUARE, [], PARAMS, fmt='png', width=100)
+    data = base64.b64decode(result['image'])
+    assert data.startswith(preview.PNG_SIGNATURE)
+    width, height = struct.unpack('>II', data[16:24])
+    assert width == 100 and height > 0
+
+
+@pytest.mark.parametrize('options', [
+    {'fmt': 'gif'},
+    {'width': 5},
+    {'width': preview.MAX_WIDTH + 1},
+    {'noise': -0.1},
+    {'noise': 'nan'},
+])
+def test_bad_options_are_refused(options):
+    with pytest.raises(ValueError):
+        preview.preview(SQUARE, [], PARAMS, **options)
+
+
+def test_needs_two_points():
+    with pytest.raises(ValueError):
+        preview.preview(SQUARE[:1], [], PARAMS)
@@ -0,0 +1,40 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the gevent web server's handling of commands."""
+
+import pytest
+
+pytest.importorskip('gevent')
+
+from scribbler import server
+
+
+def post(controller, data):
+    """Posts the data to the controller through a gevent server, and returns
+    the status and body of the response."""
+    srv = server.Server('127.0.0.1', 0, '.', [], controllers=[controller])
+    statuses = []
+    body = srv.handle_post(controller, data,
+                           lambda status, head: statuses.append(status))
+    return statuses[0], body
+
+
+def test_reply():
+    assert post(lambda command: command.upper(), 'hi') == \
+        (server.STATUS_200, ['HI'])
+
+
+def test_no_reply():
+    assert post(lambda command: None, 'hi')[0] == server.STATUS_204
+
+
+def test_handler_error_replies_500():
+    def broken(command):
+        raise RuntimeError("broken")
+    assert post(broken, 'hi') == (server.STATUS_500, [""])
+
+
+def test_base_server_is_abstract():
+    srv = server.BaseServer('127.0.0.1', 0, '.', [], [])
+    with pytest.raises(NotImplementedError):
+        srv.controller('/all')('short:sync')
@@ -0,0 +1,52 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the status log that clients poll for messages."""
+
+import pytest
+
+pytest.importorskip('gevent')
+
+import gevent
+
+from scribbler.statuslog import StatusLog
+
+
+def test_readers_see_the_same_stream():
+    log = StatusLog()
+    for msg in 'abc':
+        log.put(msg)
+    assert log.read(0) == (['a', 'b', 'c'], 3, 0)
+    assert log.read(1) == (['b', 'c'], 3, 0)
+    log.put('d')
+    assert log.read(3) == (['d'], 4, 0)
+
+
+def test_missed_messages_are_counted():
+    log = StatusLog(capacity=3)
+    for msg in 'abcde':
+        log.put(msg)
+    assert log.oldest == 2
+    assert log.read(0) == (['c', 'd', 'e'], 5, 2)
+
+
+def test_cursor_from_the_future_starts_at_the_oldest():
+    log = StatusLog(capacity=2)
+    for msg in 'abc':
+        log.put(msg)
+    assert log.read(10) == (['b', 'c'], 3, 0)
+
+
+def test_read_times_out_with_the_same_cursor():
+    log = StatusLog()
+    log.put('a')
+    assert log.read(1, timeout=0.01) == ([], 1, 0)
+
+
+def test_new_messages_wake_waiting_readers():
+    log = StatusLog()
+    log.put('old')
+    readers = [gevent.spawn(log.read, None, 1) for _ in range(3)]
+    gevent.sleep(0)
+    log.put('new')
+    gevent.joinall(readers, timeout=1)
+    assert [r.value for r in readers] == [(['new'], 2, 0)] * 3
@@ -0,0 +1,84 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of ordering the strokes of a drawing to shorten the pen travel."""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from scribbler import strokes
+
+
+def segments(*coords):
+    """Returns strokes that are each a segment from (x0, y0) to (x1, y1)."""
+    return [np.array([(x0, y0), (x1, y1)], dtype=float)
+            for x0, y0, x1, y1 in coords]
+
+
+def random_strokes(seed, n=40):
+    """Returns n random open strokes of a few points each."""
+    rng = np.random.RandomState(seed)
+    return [rng.uniform(0, 100, size=(rng.randint(2, 5), 2))
+            for _ in range(n)]
+
+
+def reverse_run(order, i, j):
+    """Returns the order with the run from i to j - 1 drawn backwards."""
+    return order[:i] + [s[::-1] for s in order[i:j][::-1]] + order[j:]
+
+
+def same_strokes(a, b):
+    """Returns true if the orders have the same strokes, in either
+    direction."""
+    key = lambda s: tuple(sorted([tuple(s.ravel()), tuple(s[::-1].ravel())]))
+    return sorted(map(key, a)) == sorted(map(key, b))
+
+
+def test_travel():
+    lines = segments((1, 0, 2, 0), (5, 0, 6, 0))
+    assert strokes.travel(lines) == pytest.approx(4)
+    assert strokes.travel(lines, start=(1, 0)) == pytest.approx(3)
+    assert strokes.travel([]) == 0
+
+
+def test_two_opt_untangles_a_run():
+    lines = segments((1, 0, 2, 0), (5, 0, 6, 0), (3, 0, 4, 0))
+    better = strokes.two_opt(lines)
+    assert strokes.travel(better) == pytest.approx(3)
+    assert same_strokes(better, lines)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_two_opt_reaches_a_local_optimum(seed):
+    tour = strokes.nearest_neighbour(random_strokes(seed))
+    better = strokes.two_opt(tour, time_limit=10)
+    assert same_strokes(better, tour)
+    length = strokes.travel(better)
+    assert length <= strokes.travel(tour) + strokes.EPSILON
+    # No reversal that 2-opt tries would have shortened the travel further.
+    n = len(better)
+    for i in range(n):
+        for j in range(i + 1, min(n, i + strokes.MAX_RUN) + 1):
+            assert strokes.travel(reverse_run(better, i, j)) > \
+                length - 1e-6
+
+
+def test_two_opt_gives_up_at_the_time_limit():
+    tour = strokes.nearest_neighbour(random_strokes(0))
+    same = strokes.two_opt(tour, time_limit=-1)
+    assert all(np.array_equal(a, b) for a, b in zip(same, tour))
+
+
+def test_closed_strokes_start_at_the_nearest_point():
+    square = np.array([(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)],
+                      dtype=float)
+    (stroke,) = strokes.nearest_neighbour([square], start=(9, 9))
+    assert tuple(stroke[0]) == tuple(stroke[-1]) == (10, 10)
+    assert len(stroke) == len(square)
+
+
+def test_order_starts_near_the_start():
+    lines = segments((50, 50, 60, 60), (0, 1, 0, 5))
+    ordered = strokes.order(lines)
+    assert tuple(ordered[0][0]) == (0, 1)
+    assert strokes.order([]) == []
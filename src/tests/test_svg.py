@@ -0,0 +1,107 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the SVG import and its curve flattening."""
+
+import math
+
+import pytest
+
+from scribbler import svg
+
+# The points of a cubic Bezier curve like an arch.
+CURVE = (0.0, 0.0), (0.0, 100.0), (100.0, 100.0), (100.0, 0.0)
+
+
+def document(body):
+    """Wraps elements in an SVG document."""
+    return '<svg xmlns="http://www.w3.org/2000/svg">{}</svg>'.format(body)
+
+
+def test_lines_flip_the_y_axis():
+    strokes = svg.load_svg(document('<path d="M1 2 L3 4 l1 1 H10 v-2"/>'), 1)
+    assert strokes == [[(1, -2), (3, -4), (4, -5), (10, -5), (10, -3)]]
+
+
+def distance_to_segment(p, a, b):
+    """Returns the distance from point p to the segment from a to b."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    t = ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / float(dx * dx + dy * dy)
+    t = min(1, max(0, t))
+    return math.hypot(a[0] + t * dx - p[0], a[1] + t * dy - p[1])
+
+
+@pytest.mark.parametrize('tolerance', [1.0, 0.1, 0.01])
+def test_cubic_stays_within_tolerance(tolerance):
+    p0, p1, p2, p3 = CURVE
+    pts = []
+    svg.flatten_cubic(p0, p1, p2, p3, tolerance, pts)
+    assert pts[-1] == p3
+    line = [p0] + pts
+    for i in range(201):
+        t = i / 200.0
+        x = 300 * t * t * (1 - t) + 100 * t ** 3
+        y = 300 * t * (1 - t) ** 2 + 300 * t * t * (1 - t)
+        near = min(distance_to_segment((x, y), a, b)
+                   for a, b in zip(line, line[1:]))
+        assert near <= tolerance
+
+
+def test_cubic_gets_more_points_when_tighter():
+    p0, p1, p2, p3 = CURVE
+    coarse, fine = [], []
+    svg.flatten_cubic(p0, p1, p2, p3, 1.0, coarse)
+    svg.flatten_cubic(p0, p1, p2, p3, 0.01, fine)
+    assert len(coarse) < len(fine)
+
+
+@pytest.mark.parametrize('sweep, side', [(True, -1), (False, 1)])
+def test_arc_sweep_flag(sweep, side):
+    pts = svg.arc_points((0.0, 0.0), 5, 5, 0, False, sweep, (10.0, 0.0),
+                         0.01)
+    assert pts[-1] == (10, 0)
+    for x, y in pts[:-1]:
+        assert math.hypot(x - 5, y) == pytest.approx(5)
+        assert y * side > 0
+
+
+def test_large_arc_flag():
+    small = svg.arc_points((0, 0), 10, 10, 0, False, True, (10, 0), 0.01)
+    large = svg.arc_points((0, 0), 10, 10, 0, True, True, (10, 0), 0.01)
+    assert len(large) > 3 * len(small)
+
+
+def test_arc_with_zero_radius_is_a_line():
+    assert svg.arc_points((0, 0), 0, 5, 0, False, True, (10, 0), 0.1) == \
+        [(10, 0)]
+
+
+def test_circle_within_tolerance():
+    strokes = svg.load_svg(document('<circle cx="0" cy="0" r="10"/>'), 0.05)
+    (stroke,) = strokes
+    for (x0, y0), (x1, y1) in zip(stroke, stroke[1:]):
+        assert math.hypot(x0, y0) == pytest.approx(10)
+        mid = math.hypot((x0 + x1) / 2, (y0 + y1) / 2)
+        assert 10 - mid <= 0.05 + 1e-9
+
+
+def test_transforms():
+    strokes = svg.load_svg(document(
+        '<g transform="translate(10 0) scale(2)"><line x1="0" y1="0" '
+        'x2="1" y2="1"/></g>'), 1)
+    assert strokes == [[(10, 0), (12, -2)]]
+
+
+@pytest.mark.parametrize('body', [
+    '<path d="M0 0 L1e400 0"/>',
+    '<line x1="0" y1="0" x2="inf" y2="0"/>',
+    '<line x1="0" y1="0" x2="nan" y2="0"/>',
+    '<g transform="scale(1e300)"><path d="M0 0 L1e300 0"/></g>',
+])
+def test_non_finite_numbers_are_refused(body):
+    with pytest.raises(ValueError):
+        svg.load_svg(document(body), 1)
+
+
+def test_tolerance_must_be_positive():
+    with pytest.raises(ValueError):
+        svg.load_svg(document('<circle r="1"/>'), 0)
@@ -0,0 +1,94 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of tracing raster images into strokes."""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from scribbler import vectorize
+
+
+def square_mask(size=8, lo=2, hi=6):
+    """Returns a mask with a filled square covering pixels lo to hi - 1."""
+    mask = np.zeros((size, size), dtype=bool)
+    mask[lo:hi, lo:hi] = True
+    return mask
+
+
+def pgm(mask):
+    """Encodes a mask as a plain PGM image, with the shape in black."""
+    rows = [' '.join('0' if v else '255' for v in row) for row in mask]
+    head = "P2\n# test\n{} {}\n255\n".format(mask.shape[1], mask.shape[0])
+    return (head + '\n'.join(rows) + '\n').encode('ascii')
+
+
+def test_square_has_one_closed_contour():
+    (path,) = vectorize.contours(square_mask())
+    assert tuple(path[0]) == tuple(path[-1])
+    # Every point is on an edge halfway between inside and outside pixels.
+    centre = np.abs(path - 3.5).max(axis=1)
+    assert np.all(centre == 2)
+    # Consecutive points are in the same marching squares cell.
+    steps = np.abs(np.diff(path, axis=0)).max(axis=1)
+    assert np.all((steps > 0) & (steps <= 1))
+    assert len(np.unique(path[:-1], axis=0)) == len(path) - 1
+
+
+def test_hole_is_its_own_contour():
+    mask = square_mask(10, 1, 9)
+    mask[4:6, 4:6] = False
+    paths = vectorize.contours(mask)
+    assert len(paths) == 2
+    extents = sorted(np.abs(p - 4.5).max() for p in paths)
+    assert extents == [1, 4]
+
+
+def test_saddle_joins_diagonal_pixels():
+    mask = np.array([[1, 0], [0, 1]], dtype=bool)
+    assert len(vectorize.contours(mask)) == 1
+
+
+def test_specks_are_dropped_and_busy_images_refused():
+    mask = square_mask(12, 2, 8)
+    mask[10, 10] = True
+    assert len(vectorize.contours(mask)) == 2
+    assert len(vectorize.contours(mask, min_length=8)) == 1
+    with pytest.raises(ValueError):
+        vectorize.contours(mask, max_count=1)
+
+
+def distance_to_path(p, path):
+    """Returns the distance from point p to the nearest segment of a path."""
+    a, b = path[:-1], path[1:]
+    d = b - a
+    t = np.clip(((p - a) * d).sum(axis=1) / (d * d).sum(axis=1), 0, 1)
+    return np.hypot(*(a + t[:, None] * d - p).T).min()
+
+
+@pytest.mark.parametrize('tolerance', [0.1, 0.5, 2.0])
+def test_simplify_stays_within_tolerance(tolerance):
+    mask = square_mask(16, 2, 14)
+    mask[5:11, 2:5] = False
+    (path,) = vectorize.contours(mask)
+    (simple,) = vectorize.simplify([path], tolerance)
+    assert tuple(simple[0]) == tuple(simple[-1])
+    assert len(simple) < len(path)
+    for p in path:
+        assert distance_to_path(p, simple) <= tolerance + 1e-9
+
+
+def test_trace_image_scales_to_the_canvas():
+    strokes = vectorize.trace_image(pgm(square_mask()), size=80)
+    (stroke,) = strokes
+    assert stroke[:, 0].min() == pytest.approx(15)
+    assert stroke[:, 0].max() == pytest.approx(55)
+    # The y-axis points upwards.
+    assert stroke[:, 1].min() == pytest.approx(80 - 55)
+
+
+def test_bad_images_are_refused():
+    with pytest.raises(ValueError):
+        vectorize.load_image(b'P2\n2 x\n255\n0 0 0 0\n')
+    with pytest.raises(ValueError):
+        vectorize.load_image(b'P5\n4000 4000\n255\n')
@@ -0,0 +1,48 @@
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+"""Tests of the shared memory that worker processes publish their state in."""
+
+import pytest
+
+pytest.importorskip('gevent')
+
+from scribbler import worker
+
+
+class FakeController(object):
+
+    """Has the state of a controller whose program can't trace."""
+
+    def __init__(self, program, mode):
+        self.program = self
+        self.values = {
+            'program': program,
+            'mode': mode,
+            'running': True,
+            'can_reset': True,
+            'status_seq': 7,
+            'heading': 1.5
+        }
+
+    def state(self):
+        return self.values
+
+    def trace(self):
+        return None
+
+
+def test_snapshot_has_the_published_state():
+    plane = worker.StatusPlane()
+    plane.publish(FakeController('tracie', 'drawing'))
+    p = plane.snapshot()
+    assert p.version % 2 == 0
+    assert worker.decode_name(p.program) == 'tracie'
+    assert worker.decode_name(p.mode) == 'drawing'
+    assert (p.running, p.status_seq, p.trace_len) == (True, 7, 0)
+
+
+def test_long_names_are_cut():
+    plane = worker.StatusPlane()
+    plane.publish(FakeController('tracie', 'm' * 40))
+    name = worker.decode_name(plane.snapshot().mode)
+    assert name == 'm' * worker.NAME_LEN
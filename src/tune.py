@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright 2014 Mitchell Kember. Subject to the MIT License.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+from scribbler.programs.tracie import parse_points
+from scribbler.tuner import (
+    DEFAULT_OBSTACLE, PROGRAMS, commands, grid, parse_range, sample, tune)
+
+
+# Description for the usage message.
+DESC = "Tunes program parameters on a simulated Scribbler."
+
+# Drawing used to tune Tracie if no other points file is given.
+DEFAULT_POINTS = '../demo/complex.json'
+
+# Configure the arguments.
+parser = argparse.ArgumentParser(description=DESC)
+parser.add_argument(
+    'program',
+    choices=sorted(PROGRAMS),
+    help="the program to tune"
+)
+parser.add_argument(
+    '-p',
+    '--param',
+    action='append',
+    default=[],
+    help="a parameter range, like sd=0.1:0.5:5 or bi=-0.1,0,0.1"
+)
+parser.add_argument(
+    '-r',
+    '--random',
+    type=int,
+    default=0,
+    help="try this many random settings instead of the whole grid"
+)
+parser.add_argument(
+    '-t',
+    '--trials',
+    type=int,
+    default=3,
+    help="run each setting this many times with different noise"
+)
+parser.add_argument(
+    '-n',
+    '--noise',
+    type=float,
+    default=0.02,
+    help="relative standard deviation of the simulated motor noise"
+)
+parser.add_argument(
+    '--dtt',
+    type=float,
+    default=None,
+    help="the simulated robot's true dist_to_time factor"
+)
+parser.add_argument(
+    '--att',
+    type=float,
+    default=None,
+    help="the simulated robot's true angle_to_time factor"
+)
+parser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=None,
+    help="use this many processes (defaults to the number of CPUs)"
+)
+parser.add_argument(
+    '-k',
+    '--top',
+    type=int,
+    default=5,
+    help="show this many of the best settings"
+)
+parser.add_argument(
+    '--points',
+    type=str,
+    default=DEFAULT_POINTS,
+    help="the drawing to tune Tracie with (saved from the drawing view)"
+)
+
+# Parse the command-line arguments, making the paths in them absolute before
+# changing directory.
+args = parser.parse_args()
+if args.points != DEFAULT_POINTS:
+    args.points = os.path.abspath(args.points)
+
+# Go to this directory to make the relative paths work.
+script_dir = os.path.dirname(sys.argv[0])
+if script_dir:
+    os.chdir(script_dir)
+ranges = dict(parse_range(spec) for spec in args.param)
+codes = PROGRAMS[args.program]().codes
+for code in ranges:
+    if code not in codes:
+        sys.exit("error: invalid code for {}: {}".format(args.program, code))
+
+# Set up the simulated course.
+scenario = {
+    'noise': args.noise,
+    'dist_to_time': args.dtt,
+    'angle_to_time': args.att
+}
+if args.program == 'tracie':
+    with open(args.points) as f:
+        scenario['points'] = parse_points(json.load(f))
+else:
+    scenario['obstacles'] = [DEFAULT_OBSTACLE]
+
+# Search the parameter space.
+if args.random:
+    candidates = sample(ranges, args.random)
+else:
+    candidates = grid(ranges)
+print("Trying {} settings...".format(len(candidates)))
+results = tune(args.program, candidates, scenario, args.trials, args.jobs)
+
+# Report the best settings.
+for r in results[:args.top]:
+    print("score {:.1f}: {:.1f} s, {:.2f} cm error".format(
+        r['score'], r['time'], r['error']))
+    for command in commands(r['settings']):
+        print("    " + command)